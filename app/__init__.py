@@ -47,11 +47,12 @@ class MyAdminIndexView(flask_admin.AdminIndexView):
         return super(MyAdminIndexView, self).index()
 # admin panels
 
-from app.models import User, Company, Match, Rating
+from app.models import User, Company, Match, Rating, MatchRating
 admin = Admin(app, index_view=MyAdminIndexView())
 admin.add_view(MoneyballModelView(User, db.session))
 admin.add_view(MoneyballModelView(Company, db.session))
 admin.add_view(MoneyballModelView(Match, db.session))
+admin.add_view(MoneyballModelView(MatchRating, db.session))
 admin.add_view(MoneyballModelView(Rating, db.session))
 
 if app.config['LOG_TO_STDOUT']:
@@ -69,4 +70,4 @@ else:
     file_handler.setLevel(logging.INFO)
     app.logger.addHandler(file_handler)
 
-from app import routes, models
\ No newline at end of file
+from app import routes, models, cli
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+Small cache with versioned namespaces.
+
+Cached values are stored under keys that include a namespace version, e.g.
+the ratings version. Bumping the version makes every old entry unreachable,
+so there is no need to find and delete them.
+
+Two backends are available, selected with the `CACHE_BACKEND` config:
+
+- `sqlite` (default): cache stored in a SQLite file at `CACHE_PATH`,
+  shared by every process on the machine, e.g. all gunicorn workers.
+- `memory`: LRU cache local to the process. Versions are local too, so a
+  bump in one process leaves the others serving stale entries; only for a
+  single process.
+
+Rendered plots are large, so they have their own in-process cache bounded
+by bytes, see `get_plot_cache`.
+"""
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import current_app
+
+
+class LRUCache(object):
+    """
+    In-process cache holding at most `maxsize` entries, and with `maxbytes`
+    at most that many bytes of values. Sizes are measured with
+    `sys.getsizeof`, so bound bytes only for flat values like strings.
+    """
+    def __init__(self, maxsize=1024, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.versions = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.nbytes -= self.sizes.get(key, 0)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.sizes[key] = sys.getsizeof(value)
+            self.nbytes += self.sizes[key]
+            while len(self.entries) > self.maxsize or (
+                    self.maxbytes is not None and self.nbytes > self.maxbytes):
+                old_key, _ = self.entries.popitem(last=False)
+                self.nbytes -= self.sizes.pop(old_key)
+
+    def get_version(self, namespace):
+        with self.lock:
+            return self.versions[namespace]
+
+    def bump_version(self, namespace):
+        with self.lock:
+            self.versions[namespace] += 1
+            return self.versions[namespace]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        stats = dict(hits=self.hits, misses=self.misses, size=len(self))
+        if self.maxbytes is not None:
+            stats['bytes'] = self.nbytes
+        return stats
+
+
+class SQLiteCache(object):
+    """
+    Cache stored in a SQLite file, so all processes see the same entries
+    and versions. Holds at most `maxsize` entries, evicting the least
+    recently used. Hit and miss counters are per process.
+    """
+    def __init__(self, path, maxsize=1024):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entry '
+                '(key TEXT PRIMARY KEY, value BLOB, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_accessed '
+                'ON cache_entry (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_version '
+                '(namespace TEXT PRIMARY KEY, version INTEGER)')
+
+    @contextmanager
+    def _connect(self):
+        # A new connection per call keeps the cache safe to use from any
+        # thread or process
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key, default=None):
+        key = repr(key)
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM cache_entry WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            conn.execute('UPDATE cache_entry SET accessed = ? WHERE key = ?',
+                (time.time(), key))
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache_entry '
+                '(key, value, accessed) VALUES (?, ?, ?)',
+                (repr(key), pickle.dumps(value), time.time()))
+            conn.execute('DELETE FROM cache_entry WHERE key IN ('
+                'SELECT key FROM cache_entry ORDER BY accessed DESC '
+                'LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def get_version(self, namespace):
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT version FROM cache_version WHERE namespace = ?',
+                (namespace,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def bump_version(self, namespace):
+        with self._connect() as conn:
+            conn.execute('INSERT OR IGNORE INTO cache_version '
+                '(namespace, version) VALUES (?, 0)', (namespace,))
+            conn.execute('UPDATE cache_version SET version = version + 1 '
+                'WHERE namespace = ?', (namespace,))
+            row = conn.execute(
+                'SELECT version FROM cache_version WHERE namespace = ?',
+                (namespace,)).fetchone()
+        return row[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache_entry')
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self))
+
+
+def get_cache():
+    """
+    Cache of the current app, created on first use from the app config
+    """
+    cache = current_app.extensions.get('moneyball_cache')
+    if cache is None:
+        backend = current_app.config['CACHE_BACKEND']
+        size = current_app.config['CACHE_SIZE']
+        if backend == 'memory':
+            cache = LRUCache(maxsize=size)
+        elif backend == 'sqlite':
+            cache = SQLiteCache(current_app.config['CACHE_PATH'], maxsize=size)
+        else:
+            raise AssertionError(f'wrong cache backend: {backend}')
+        current_app.extensions['moneyball_cache'] = cache
+    return cache
+
+
+def get_plot_cache():
+    """
+    In-process cache of rendered plots of the current app, bounded by
+    `PLOT_CACHE_BYTES`
+    """
+    cache = current_app.extensions.get('moneyball_plot_cache')
+    if cache is None:
+        cache = LRUCache(maxsize=current_app.config['CACHE_SIZE'],
+            maxbytes=current_app.config['PLOT_CACHE_BYTES'])
+        current_app.extensions['moneyball_plot_cache'] = cache
+    return cache
+
+
+def hit_rate(stats):
+    lookups = stats['hits'] + stats['misses']
+    return stats['hits'] / lookups if lookups else None
+
+
+def bump_ratings_version():
+    """
+    Invalidate everything cached from ratings, e.g. the leaderboard
+    """
+    return get_cache().bump_version('ratings')
+
+
+def bump_players_version():
+    """
+    Invalidate cached lists of players, e.g. the player choices of forms
+    """
+    return get_cache().bump_version('players')
@@ -0,0 +1,161 @@
+"""
+Daily and weekly open/high/low/close candles of every players ratings.
+
+Candles are kept in the `rating_candle` table, so plotting a players
+history reads one row per bucket instead of every rating. New ratings are
+merged into their candles as they are written, and recalculations rebuild
+the candles from the first bucket they changed.
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from app import db
+from app.models import RatingCandle, rating_rows
+
+Interval = namedtuple('Interval', ['freq', 'start', 'label'])
+
+
+def _day(timestamp):
+    return datetime.combine(timestamp.date(), time())
+
+
+def _week_start(timestamp):
+    return _day(timestamp) - timedelta(days=timestamp.weekday())
+
+
+def _week_label(timestamp):
+    # pandas labels a week by the Sunday ending it
+    return _week_start(timestamp) + timedelta(days=6)
+
+
+# By `resample_interval` of `plots.plot_ratings`. `freq` is the pandas
+# frequency of the buckets, `start` and `label` give the first moment and
+# the label of the bucket holding a timestamp.
+INTERVALS = {
+    'D': Interval(freq='D', start=_day, label=_day),
+    'W': Interval(freq='W-SUN', start=_week_start, label=_week_label),
+}
+
+
+def _candle(value, timestamp):
+    return dict(open=value, high=value, low=value, close=value,
+        open_timestamp=timestamp, close_timestamp=timestamp, number_ratings=1)
+
+
+def _combine(a, b):
+    """
+    Candle of the ratings of two candles in the same bucket. Of ratings
+    with the same timestamp, the ones in `b` are taken to be the latest.
+    """
+    first = b if b['open_timestamp'] < a['open_timestamp'] else a
+    last = b if b['close_timestamp'] >= a['close_timestamp'] else a
+    return dict(
+        open=first['open'],
+        high=max(a['high'], b['high']),
+        low=min(a['low'], b['low']),
+        close=last['close'],
+        open_timestamp=first['open_timestamp'],
+        close_timestamp=last['close_timestamp'],
+        number_ratings=a['number_ratings'] + b['number_ratings'],
+    )
+
+
+def _fold(rows, after_time=None):
+    """
+    Candles of ratings given as (user_id, rating_type, value, timestamp) in
+    the order they were written, by (user_id, rating_type, interval,
+    bucket). With `after_time`, only buckets from the one holding
+    `after_time` are made.
+    """
+    candles = {}
+    for user_id, rating_type, value, timestamp in rows:
+        for name, interval in INTERVALS.items():
+            if after_time is not None and timestamp < interval.start(after_time):
+                continue
+            key = (user_id, rating_type, name, interval.label(timestamp))
+            candle = _candle(value, timestamp)
+            if key in candles:
+                candle = _combine(candles[key], candle)
+            candles[key] = candle
+    return candles
+
+
+def _row(key, candle):
+    user_id, rating_type, interval, bucket = key
+    return dict(candle, user_id=user_id, rating_type=rating_type,
+        interval=interval, bucket=bucket)
+
+
+def update_candles(ratings):
+    """
+    Merge new ratings, given as dicts like `Rating` rows, into their
+    candles. Committing is left to the caller.
+    """
+    new_candles = _fold(
+        (r['user_id'], r['rating_type'], r['rating_value'], r['timestamp'])
+        for r in ratings)
+    if not new_candles:
+        return
+    existing = RatingCandle.query \
+        .filter(RatingCandle.user_id.in_({k[0] for k in new_candles})) \
+        .filter(RatingCandle.bucket.in_({k[3] for k in new_candles}))
+    existing = {(c.user_id, c.rating_type, c.interval, c.bucket): c
+        for c in existing}
+    for key, candle in new_candles.items():
+        current = existing.get(key)
+        if current is None:
+            db.session.add(RatingCandle(**_row(key, candle)))
+            continue
+        merged = _combine({field: getattr(current, field) for field in candle},
+            candle)
+        for field, value in merged.items():
+            setattr(current, field, value)
+
+
+def rebuild_candles(after_time=None, user_ids=None):
+    """
+    Rebuild the candles of every user (or only `user_ids`) from the bucket
+    holding `after_time`, reading the ratings in one pass. Committing is
+    left to the caller.
+    """
+    stored = rating_rows()
+    ratings = db.session.query(
+            stored.c.user_id,
+            stored.c.rating_type,
+            stored.c.rating_value,
+            stored.c.timestamp) \
+        .filter(stored.c.user_id.isnot(None)) \
+        .filter(stored.c.rating_type.isnot(None))
+    for name, interval in INTERVALS.items():
+        candles = RatingCandle.query.filter(RatingCandle.interval == name)
+        if after_time is not None:
+            candles = candles.filter(
+                RatingCandle.bucket >= interval.label(after_time))
+        if user_ids is not None:
+            candles = candles.filter(RatingCandle.user_id.in_(list(user_ids)))
+        candles.delete(synchronize_session='fetch')
+    if after_time is not None:
+        ratings = ratings.filter(stored.c.timestamp >= min(
+            interval.start(after_time) for interval in INTERVALS.values()))
+    if user_ids is not None:
+        ratings = ratings.filter(stored.c.user_id.in_(list(user_ids)))
+    ratings = ratings.order_by(stored.c.timestamp, stored.c.id) \
+        .yield_per(1000)
+
+    rows = [_row(key, candle)
+        for key, candle in _fold(ratings, after_time).items()]
+    if rows:
+        db.session.bulk_insert_mappings(RatingCandle, rows)
+    return len(rows)
+
+
+def get_candles(user_id, rating_type, interval):
+    """
+    Candles of a users ratings, ordered by bucket. Buckets without ratings
+    are left out.
+    """
+    return RatingCandle.query \
+        .filter_by(user_id=user_id, rating_type=rating_type,
+            interval=interval) \
+        .order_by(RatingCandle.bucket) \
+        .all()
@@ -0,0 +1,122 @@
+"""
+Periodic snapshots of every players ratings.
+
+A checkpoint at time C holds the state computed from all ratings older than
+C. Recalculating from time T restores the latest checkpoint at or before T
+and only folds in the ratings between the checkpoint and T, instead of
+reading the whole rating history. Checkpoints after T are invalid as soon as
+ratings from T are rewritten.
+"""
+from flask import current_app
+
+from app import db
+from app.models import RatingCheckpoint, CheckpointRating, rating_rows
+from app.replay import ReplayEngine
+
+
+def invalidate_checkpoints(after_time):
+    """
+    Delete checkpoints depending on ratings from `after_time`
+    """
+    checkpoints = RatingCheckpoint.query \
+        .filter(RatingCheckpoint.timestamp > after_time)
+    checkpoint_ids = [c.id for c in checkpoints]
+    if checkpoint_ids:
+        CheckpointRating.query \
+            .filter(CheckpointRating.checkpoint_id.in_(checkpoint_ids)) \
+            .delete(synchronize_session='fetch')
+        RatingCheckpoint.query \
+            .filter(RatingCheckpoint.id.in_(checkpoint_ids)) \
+            .delete(synchronize_session='fetch')
+
+
+def latest_checkpoint(before=None):
+    checkpoints = RatingCheckpoint.query
+    if before is not None:
+        checkpoints = checkpoints.filter(RatingCheckpoint.timestamp <= before)
+    return checkpoints.order_by(RatingCheckpoint.timestamp.desc()).first()
+
+
+def _ratings_between(after=None, before=None):
+    stored = rating_rows()
+    ratings = db.session.query(
+            stored.c.user_id,
+            stored.c.rating_type,
+            stored.c.rating_value,
+            stored.c.timestamp,
+            stored.c.match_id) \
+        .filter(stored.c.user_id != None)
+    if after is not None:
+        ratings = ratings.filter(stored.c.timestamp >= after)
+    if before is not None:
+        ratings = ratings.filter(stored.c.timestamp < before)
+    return ratings.order_by(stored.c.timestamp, stored.c.id).yield_per(1000)
+
+
+def restore_state(engine, before):
+    """
+    Load the state from all ratings older than `before` into a
+    `replay.ReplayEngine`, starting from the latest checkpoint.
+    """
+    checkpoint = latest_checkpoint(before)
+    if checkpoint is None:
+        engine.load_state(before=before)
+        return
+    engine.load_current_ratings(checkpoint.ratings)
+    for user_id, rating_type, value, timestamp, match_id in _ratings_between(
+            after=checkpoint.timestamp, before=before):
+        engine.states[user_id].set(rating_type, value, timestamp, match_id)
+
+
+def save_checkpoint(engine, timestamp):
+    checkpoint = RatingCheckpoint(timestamp=timestamp)
+    db.session.add(checkpoint)
+    db.session.flush()
+    rows = engine.current_ratings()
+    for row in rows:
+        row['checkpoint_id'] = checkpoint.id
+    db.session.bulk_insert_mappings(CheckpointRating, rows)
+    return checkpoint
+
+
+def update_checkpoints(spacing=None):
+    """
+    Add checkpoints every `spacing` approved matches after the latest one.
+    Committing is left to the caller.
+    """
+    if spacing is None:
+        spacing = current_app.config['RATING_CHECKPOINT_SPACING']
+
+    engine = ReplayEngine()
+    checkpoint = latest_checkpoint()
+    after = None
+    if checkpoint is not None:
+        engine.load_current_ratings(checkpoint.ratings)
+        after = checkpoint.timestamp
+
+    checkpoints = []
+    matches_since = 0
+    previous = (None, None)
+    for user_id, rating_type, value, timestamp, match_id in _ratings_between(
+            after=after):
+        previous_timestamp, previous_match_id = previous
+        # Every rating older than `timestamp` is in the state here
+        if matches_since >= spacing and timestamp != previous_timestamp:
+            checkpoints.append(save_checkpoint(engine, timestamp))
+            matches_since = 0
+        if match_id is not None and match_id != previous_match_id:
+            matches_since += 1
+        engine.states[user_id].set(rating_type, value, timestamp, match_id)
+        previous = (timestamp, match_id)
+    return checkpoints
+
+
+def rebuild_checkpoints(spacing=None):
+    """
+    Replace all checkpoints, and commit them
+    """
+    CheckpointRating.query.delete()
+    RatingCheckpoint.query.delete()
+    checkpoints = update_checkpoints(spacing)
+    db.session.commit()
+    return checkpoints
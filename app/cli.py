@@ -0,0 +1,100 @@
+"""
+Flask CLI commands, run with `flask <group> <command>`
+"""
+import click
+
+from app import app, db, tasks
+from app.candles import rebuild_candles
+from app.imports import (BATCH_SIZE, read_rows, format_from_filename,
+    import_matches)
+from app.exports import TABLES, FORMATS, export
+from app.checkpoints import rebuild_checkpoints
+from app.jobs import run_pending_jobs
+
+
+@app.cli.group()
+def checkpoints():
+    """Rating checkpoint commands."""
+
+
+@checkpoints.command()
+@click.option('--spacing', type=int, default=None,
+    help='Number of approved matches between checkpoints.')
+def rebuild(spacing):
+    """Rebuild all rating checkpoints."""
+    new_checkpoints = rebuild_checkpoints(spacing)
+    click.echo(f'Created {len(new_checkpoints)} rating checkpoints')
+
+
+@app.cli.group()
+def jobs():
+    """Rating recalculation job commands."""
+
+
+@jobs.command()
+def run():
+    """Run all queued rating recalculations."""
+    finished = run_pending_jobs()
+    for job in finished:
+        click.echo(f'Job {job.id}: {job.status}')
+    click.echo(f'Ran {len(finished)} rating recalculation jobs')
+
+
+@app.cli.group()
+def candles():
+    """Rating candle commands."""
+
+
+@candles.command('rebuild')
+def rebuild_all_candles():
+    """Rebuild the daily and weekly candles of all ratings."""
+    n_candles = rebuild_candles()
+    db.session.commit()
+    click.echo(f'Created {n_candles} rating candles')
+
+
+@app.cli.command('import-matches')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+    default=None, help='Format of the file, by default from its extension.')
+@click.option('--batch-size', type=int, default=BATCH_SIZE,
+    help='Number of rows validated and inserted at a time.')
+@click.option('--recalculate/--no-recalculate', default=True,
+    help='Recalculate ratings from the first imported match afterwards.')
+def import_matches_command(file, file_format, batch_size, recalculate):
+    """Import historical matches from a CSV or JSONL file."""
+    if file_format is None:
+        file_format = format_from_filename(file.name)
+    result = import_matches(read_rows(file, file_format),
+        batch_size=batch_size)
+    for line_number, error in result.errors:
+        click.echo(f'Line {line_number}: {error}', err=True)
+    click.echo(f'Imported {result.imported} matches, '
+        f'skipped {len(result.errors)} rows')
+    if result.after_time is not None:
+        if recalculate:
+            tasks.recalculate_ratings(after_time=result.after_time)
+            click.echo(f'Recalculated ratings from {result.after_time}')
+        else:
+            click.echo('Recalculate ratings from '
+                f'{result.after_time} to rate the imported matches')
+
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.option('--format', 'file_format', type=click.Choice(FORMATS),
+    default='csv')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+    help='File to write to, by default standard output.')
+@click.option('--company-id', type=int, default=None)
+@click.option('--after', type=click.DateTime(), default=None,
+    help='Only rows from this time.')
+@click.option('--before', type=click.DateTime(), default=None,
+    help='Only rows older than this time.')
+@click.option('--rating-type', default=None, help='Only ratings of this type.')
+def export_command(table, file_format, output, company_id, after, before,
+        rating_type):
+    """Export matches, user_matches or ratings as CSV or JSONL."""
+    for chunk in export(table, file_format, company_id=company_id,
+            after=after, before=before, rating_type=rating_type):
+        output.write(chunk)
@@ -0,0 +1,154 @@
+"""
+Streaming exports of matches, match players and ratings as CSV or JSONL.
+
+Rows are read with a server-side cursor where the database supports one
+and written out as they arrive, so memory use stays flat however large the
+table. Used by the `/export/<table>.<format>` endpoint and `flask export`.
+"""
+import csv
+from datetime import datetime
+import io
+import json
+
+from sqlalchemy import select
+
+from app import db
+from app.models import User, Match, UserMatch, rating_rows
+
+FORMATS = ('csv', 'jsonl')
+# Rows fetched from the cursor at a time
+CHUNK_SIZE = 1000
+
+
+def _matches_of_company(company_id):
+    return select(UserMatch.match_id) \
+        .join(User, User.id == UserMatch.user_id) \
+        .where(User.company_id == company_id)
+
+
+def _matches(company_id, rating_type):
+    query = select(
+            Match.id,
+            Match.timestamp,
+            Match.winner_score,
+            Match.loser_score,
+            Match.importance,
+            Match.approved_winner,
+            Match.approved_loser) \
+        .order_by(Match.timestamp, Match.id)
+    if company_id is not None:
+        query = query.where(Match.id.in_(_matches_of_company(company_id)))
+    return query, Match.timestamp
+
+
+def _user_matches(company_id, rating_type):
+    query = select(
+            UserMatch.match_id,
+            UserMatch.user_id,
+            User.shortname,
+            UserMatch.win,
+            Match.timestamp) \
+        .join(Match, Match.id == UserMatch.match_id) \
+        .join(User, User.id == UserMatch.user_id) \
+        .order_by(Match.timestamp, UserMatch.match_id, UserMatch.user_id)
+    if company_id is not None:
+        query = query.where(User.company_id == company_id)
+    return query, Match.timestamp
+
+
+def _ratings(company_id, rating_type):
+    stored = rating_rows(None if rating_type is None else [rating_type])
+    query = select(
+            stored.c.id,
+            stored.c.user_id,
+            User.shortname,
+            stored.c.match_id,
+            stored.c.rating_type,
+            stored.c.rating_value,
+            stored.c.timestamp) \
+        .join(User, User.id == stored.c.user_id) \
+        .order_by(stored.c.timestamp, stored.c.id)
+    if company_id is not None:
+        query = query.where(User.company_id == company_id)
+    return query, stored.c.timestamp
+
+
+# Queries of the exported tables, with the column the date range filters
+TABLES = {
+    'matches': _matches,
+    'user_matches': _user_matches,
+    'ratings': _ratings,
+}
+
+
+def export_rows(table, company_id=None, after=None, before=None,
+        rating_type=None):
+    """
+    Column names and a generator of the rows of an exported table, from
+    `after` and older than `before` if given. `rating_type` only filters
+    ratings.
+    """
+    query, timestamp = TABLES[table](company_id, rating_type)
+    if after is not None:
+        query = query.where(timestamp >= after)
+    if before is not None:
+        query = query.where(timestamp < before)
+    columns = [column.name for column in query.selected_columns]
+
+    def rows():
+        result = db.session.connection() \
+            .execution_options(stream_results=True) \
+            .execute(query)
+        for partition in result.partitions(CHUNK_SIZE):
+            yield from partition
+
+    return columns, rows()
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def format_csv(columns, rows):
+    """
+    Chunks of CSV text, with a header, of about `CHUNK_SIZE` rows each
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_value(value) for value in row])
+        if i % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def format_jsonl(columns, rows):
+    """
+    Chunks of lines of JSON objects, one per row, of `CHUNK_SIZE` rows each
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({column: _value(value)
+            for column, value in zip(columns, row)}) + '\n')
+        if len(lines) == CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def export(table, format, **filters):
+    """
+    Chunks of text of a table exported as `format`, see `export_rows` for
+    the filters
+    """
+    columns, rows = export_rows(table, **filters)
+    if format == 'csv':
+        return format_csv(columns, rows)
+    if format == 'jsonl':
+        return format_jsonl(columns, rows)
+    raise AssertionError(f'wrong export format: {format}')
@@ -1,33 +1,22 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectMultipleField, IntegerField, SelectField, DateField
 from wtforms.ext.sqlalchemy.fields import QuerySelectMultipleField, QuerySelectField
 from wtforms.validators import DataRequired, ValidationError, EqualTo, Optional
 from wtforms.ext.dateutil.fields import DateTimeField
 from app.models import User, Company
+from app.ratings import rating_type_choices, rating_field_choices
+from app.players import recent_players
 from datetime import datetime
 from dateutil.tz import gettz
-from flask_login import current_user
+from flask import current_app
 tz = gettz('Europe/Copenhagen')
 
 def get_companies():
     return Company.query.all()
 
-def get_players_from_company():
-    players = User.query.filter_by(company_id=current_user.company_id).all()
-    return sorted_users(players)
-
 def get_players():
-    players = User.query.all()
-    return sorted_users(players)
-
-def sorted_users(users):
-    return sorted(
-        [u for u in users],
-        key=lambda x: (
-            x.get_recent_match_timestamp(),
-            x.shortname),
-        reverse=True
-        ) 
+    return recent_players()
 class LoginForm(FlaskForm):
     shortname = StringField('Shortname', validators=[DataRequired()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -62,13 +51,7 @@ def my_check_scores(form, field):
         raise ValidationError('Winning score must be greater than losing score')
 
 def sort_players():
-    return sorted(
-        [u for u in User.query.all()],
-        key=lambda x: (
-            x.get_recent_match_timestamp(),
-            x.shortname),
-        reverse=True
-        )
+    return recent_players()
 
 def copenhagen_now():
     return datetime.now()
@@ -128,12 +111,7 @@ class EditPasswordForm(FlaskForm):
 
 class ChooseLeaderboardSorting(FlaskForm):
     sorting = SelectField('Sorting',
-        choices=[
-            ('elo', 'Elo'),
-            ('trueskill', 'Trueskill'),
-            ('goal_difference', 'Goal difference'),
-            ('matches_played', 'Matches Played'),
-            ],
+        choices=rating_type_choices(),
         default='elo')
     submit = SubmitField('Submit')
 
@@ -145,12 +123,7 @@ class ChooseBestMatchupForm(FlaskForm):
         id='selectpicker_best',
           )
     rating_type = SelectField('Rating to use',
-        choices=[
-            ('elo', 'Elo'),
-            ('trueskill', 'Trueskill'),
-            ('goal_difference', 'Goal difference'),
-            ('matches_played', 'Matches Played'),
-            ],
+        choices=rating_type_choices(),
         default='elo')
     submit = SubmitField('Submit')
 class SelectPlotResampleForm(FlaskForm):
@@ -163,10 +136,38 @@ class SelectPlotResampleForm(FlaskForm):
         id='selectpicker_resample')
     submit = SubmitField('Submit')
 
+class CompareRatingsForm(FlaskForm):
+    players = QuerySelectMultipleField(
+        'Players',
+        validators=[DataRequired()],
+        query_factory = sort_players,
+        id='selectpicker_compare',
+          )
+    rating_type = SelectField('Rating',
+        choices=rating_field_choices(),
+        default='elo')
+    resample_interval = SelectField('Plotting Interval',
+        choices=[
+            ('D', 'Daily'),
+            ('W', 'Weekly')
+        ],
+        default='D')
+    submit = SubmitField('Submit')
+
+    def validate_players(self, players):
+        max_users = current_app.config['RATING_COMPARISON_MAX_USERS']
+        if len(players.data) > max_users:
+            raise ValidationError(f'Select at most {max_users} players')
+
 class CreateCompanyForm(FlaskForm):
     name = StringField('Company Name', validators=[DataRequired()])
     submit = SubmitField('Submit')
 
+class ImportMatchesForm(FlaskForm):
+    file = FileField('Matches (CSV or JSONL)', validators=[FileRequired(),
+        FileAllowed(['csv', 'jsonl', 'json', 'ndjson'], 'CSV or JSONL only')])
+    submit = SubmitField('Import')
+
 class RecalculateRatingsForm(FlaskForm):
     timestamp = DateTimeField("Recalculate from:", default=copenhagen_now,
         id='datepick')
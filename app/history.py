@@ -0,0 +1,163 @@
+"""
+Columnar loading of rating histories.
+
+Ratings are read with one SELECT of scalar columns, skipping ORM objects,
+and returned as NumPy arrays per user and rating type.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, type_coerce
+
+from app import db
+from app.models import rating_rows
+
+# Arrays of equal length, ordered by time. `match_id` is NaN for ratings
+# not given by a match, e.g. the initial ratings.
+RatingHistory = namedtuple('RatingHistory', ['timestamp', 'value', 'match_id'])
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _datetime64(timestamps):
+    if timestamps and isinstance(timestamps[0], str):
+        # SQLite stores timestamps as ISO text, which NumPy parses itself
+        return np.array(timestamps, dtype='datetime64[us]')
+    # Much faster than letting NumPy convert each datetime object
+    return np.fromiter(((t - _EPOCH) // _MICROSECOND for t in timestamps),
+        dtype=np.int64, count=len(timestamps)).view('datetime64[us]')
+
+
+def _empty_history():
+    return RatingHistory(
+        timestamp=np.array([], dtype='datetime64[us]'),
+        value=np.array([], dtype=np.float64),
+        match_id=np.array([], dtype=np.float64),
+    )
+
+
+def load_rating_history(user_ids, rating_types, after=None, before=None):
+    """
+    Ratings of `user_ids` of the given `rating_types`, from `after` and
+    older than `before` if given.
+
+    Returns a `RatingHistory` by (user_id, rating_type) for every requested
+    pair, empty for pairs without ratings.
+    """
+    user_ids, rating_types = list(user_ids), list(rating_types)
+    stored = rating_rows(rating_types)
+    query = db.session.query(
+            stored.c.user_id,
+            stored.c.rating_type,
+            # Skip converting every timestamp to a datetime object
+            type_coerce(stored.c.timestamp, db.String),
+            stored.c.rating_value,
+            stored.c.match_id) \
+        .filter(stored.c.user_id.in_(user_ids))
+    if after is not None:
+        query = query.filter(stored.c.timestamp >= after)
+    if before is not None:
+        query = query.filter(stored.c.timestamp < before)
+    query = query.order_by(stored.c.user_id, stored.c.rating_type,
+        stored.c.timestamp, stored.c.id)
+    # Plain rows from the connection, without the ORM loading machinery
+    rows = db.session.connection().execute(query.statement).fetchall()
+
+    histories = {(u, t): _empty_history()
+        for u in user_ids for t in rating_types}
+    if not rows:
+        return histories
+    users, types, timestamps, values, match_ids = zip(*rows)
+    timestamps = _datetime64(timestamps)
+    values = np.array(values, dtype=np.float64)
+    # None becomes NaN
+    match_ids = np.array(match_ids, dtype=np.float64)
+
+    # Rows are grouped by user and rating type
+    users, types = np.array(users), np.array(types, dtype=object)
+    changes = (users[1:] != users[:-1]) | (types[1:] != types[:-1])
+    starts = [0] + (np.flatnonzero(changes) + 1).tolist()
+    for start, end in zip(starts, starts[1:] + [len(rows)]):
+        histories[(users[start].item(), types[start])] = RatingHistory(
+            timestamp=timestamps[start:end],
+            value=values[start:end],
+            match_id=match_ids[start:end],
+        )
+    return histories
+
+
+def lttb_indices(x, y, n_points):
+    """
+    Indices of at most `n_points` points keeping the shape of the series,
+    with Largest-Triangle-Three-Buckets downsampling. The first and last
+    points are always kept.
+    """
+    n = len(x)
+    if n <= n_points or n_points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Points between the first and last, split in `n_points - 2` buckets
+    edges = np.linspace(1, n - 1, n_points - 1).astype(np.int64)
+    indices = np.empty(n_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket, or the last point
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        # Keep the point making the largest triangle with the previous
+        # point kept and the next average
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def latest_rating(user_id, rating_type):
+    """
+    (id, timestamp, count) of a users ratings of one type, where `id` and
+    `timestamp` are the highest. Identifies the version of the history,
+    e.g. for HTTP caching.
+    """
+    stored = rating_rows([rating_type])
+    return db.session.query(
+            func.max(stored.c.id),
+            func.max(stored.c.timestamp),
+            func.count(stored.c.id)) \
+        .filter(stored.c.user_id == user_id) \
+        .one()
+
+
+def rating_series(user_id, rating_type, after=None, before=None,
+        n_points=None):
+    """
+    JSON-friendly rating history, downsampled to at most `n_points` points.
+    Times are ISO strings of the stored Copenhagen time, without an offset,
+    which charts show as they are.
+    """
+    history = load_rating_history([user_id], [rating_type], after=after,
+        before=before)[(user_id, rating_type)]
+    time = history.timestamp.astype('datetime64[ms]')
+    indices = np.arange(len(time))
+    if n_points is not None:
+        indices = lttb_indices(time.astype(np.int64), history.value,
+            n_points)
+    return dict(
+        user_id=user_id,
+        rating_type=rating_type,
+        total=len(time),
+        time=np.datetime_as_string(time[indices], unit='ms').tolist(),
+        value=history.value[indices].tolist(),
+        match_id=[None if np.isnan(m) else int(m)
+            for m in history.match_id[indices].tolist()],
+    )
@@ -0,0 +1,255 @@
+"""
+Bulk import of historical matches from CSV or JSONL.
+
+Every row is a match with the columns
+
+- `winners`, `losers`: shortnames of the players, separated by spaces,
+  commas or semicolons in CSV and lists or strings in JSONL.
+- `winner_score`, `loser_score`: the score.
+- `importance`: 8, 16 or 32, 16 if left out.
+- `timestamp`: ISO time the match was played.
+- `approved_winner`, `approved_loser`: approval flags, approved if left out.
+
+Rows are read as a stream and validated and inserted in batches. Rows that
+don't validate are reported and skipped, the rest of the batch is still
+imported. Ratings are not touched while importing: the caller replays all
+matches from `ImportResult.after_time` once afterwards, see `flask
+import-matches`.
+"""
+from collections import namedtuple
+import csv
+from datetime import datetime
+import json
+import re
+
+from app import db
+from app.cache import bump_players_version
+from app.models import User, Rating, MatchRating, Match, UserMatch
+
+BATCH_SIZE = 500
+IMPORTANCES = (8, 16, 32)
+
+# `errors` holds (line number, message) of the skipped rows. Ratings must be
+# recalculated from `after_time`, None if the import changed no ratings.
+ImportResult = namedtuple('ImportResult', ['imported', 'errors', 'after_time'])
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(lines, format):
+    """
+    Rows of a CSV (with a header) or JSONL file as (line number, dict). A
+    line that can't be parsed gives a `RowError` instead of the dict.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError('not an object')
+            except ValueError as e:
+                row = RowError(f'invalid JSON: {e}')
+            yield line_number, row
+    else:
+        raise AssertionError(f'wrong import format: {format}')
+
+
+def format_from_filename(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return 'jsonl' if extension in ('jsonl', 'json', 'ndjson') else 'csv'
+
+
+def _shortnames(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = re.split(r'[\s,;]+', value.strip())
+    if not isinstance(value, list):
+        raise RowError(f'invalid players: {value}')
+    return [str(v).upper() for v in value if str(v).strip()]
+
+
+def _flag(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, str):
+        if value.strip().lower() in ('1', 'true', 'yes', 'y'):
+            return True
+        if value.strip().lower() in ('0', 'false', 'no', 'n'):
+            return False
+        raise RowError(f'invalid approval flag: {value}')
+    return bool(value)
+
+
+def _integer(row, column, default=None):
+    value = row.get(column)
+    if value is None or value == '':
+        if default is None:
+            raise RowError(f'missing {column}')
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'invalid {column}: {value}')
+
+
+def _validate(row, players):
+    """
+    Column values of a `Match` and the ids of the winners and losers of a
+    row
+    """
+    if isinstance(row, RowError):
+        raise row
+    teams = []
+    for column in ['winners', 'losers']:
+        shortnames = _shortnames(row.get(column))
+        if not shortnames:
+            raise RowError(f'missing {column}')
+        unknown = [s for s in shortnames if s not in players]
+        if unknown:
+            raise RowError(f'unknown players: {", ".join(unknown)}')
+        team = [players[s] for s in shortnames]
+        if len(set(team)) < len(team):
+            raise RowError(f'same player listed twice in {column}')
+        teams.append(team)
+    winners, losers = teams
+    if set(winners) & set(losers):
+        raise RowError('same user cannot be both winner and loser')
+
+    winner_score = _integer(row, 'winner_score')
+    loser_score = _integer(row, 'loser_score')
+    if winner_score <= loser_score:
+        raise RowError('winning score must be greater than losing score')
+    importance = _integer(row, 'importance', default=16)
+    if importance not in IMPORTANCES:
+        raise RowError(f'invalid importance: {importance}')
+    try:
+        timestamp = datetime.fromisoformat(str(row.get('timestamp')).strip())
+    except ValueError:
+        raise RowError(f'invalid timestamp: {row.get("timestamp")}')
+    return dict(
+        winner_score=winner_score,
+        loser_score=loser_score,
+        importance=importance,
+        timestamp=timestamp,
+        approved_winner=_flag(row.get('approved_winner')),
+        approved_loser=_flag(row.get('approved_loser')),
+    ), winners, losers
+
+
+def _load_players(batch, players):
+    """
+    Add the ids of the players named in a batch of rows to `players`, by
+    shortname
+    """
+    shortnames = set()
+    for _, row in batch:
+        if isinstance(row, dict):
+            for column in ['winners', 'losers']:
+                try:
+                    shortnames.update(_shortnames(row.get(column)))
+                except RowError:
+                    pass
+    missing = list(shortnames - set(players))
+    if missing:
+        players.update(db.session.query(User.shortname, User.id)
+            .filter(User.shortname.in_(missing)))
+
+
+def _insert_batch(batch, players, errors):
+    """
+    Validate and insert a batch of rows. Returns the imported matches as
+    (timestamp, approved, user ids).
+    """
+    _load_players(batch, players)
+    valid = []
+    for line_number, row in batch:
+        try:
+            valid.append(_validate(row, players))
+        except RowError as e:
+            errors.append((line_number, str(e)))
+    if not valid:
+        return []
+    matches = [Match(**values) for values, _, _ in valid]
+    db.session.add_all(matches)
+    # Gives the matches their ids
+    db.session.flush()
+    db.session.bulk_insert_mappings(UserMatch, [
+        dict(user_id=user_id, match_id=match.id, win=win)
+        for match, (_, winners, losers) in zip(matches, valid)
+        for user_ids, win in [(winners, True), (losers, False)]
+        for user_id in user_ids])
+    return [(values['timestamp'],
+             values['approved_winner'] and values['approved_loser'],
+             winners + losers)
+        for values, winners, losers in valid]
+
+
+def _backdate_initial_ratings(first_matches):
+    """
+    Move the initial ratings of players to their first imported match, if
+    that was played before they were registered. Returns the earliest time
+    a rating was moved to, or None.
+    """
+    earliest = None
+    for user_id, timestamp in first_matches.items():
+        moved = 0
+        for model in (MatchRating, Rating):
+            moved += model.query \
+                .filter(model.user_id == user_id) \
+                .filter(model.match_id.is_(None)) \
+                .filter(model.timestamp > timestamp) \
+                .update(dict(timestamp=timestamp), synchronize_session=False)
+        if moved and (earliest is None or timestamp < earliest):
+            earliest = timestamp
+    return earliest
+
+
+def import_matches(rows, batch_size=BATCH_SIZE):
+    """
+    Import (line number, row) pairs from `read_rows`, committing every
+    `batch_size` rows. Returns an `ImportResult`.
+    """
+    players = {}
+    errors = []
+    imported = 0
+    first_matches = {}
+    after_time = None
+
+    def flush(batch):
+        nonlocal imported, after_time
+        for timestamp, approved, user_ids in _insert_batch(batch, players,
+                errors):
+            imported += 1
+            for user_id in user_ids:
+                if timestamp < first_matches.get(user_id, datetime.max):
+                    first_matches[user_id] = timestamp
+            if approved and (after_time is None or timestamp < after_time):
+                after_time = timestamp
+        db.session.commit()
+
+    batch = []
+    for line_number, row in rows:
+        batch.append((line_number, row))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    if first_matches:
+        backdated = _backdate_initial_ratings(first_matches)
+        if backdated is not None:
+            after_time = backdated if after_time is None \
+                else min(after_time, backdated)
+        db.session.commit()
+        bump_players_version()
+    return ImportResult(imported, errors, after_time)
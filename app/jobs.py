@@ -0,0 +1,213 @@
+"""
+Rating recalculations as queued jobs.
+
+Jobs are rows in the `recalculation_job` table, so the queue survives
+restarts and needs nothing but the database. How queued jobs are run is set
+with the `RATING_JOBS_WORKER` config:
+
+- `thread`: in a background thread of the process that queued them.
+- `eager`: right away, before `enqueue_recalculation` returns.
+- `none`: only by `flask jobs run`, e.g. from cron.
+
+A recalculation always runs to the latest match, so a new job is merged into
+a job already waiting in the queue instead of adding another one.
+
+A running job records its progress and a heartbeat on its row. A job whose
+heartbeat is older than `HEARTBEAT_TIMEOUT` has lost its worker.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from app import db, tasks
+from app.models import RecalculationJob, copenhagen_now
+
+# A running job without a heartbeat for this long is assumed to have lost
+# its worker. Heartbeats come with progress, every 1000 matches replayed,
+# but not while the new ratings are written.
+HEARTBEAT_TIMEOUT = timedelta(minutes=10)
+
+
+def _merge_after_time(a, b):
+    # None means from the first match
+    if a is None or b is None:
+        return None
+    return min(a, b)
+
+
+def enqueue_recalculation(after_time=None, user_ids=None):
+    """
+    Queue a recalculation of ratings from `after_time`. With `user_ids`, only
+    the matches depending on those players are recalculated, see
+    `tasks.recalculate_player_ratings`.
+
+    Returns the queued job, which may be an existing job it was merged into.
+    """
+    job = RecalculationJob.query.filter_by(status='queued') \
+        .order_by(RecalculationJob.id).first()
+    merged = 0
+    if job is not None:
+        queued_user_ids = job.get_user_ids()
+        if queued_user_ids is None or user_ids is None:
+            merged_user_ids = None
+        else:
+            merged_user_ids = queued_user_ids + list(user_ids)
+        # Only while the job is still queued, as a worker may have claimed
+        # it since it was read
+        merged = RecalculationJob.query \
+            .filter_by(id=job.id, status='queued') \
+            .update(dict(
+                after_time=_merge_after_time(job.after_time, after_time),
+                user_ids=RecalculationJob.format_user_ids(merged_user_ids)),
+                synchronize_session=False)
+    if merged != 1:
+        job = RecalculationJob(status='queued', after_time=after_time)
+        job.set_user_ids(user_ids)
+        db.session.add(job)
+    db.session.commit()
+
+    worker = current_app.config['RATING_JOBS_WORKER']
+    if worker == 'eager':
+        run_pending_jobs()
+    elif worker == 'thread':
+        _get_executor().submit(_run_in_app_context,
+            current_app._get_current_object())
+    elif worker != 'none':
+        raise AssertionError(f'wrong rating jobs worker: {worker}')
+    return job
+
+
+def _get_executor():
+    # A single worker, so the jobs of this process run one at a time
+    executor = current_app.extensions.get('moneyball_jobs')
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=1)
+        current_app.extensions['moneyball_jobs'] = executor
+    return executor
+
+
+def _run_in_app_context(app):
+    with app.app_context():
+        try:
+            run_pending_jobs()
+        except Exception:
+            app.logger.exception('Rating recalculation worker failed')
+        finally:
+            db.session.remove()
+
+
+def _claim_next_job():
+    """
+    Mark the oldest queued job as running and return it, or None if there
+    is nothing to run or another job is still running.
+    """
+    now = copenhagen_now()
+    # Jobs of a worker that died are never finished, don't wait for them
+    last_beat = func.coalesce(RecalculationJob.heartbeat,
+        RecalculationJob.started)
+    RecalculationJob.query \
+        .filter_by(status='running') \
+        .filter(last_beat < now - HEARTBEAT_TIMEOUT) \
+        .update(dict(status='failed', finished=now,
+            error='Worker stopped before the job finished'),
+            synchronize_session=False)
+    db.session.commit()
+
+    job = RecalculationJob.query.filter_by(status='queued') \
+        .order_by(RecalculationJob.id).first()
+    if job is None:
+        return None
+    # Only one worker gets to move the job out of the queue, and only while
+    # no other job runs. Checked and set in one statement, so two workers
+    # can't both claim a job.
+    other = db.aliased(RecalculationJob)
+    running = db.session.query(other.id) \
+        .filter(other.status == 'running').exists()
+    claimed = RecalculationJob.query \
+        .filter_by(id=job.id, status='queued') \
+        .filter(~running) \
+        .update(dict(status='running', started=now, heartbeat=now),
+            synchronize_session=False)
+    db.session.commit()
+    if claimed != 1:
+        return None
+    db.session.refresh(job)
+    return job
+
+
+def _beat(job_id, progress):
+    """
+    Record the progress of a running job and refresh its heartbeat. Written
+    on a connection of its own and committed right away, as the
+    recalculation only commits once it is done.
+    """
+    table = RecalculationJob.__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.update()
+            .where(table.c.id == job_id)
+            .values(progress=progress, heartbeat=copenhagen_now()))
+
+
+def run_job(job):
+    """
+    Run a claimed job and record how it went
+    """
+    job_id = job.id
+
+    def progress(fraction):
+        _beat(job_id, fraction)
+
+    try:
+        user_ids = job.get_user_ids()
+        if user_ids is None:
+            tasks.recalculate_ratings(after_time=job.after_time,
+                progress=progress)
+        else:
+            tasks.recalculate_player_ratings(user_ids,
+                after_time=job.after_time, progress=progress)
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = repr(e)
+        current_app.logger.exception(f'Recalculation job {job.id} failed')
+    else:
+        job.status = 'done'
+        job.progress = 1
+    job.finished = copenhagen_now()
+    db.session.commit()
+    return job
+
+
+def run_pending_jobs():
+    """
+    Run queued jobs until the queue is empty. Returns the jobs run.
+    """
+    jobs = []
+    while True:
+        job = _claim_next_job()
+        if job is None:
+            return jobs
+        jobs.append(run_job(job))
+
+
+def job_status(job):
+    """
+    JSON-friendly status of a job
+    """
+    def isoformat(t):
+        return None if t is None else t.isoformat()
+
+    return dict(
+        id=job.id,
+        status=job.status,
+        progress=job.progress,
+        after_time=isoformat(job.after_time),
+        user_ids=job.get_user_ids(),
+        created=isoformat(job.created),
+        started=isoformat(job.started),
+        finished=isoformat(job.finished),
+        heartbeat=isoformat(job.heartbeat),
+        error=job.error,
+    )
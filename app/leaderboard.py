@@ -0,0 +1,89 @@
+"""
+Leaderboard rows computed in a single query from the `current_rating` table.
+"""
+from collections import namedtuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.cache import get_cache
+from app.models import User, CurrentRating
+from app.ratings import get_rating_system
+
+
+class LeaderboardRow(namedtuple('LeaderboardRow', [
+        'rank', 'user_id', 'shortname', 'nickname', 'rating',
+        'matches_played'])):
+
+    def __str__(self):
+        # Same as `User.__str__`
+        return f'({self.shortname}) {self.nickname}'
+
+
+def _current(rating_type, name=None):
+    """
+    Alias of `CurrentRating` joined on the rating type. Use with an outer
+    join, so users missing a rating get the default value.
+    """
+    current = aliased(CurrentRating, name=name or rating_type)
+    onclause = (current.user_id == User.id) & (current.rating_type == rating_type)
+    return current, onclause
+
+
+def get_leaderboard(company_id, sorting='elo', limit=None, page=1):
+    """
+    Ranked leaderboard of the players in a company with any approved match,
+    sorted by the score of a registered rating system.
+
+    All ratings and ranks are computed by the database in one statement.
+    Use `limit` to get the top N players, and `page` to page through the
+    leaderboard `limit` players at a time.
+    """
+    system = get_rating_system(sorting)
+
+    # Every rated user has an elo rating, which also holds the number of
+    # approved matches
+    played, played_on = _current('elo', name='played')
+    query = db.session.query(User.id, User.shortname, User.nickname) \
+        .join(played, played_on) \
+        .filter(User.company_id == company_id) \
+        .filter(played.number_matches > 0)
+
+    state = {'matches_played': played.number_matches}
+    for field, default in system.fields.items():
+        current, onclause = _current(field)
+        query = query.outerjoin(current, onclause)
+        state[field] = func.coalesce(current.rating_value, default)
+    rating = system.score(state)
+
+    query = query \
+        .add_columns(
+            rating.label('rating'),
+            played.number_matches.label('matches_played'),
+            func.rank().over(order_by=rating.desc()).label('rank')) \
+        .order_by(rating.desc(), User.id)
+    if limit is not None:
+        query = query.limit(limit).offset((page - 1) * limit)
+
+    return [
+        LeaderboardRow(rank, user_id, shortname, nickname, rating,
+            matches_played)
+        for (user_id, shortname, nickname, rating, matches_played, rank)
+        in query
+    ]
+
+
+def get_cached_leaderboard(company_id, sorting='elo', limit=None, page=1):
+    """
+    `get_leaderboard`, cached until the ratings version is bumped
+    """
+    cache = get_cache()
+    key = ('leaderboard', company_id, sorting, limit, page,
+        cache.get_version('ratings'))
+    rows = cache.get(key)
+    if rows is None:
+        rows = get_leaderboard(company_id, sorting=sorting, limit=limit,
+            page=page)
+        cache.set(key, rows)
+    return rows
@@ -0,0 +1,68 @@
+"""
+Pages of a players matches, newest first.
+
+Pages are found by keyset on (timestamp, id) instead of an offset, so the
+database seeks to a page through the `match` index however far back it
+is. Every page takes the same four queries: the matches, their winners,
+their losers and the players Elo after each match.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy.orm import selectinload
+
+from app import db
+from app.models import Match, UserMatch
+
+MATCHES_PER_PAGE = 25
+MAX_MATCHES_PER_PAGE = 100
+
+# `win` is whether the player won `match`, `elo` the players Elo after it,
+# 0 if the match is not rated yet
+MatchRow = namedtuple('MatchRow', ['match', 'win', 'elo'])
+# `before` is the cursor of the next (older) page, None on the last page
+MatchPage = namedtuple('MatchPage', ['rows', 'before'])
+
+
+def encode_cursor(match):
+    return f'{match.timestamp.isoformat()}_{match.id}'
+
+
+def decode_cursor(cursor):
+    """
+    (timestamp, id) of a cursor from `encode_cursor`. Raises ValueError for
+    malformed cursors.
+    """
+    timestamp, match_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(timestamp), int(match_id)
+
+
+def user_matches_page(user, before=None, per_page=MATCHES_PER_PAGE):
+    """
+    `MatchPage` of the matches of `user` older than the cursor `before`,
+    or the latest matches without it
+    """
+    query = db.session.query(Match, UserMatch.win) \
+        .join(UserMatch, UserMatch.match_id == Match.id) \
+        .filter(UserMatch.user_id == user.id) \
+        .options(
+            selectinload(Match.winning_players),
+            selectinload(Match.losing_players))
+    if before is not None:
+        timestamp, match_id = decode_cursor(before)
+        query = query.filter((Match.timestamp < timestamp)
+            | ((Match.timestamp == timestamp) & (Match.id < match_id)))
+    # One extra match tells if there is another page
+    rows = query.order_by(Match.timestamp.desc(), Match.id.desc()) \
+        .limit(per_page + 1) \
+        .all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    matches = [match for match, _ in rows]
+    user.load_match_rating_values(matches)
+    return MatchPage(
+        rows=[MatchRow(match, win, user.get_match_rating_value(match))
+            for match, win in rows],
+        before=encode_cursor(matches[-1]) if has_next else None,
+    )
@@ -1,5 +1,7 @@
-from app import db, login
-from sqlalchemy import or_, and_
+from app import db, login, ratings
+from flask import g, has_app_context
+from sqlalchemy import or_, and_, event, literal, select, union_all
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime
@@ -8,6 +10,46 @@ from dateutil.tz import gettz
 tz = gettz('Europe/Copenhagen')
 
 
+def rating_cache():
+    """
+    Ratings read by the `User` getters in this request (or app context), or
+    None outside of one. Cleared whenever ratings are written, see
+    `_clear_rating_cache`.
+
+    `current` holds a dict of rating type to (rating_value, number_matches)
+    by user id, `match` the rating value by (user_id, match_id,
+    rating_type), None for matches without a rating.
+    """
+    if not has_app_context():
+        return None
+    if 'rating_cache' not in g:
+        g.rating_cache = dict(current={}, match={})
+    return g.rating_cache
+
+
+# Writes to any table holding ratings: `rating`, `match_rating` (see
+# `MatchRating`) and `current_rating`
+@event.listens_for(Engine, 'after_cursor_execute')
+def _clear_rating_cache(conn, cursor, statement, parameters, context,
+        executemany):
+    if context is None or not (
+            context.isinsert or context.isupdate or context.isdelete):
+        return
+    table = getattr(getattr(context.compiled, 'statement', None), 'table',
+        None)
+    if getattr(table, 'name', None) in ('rating', 'match_rating',
+            'current_rating') \
+            and has_app_context():
+        g.pop('rating_cache', None)
+
+
+@event.listens_for(Engine, 'rollback')
+def _clear_rating_cache_on_rollback(conn):
+    # Ratings read since the last write may have been rolled back
+    if has_app_context():
+        g.pop('rating_cache', None)
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     shortname = db.Column(db.String(64), index=True, unique=True)
@@ -51,82 +93,108 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def get_current_ratings(self):
+        """
+        (rating_value, number_matches) of the users current ratings by
+        rating type, read in one query once per request
+        """
+        cache = rating_cache()
+        if cache is not None and self.id in cache['current']:
+            return cache['current'][self.id]
+        current = {rating_type: (rating_value, number_matches)
+            for rating_type, rating_value, number_matches in db.session.query(
+                    CurrentRating.rating_type,
+                    CurrentRating.rating_value,
+                    CurrentRating.number_matches) \
+                .filter(CurrentRating.user_id == self.id)}
+        if cache is not None:
+            cache['current'][self.id] = current
+        return current
+
     def get_current_elo(self):
-        elo_q = Rating.query \
-            .filter(and_(Rating.user_id == self.id), Rating.rating_type == 'elo') \
-            .order_by(Rating.timestamp.desc()) \
-            .first()
         try:
-            return elo_q.rating_value
-        except AttributeError:
+            return self.get_current_ratings()['elo'][0]
+        except KeyError:
             return 1500
 
     def get_current_trueskill(self):
-        mu = Rating.query \
-            .filter(and_(
-                Rating.user_id == self.id),
-                Rating.rating_type == 'trueskill_mu') \
-            .order_by(Rating.timestamp.desc()) \
-            .first()
-        sigma = Rating.query \
-            .filter(and_(
-                Rating.user_id == self.id),
-                Rating.rating_type == 'trueskill_sigma') \
-            .order_by(Rating.timestamp.desc()) \
-            .first()
+        current = self.get_current_ratings()
         try:
-            return (mu.rating_value, sigma.rating_value)
-        except AttributeError:
+            return (current['trueskill_mu'][0], current['trueskill_sigma'][0])
+        except KeyError:
             return (25, 8.33)
 
     def get_current_goal_difference(self):
-        rating = Rating.query \
-            .filter(and_(Rating.user_id == self.id), Rating.rating_type == 'goal_difference') \
-            .order_by(Rating.timestamp.desc()) \
-            .first()
         try:
-            return rating.rating_value
-        except AttributeError:
+            return self.get_current_ratings()['goal_difference'][0]
+        except KeyError:
             return 0
 
     def get_current_number_matches_approved(self):
         """
         Count number of approved matches for User. Used in Matches Played ranking
         """
-        # Use ratings to only find approved matches
-        # Select just one type of Rating. Otherwise we are overcounting
-        ratings = Rating.query \
-            .filter(Rating.user_id == self.id) \
-            .filter(Rating.rating_type == 'elo') \
-            .all()
-        # Remove 1 for the initial rating (elo=1500 when creating the user)
-        return len(ratings) - 1
+        # Only approved matches get ratings. Use the elo count so we are
+        # not overcounting across rating types.
+        try:
+            return self.get_current_ratings()['elo'][1]
+        except KeyError:
+            return 0
 
+    def load_match_rating_values(self, matches, rating_type='elo'):
+        """
+        Read the users ratings of `rating_type` given by `matches` in one
+        query, for `get_match_rating_value` to use for the rest of the
+        request
+        """
+        cache = rating_cache()
+        if cache is None:
+            return
+        match_ids = [m.id for m in matches
+            if (self.id, m.id, rating_type) not in cache['match']]
+        if not match_ids:
+            return
+        rows = rating_rows([rating_type])
+        values = dict(db.session.query(rows.c.match_id, rows.c.rating_value) \
+            .filter(rows.c.user_id == self.id) \
+            .filter(rows.c.match_id.in_(match_ids)))
+        for match_id in match_ids:
+            cache['match'][(self.id, match_id, rating_type)] = \
+                values.get(match_id)
 
     def get_match_rating_value(self, match, rating_type='elo'):
-        rating = Rating.query \
-            .filter(Rating.user_id == self.id) \
-            .filter(Rating.match_id == match.id) \
-            .filter(Rating.rating_type == rating_type) \
-            .first()
-        try:
-            return rating.rating_value
-        except AttributeError:
+        self.load_match_rating_values([match], rating_type=rating_type)
+        cache = rating_cache()
+        if cache is not None:
+            value = cache['match'][(self.id, match.id, rating_type)]
+        else:
+            rows = rating_rows([rating_type])
+            rating = db.session.query(rows.c.rating_value) \
+                .filter(rows.c.user_id == self.id) \
+                .filter(rows.c.match_id == match.id) \
+                .first()
+            value = None if rating is None else rating.rating_value
+        if value is None:
             return 0
+        return value
+
+    def get_current_state(self):
+        """
+        Current value of every rating type, and the number of approved
+        matches, as used by `ratings.RatingSystem.score`
+        """
+        current = {rating_type: value
+            for rating_type, (value, _) in self.get_current_ratings().items()}
+        state = {}
+        for system in ratings.rating_systems():
+            for field, default in system.fields.items():
+                state[field] = current.get(field, default)
+        state['matches_played'] = self.get_current_number_matches_approved()
+        return state
 
     def get_current_rating(self, rating_type='elo'):
-        if rating_type == 'trueskill':
-            (mu, sigma) = self.get_current_trueskill()
-            rating = mu - (3*sigma)
-        elif rating_type == 'elo':
-            rating = self.get_current_elo()
-        elif rating_type == 'goal_difference':
-            rating = self.get_current_goal_difference()
-        elif rating_type == 'matches_played':
-            rating = self.get_current_number_matches_approved()
-        else:
-            raise AssertionError(f'wrong rating_type: {rating_type}')
-        return rating
+        system = ratings.get_rating_system(rating_type)
+        return system.score(self.get_current_state())
 
     def can_approve_match(self, match):
         if self in match.winning_players and not match.approved_winner:
@@ -150,13 +218,9 @@ class User(UserMixin, db.Model):
             return datetime.min
 
     def get_winstreak(self):
-        winstreak = 0
-        for m in self.matches[::-1]:
-            if self in m.winning_players:
-                winstreak += 1
-            else:
-                break
-        return winstreak
+        from app.stats import win_streaks
+        current, best = win_streaks(self.id)
+        return current
 
 @login.user_loader
 def load_user(id):
@@ -181,7 +245,7 @@ class Match(db.Model):
     importance = db.Column(db.Integer, default=16)
     timestamp = db.Column(db.DateTime, index=True, default=copenhagen_now)
     table_id = db.Column(db.Integer, db.ForeignKey('table.id'))
-    ratings = db.relationship('Rating')
+    ratings = db.relationship('MatchRating')
     approved_winner = db.Column(db.Boolean, default=False)
     approved_loser = db.Column(db.Boolean, default=False)
 
@@ -189,6 +253,10 @@ class Match(db.Model):
         return f'<Match - match_id:{self.id}>'
 
 class Rating(db.Model):
+    """
+    Rating of one type, for the rating types without a column in
+    `MatchRating`, e.g. of rating systems registered by plugins
+    """
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     match_id = db.Column(db.Integer, db.ForeignKey('match.id'))
@@ -196,6 +264,12 @@ class Rating(db.Model):
     rating_type = db.Column(db.String(64), index=True)
     rating_value = db.Column(db.Float)
 
+    # Rating histories of a user are read by type and time
+    __table_args__ = (
+        db.Index('ix_rating_user_id_rating_type_timestamp',
+            'user_id', 'rating_type', 'timestamp'),
+    )
+
     user = db.relationship('User', foreign_keys=user_id)
     match = db.relationship('Match', foreign_keys=match_id)
 
@@ -203,6 +277,208 @@ class Rating(db.Model):
         return f'<Rating - user:{self.user_id}, {self.rating_type}:{self.rating_value} @ {self.timestamp}>'
 
 
+# Rating types stored as columns of `MatchRating`
+MATCH_RATING_TYPES = ('elo', 'trueskill_mu', 'trueskill_sigma',
+    'goal_difference')
+
+
+class MatchRating(db.Model):
+    """
+    Ratings of a user after a match, or the initial ratings without
+    `match_id`, with one column per rating type of `MATCH_RATING_TYPES`.
+    Types not rated are NULL. Read them one row per rating type with
+    `rating_rows`.
+    """
+    __tablename__ = 'match_rating'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    match_id = db.Column(db.Integer, db.ForeignKey('match.id'), index=True)
+    timestamp = db.Column(db.DateTime, index=True, default=copenhagen_now)
+    elo = db.Column(db.Float)
+    trueskill_mu = db.Column(db.Float)
+    trueskill_sigma = db.Column(db.Float)
+    goal_difference = db.Column(db.Float)
+
+    # Rating histories of a user are read by time
+    __table_args__ = (
+        db.Index('ix_match_rating_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    user = db.relationship('User', foreign_keys=user_id)
+    match = db.relationship('Match', foreign_keys=match_id)
+
+    def __repr__(self):
+        return f'<MatchRating - user:{self.user_id}, match:{self.match_id} @ {self.timestamp}>'
+
+
+def rating_rows(rating_types=None):
+    """
+    Subquery of ratings with the columns of `Rating`, one row per rating
+    type, from both `MatchRating` and `Rating`. Limited to `rating_types`
+    if given, which only reads the columns and tables needed. Filters on
+    the subquery are pushed down to every table by the database.
+    """
+    selects = []
+    for rating_type in MATCH_RATING_TYPES:
+        if rating_types is not None and rating_type not in rating_types:
+            continue
+        column = getattr(MatchRating, rating_type)
+        selects.append(select(
+                MatchRating.id,
+                MatchRating.user_id,
+                MatchRating.match_id,
+                MatchRating.timestamp,
+                literal(rating_type, db.String(64)).label('rating_type'),
+                column.label('rating_value'))
+            .where(column.isnot(None)))
+    other_types = None if rating_types is None else \
+        [t for t in rating_types if t not in MATCH_RATING_TYPES]
+    if other_types is None or other_types or not selects:
+        query = select(
+            Rating.id,
+            Rating.user_id,
+            Rating.match_id,
+            Rating.timestamp,
+            Rating.rating_type,
+            Rating.rating_value)
+        if other_types is not None:
+            query = query.where(Rating.rating_type.in_(other_types))
+        selects.append(query)
+    if len(selects) == 1:
+        return selects[0].subquery('ratings')
+    return union_all(*selects).subquery('ratings')
+
+
+def split_ratings(ratings):
+    """
+    New ratings, given as dicts like `Rating` rows, as `MatchRating` rows
+    of the ratings of the same user, match and time, and `Rating` rows of
+    the other rating types
+    """
+    match_ratings = {}
+    other = []
+    for r in ratings:
+        if r['rating_type'] not in MATCH_RATING_TYPES:
+            other.append(r)
+            continue
+        key = (r['user_id'], r['match_id'], r['timestamp'])
+        if key not in match_ratings:
+            match_ratings[key] = dict(user_id=r['user_id'],
+                match_id=r['match_id'], timestamp=r['timestamp'])
+        match_ratings[key][r['rating_type']] = r['rating_value']
+    # Every row of a bulk insert needs the same columns
+    rows = [dict(dict.fromkeys(MATCH_RATING_TYPES), **row)
+        for row in match_ratings.values()]
+    return rows, other
+
+
+class CurrentRating(db.Model):
+    """
+    Latest rating of each type for a user, kept up to date whenever ratings
+    are written. `number_matches` counts the approved matches rated.
+    """
+    __tablename__ = 'current_rating'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rating_type = db.Column(db.String(64), primary_key=True)
+    rating_value = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime)
+    number_matches = db.Column(db.Integer, default=0)
+
+    user = db.relationship('User', foreign_keys=user_id)
+
+    def __repr__(self):
+        return f'<CurrentRating - user:{self.user_id}, {self.rating_type}:{self.rating_value} @ {self.timestamp}>'
+
+
+class RatingCheckpoint(db.Model):
+    """
+    Snapshot of the current ratings of every user, computed from all
+    ratings older than `timestamp`
+    """
+    __tablename__ = 'rating_checkpoint'
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, index=True)
+    ratings = db.relationship('CheckpointRating', cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f'<RatingCheckpoint - id:{self.id} @ {self.timestamp}>'
+
+
+class CheckpointRating(db.Model):
+    """
+    Like `CurrentRating`, as of a `RatingCheckpoint`
+    """
+    __tablename__ = 'checkpoint_rating'
+    checkpoint_id = db.Column(db.Integer, db.ForeignKey('rating_checkpoint.id'),
+        primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rating_type = db.Column(db.String(64), primary_key=True)
+    rating_value = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime)
+    number_matches = db.Column(db.Integer, default=0)
+
+
+class RatingCandle(db.Model):
+    """
+    Open, high, low and close of a users ratings of one type in a daily or
+    weekly bucket, see `candles`. Buckets are labelled like pandas
+    resampling labels them.
+    """
+    __tablename__ = 'rating_candle'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rating_type = db.Column(db.String(64), primary_key=True)
+    interval = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float)
+    open_timestamp = db.Column(db.DateTime)
+    close_timestamp = db.Column(db.DateTime)
+    number_ratings = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return (f'<RatingCandle - user:{self.user_id}, {self.rating_type} '
+            f'{self.interval}@{self.bucket}: {self.open}/{self.high}/'
+            f'{self.low}/{self.close}>')
+
+
+class RecalculationJob(db.Model):
+    """
+    Queued rating recalculation from `after_time`. With `user_ids`, only the
+    matches depending on those players are recalculated. A running job
+    refreshes `heartbeat` along with `progress`.
+    """
+    __tablename__ = 'recalculation_job'
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(16), index=True, default='queued')
+    after_time = db.Column(db.DateTime, nullable=True)
+    user_ids = db.Column(db.Text, nullable=True)
+    progress = db.Column(db.Float, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, default=copenhagen_now)
+    started = db.Column(db.DateTime, nullable=True)
+    finished = db.Column(db.DateTime, nullable=True)
+    heartbeat = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<RecalculationJob - id:{self.id}; status:{self.status}>'
+
+    def get_user_ids(self):
+        if self.user_ids is None:
+            return None
+        return [int(user_id) for user_id in self.user_ids.split(',')]
+
+    def set_user_ids(self, user_ids):
+        self.user_ids = self.format_user_ids(user_ids)
+
+    @staticmethod
+    def format_user_ids(user_ids):
+        if user_ids is None:
+            return None
+        return ','.join(str(u) for u in sorted(set(user_ids)))
+
+
 class Table(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), index=True)
@@ -0,0 +1,63 @@
+"""
+Players ordered by their latest match, as offered by the match and matchup
+forms.
+
+The order comes from one `MAX(match.timestamp) GROUP BY user_id` query and
+is cached until a match or player is added, changed or deleted, see
+`cache.bump_players_version`.
+"""
+from flask import g, has_app_context
+from sqlalchemy import func
+
+from app import db
+from app.cache import get_cache
+from app.models import User, Match, UserMatch
+
+
+def recent_player_ids(company_id=None):
+    """
+    Ids of the players of a company, or of every company if `company_id` is
+    None, latest match first. Players without matches come last, and ties
+    are sorted by shortname, descending.
+    """
+    latest = db.session.query(
+            UserMatch.user_id,
+            func.max(Match.timestamp).label('timestamp')) \
+        .join(Match, Match.id == UserMatch.match_id) \
+        .group_by(UserMatch.user_id) \
+        .subquery()
+    query = db.session.query(User.id) \
+        .outerjoin(latest, latest.c.user_id == User.id)
+    if company_id is not None:
+        query = query.filter(User.company_id == company_id)
+    query = query.order_by(latest.c.timestamp.is_(None),
+        latest.c.timestamp.desc(), User.shortname.desc())
+    return [user_id for user_id, in query]
+
+
+def get_cached_recent_player_ids(company_id=None):
+    """
+    `recent_player_ids`, cached until the players version is bumped
+    """
+    cache = get_cache()
+    key = ('recent_players', company_id, cache.get_version('players'))
+    user_ids = cache.get(key)
+    if user_ids is None:
+        user_ids = recent_player_ids(company_id)
+        cache.set(key, user_ids)
+    return user_ids
+
+
+def recent_players(company_id=None):
+    """
+    `User`s in the order of `recent_player_ids`. Loaded once per request, so
+    several fields of a form share one query.
+    """
+    user_ids = get_cached_recent_player_ids(company_id)
+    key = (company_id, get_cache().get_version('players'))
+    loaded = g.setdefault('recent_players', {}) if has_app_context() else {}
+    if key not in loaded:
+        users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))}
+        loaded[key] = [users[user_id] for user_id in user_ids
+            if user_id in users]
+    return loaded[key]
@@ -1,41 +1,65 @@
-from app.models import User, Rating
+from app.models import User
+from app.candles import INTERVALS, get_candles
+from app.history import load_rating_history, latest_rating
+from app.cache import get_plot_cache
+from flask import current_app
 import plotly
 import numpy as np
 import pandas as pd
 import plotly.graph_objs as go
 
-def datetime(x):
-    return np.array(x, dtype=np.datetime64)
-
 def get_ratings(shortname, rating_type='elo'):
     user = User.query.filter_by(shortname=shortname).first()
-    ratings = Rating.query \
-        .filter_by(rating_type=rating_type) \
-        .filter_by(user_id=user.id) \
-        .order_by(Rating.timestamp).all()
-    values = [r.rating_value for r in ratings]
-    dates = datetime([r.timestamp for r in ratings])
-    match_ids = [r.match_id for r in ratings]
+    history = load_rating_history([user.id], [rating_type])[(user.id, rating_type)]
     source = pd.DataFrame(dict(
-        date=dates,
-        rating=values,
-        match_id=match_ids
+        date=history.timestamp,
+        rating=history.value,
+        match_id=history.match_id
     ))
 
     return source
 
+def format_numbers(values):
+    """
+    Format numbers like `format(value, "1.0f")`, for a whole array at once
+    """
+    return pd.Series(np.char.mod('%.0f', np.asarray(values, dtype=np.float64)))
+
+WEEKDAYS = np.array(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+    dtype=object)
+MONTHS = np.array(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
+    'Sep', 'Oct', 'Nov', 'Dec'], dtype=object)
+
+def format_ctimes(dates):
+    """
+    Format dates like `datetime.ctime`, for a whole array at once
+    """
+    seconds = np.asarray(dates, dtype='datetime64[s]')
+    days = seconds.astype('datetime64[D]')
+    months = seconds.astype('datetime64[M]')
+    # 1970-01-01 was a Thursday
+    weekday = WEEKDAYS[(days.astype(np.int64) + 3) % 7]
+    month = MONTHS[months.astype(np.int64) % 12]
+    day = pd.Series((days - months).astype(np.int64) + 1).astype(str).str.rjust(2)
+    # YYYY-MM-DDTHH:MM:SS
+    iso = pd.Series(np.datetime_as_string(seconds, unit='s'))
+    return (pd.Series(weekday) + ' ' + pd.Series(month) + ' ' + day + ' '
+        + iso.str[11:] + ' ' + iso.str[:4])
+
 def plot_ratings(shortname, rating_type, resample_interval):
     """
     Gather the ratings for a user, construct a plot and return the ´div´ element holding the plot
     """
-    source = get_ratings(shortname, rating_type=rating_type)
+    user = User.query.filter_by(shortname=shortname).first()
+    candles = get_candles(user.id, rating_type, resample_interval)
     MIN_MATCHES_FOR_CANDLESTICK = 7
-    if len(source) < MIN_MATCHES_FOR_CANDLESTICK:
+    if sum(c.number_ratings for c in candles) < MIN_MATCHES_FOR_CANDLESTICK:
         # Plot scatterplot if we have few observations
+        source = get_ratings(shortname, rating_type=rating_type)
         data = get_scatter_plot(source)
     else:
         # Plot candlestick if we have enough observations
-        data = get_candlestick_plot(source, resample_interval=resample_interval)
+        data = get_candlestick_plot(candles, resample_interval=resample_interval)
 
     data_comp = [data]
     layout_comp = go.Layout(
@@ -53,22 +77,30 @@ def plot_ratings(shortname, rating_type, resample_interval):
     div = plotly.offline.plot(fig_comp, show_link=False, output_type="div", include_plotlyjs=False)
     return div
 
+def get_cached_plot_ratings(user, rating_type, resample_interval):
+    """
+    `plot_ratings`, cached until the user gets a new rating of `rating_type`
+    """
+    # Recalculations write new rows, so the latest id changes as well
+    latest_id, _, count = latest_rating(user.id, rating_type)
+    key = ('plot', user.id, rating_type, resample_interval, latest_id, count)
+    cache = get_plot_cache()
+    div = cache.get(key)
+    if div is None:
+        div = plot_ratings(user.shortname, rating_type, resample_interval)
+        cache.set(key, div)
+    return div
+
 def get_scatter_plot(source):
-    hover_text = []
-    for index, row in source.iterrows():
-        match_id = row['match_id']
-        if pd.isnull(match_id):
-            # To allow formatting of ids laters
-            match_id = 0
-        hover_text.append((
-            "Match ID: {match_id}<br>"+
-            "Time: {date}<br>"+
-            "Rating: {rating}<br>").format(
-                match_id = format(match_id, "1.0f") ,
-                date = row["date"].ctime(),
-                rating = format(row["rating"], "1.0f")
-            ))
-    
+    if source.empty:
+        # Nothing to format for players without ratings
+        return go.Scatter(x=[], y=[], showlegend=False)
+    # To allow formatting of ids laters
+    match_ids = source["match_id"].fillna(0)
+    hover_text = ("Match ID: " + format_numbers(match_ids)
+        + "<br>Time: " + format_ctimes(source["date"])
+        + "<br>Rating: " + format_numbers(source["rating"]) + "<br>").tolist()
+
     data = go.Scatter(
             x = source.loc[:,"date"],
             y = source.loc[:,"rating"],
@@ -80,40 +112,40 @@ def get_scatter_plot(source):
             showlegend = False
         )
     return data
-    
-def get_candlestick_plot(source, resample_interval='D'):
-    # (1) Resample source dataframe so that there is one entry for every resample interval.
-    # (2) Convert the source dataframe to a dataframe with four columns: open, high, low, close.
-    # (3) Fill in empty rows.
-    series = source.set_index("date").loc[:,"rating"]
-    resampled = series.resample(resample_interval)
-    df_new = resampled.last()
-    df_new = df_new.to_frame("close")
-    df_new.loc[:,"high"] = resampled.max()
-    df_new.loc[:,"low"] = resampled.min()
-    df_new.loc[:,"open"] = resampled.first()
-    df_new.close.fillna(method = "ffill", inplace = True)
-    df_new.fillna(axis = "columns", method = "ffill", inplace = True)
-    # TODO: What is going on here?
-    # I assume this is to ensure that close on day 1 is equal to open on day 2?
+
+def candles_frame(candles, resample_interval='D'):
+    """
+    Dataframe with open, high, low and close for every bucket from the
+    first to the last candle. Each bucket opens at the previous close, and
+    buckets without ratings stay at the previous close.
+    """
+    buckets = pd.DatetimeIndex([c.bucket for c in candles])
+    df_new = pd.DataFrame(dict(
+        open=[c.open for c in candles],
+        high=[c.high for c in candles],
+        low=[c.low for c in candles],
+        close=[c.close for c in candles],
+    ), index=buckets)
+    freq = INTERVALS[resample_interval].freq
+    df_new = df_new.reindex(pd.date_range(buckets[0], buckets[-1], freq=freq))
+    df_new.close = df_new.close.ffill()
+    for column in ['high', 'low', 'open']:
+        df_new[column] = df_new[column].fillna(df_new.close)
     open_series = df_new.close.shift()
     open_series[0] = df_new.open[0]
     df_new.open = open_series
     df_new.low = np.minimum(df_new.low, df_new.open)
     df_new.high = np.maximum(df_new.high, df_new.open)
-    
-    hover_text = []
-    for index, row in df_new.iterrows():
-        hover_text.append((
-            "Open: {open_v}<br>"+
-            "High: {high}<br>"+
-            "Low: {low}<br>"+
-            "Close: {close}<br>").format(
-                open_v = format(row["open"], "1.0f") , # TODO: Why open_v?
-                high = format(row["high"], "1.0f") ,
-                low = format(row["low"], "1.0f") ,
-                close = format(row["close"], "1.0f"),
-            ))
+    return df_new
+
+def get_candlestick_plot(candles, resample_interval='D'):
+    # Candles are precomputed per bucket, see `candles`
+    df_new = candles_frame(candles, resample_interval=resample_interval)
+
+    hover_text = ("Open: " + format_numbers(df_new.open)
+        + "<br>High: " + format_numbers(df_new.high)
+        + "<br>Low: " + format_numbers(df_new.low)
+        + "<br>Close: " + format_numbers(df_new.close) + "<br>").tolist()
 
     data = go.Candlestick(x=df_new.index,
                 open=df_new.open.values,
@@ -123,4 +155,67 @@ def get_candlestick_plot(source, resample_interval='D'):
                 text = hover_text,
                 hoverinfo = 'text',
                     )
-    return data
\ No newline at end of file
+    return data
+
+
+def rating_comparison(user_ids, rating_type, resample_interval='D',
+        n_points=None):
+    """
+    Ratings of several users on a shared time axis, as a dataframe with a
+    column per user holding the latest rating in every bucket of
+    `resample_interval`. Users keep their rating through buckets without
+    ratings and are NaN before their first. If there would be more than
+    `n_points` buckets, by default `RATING_COMPARISON_MAX_POINTS`, buckets
+    are merged to get at most `n_points`.
+    """
+    if n_points is None:
+        n_points = current_app.config['RATING_COMPARISON_MAX_POINTS']
+    histories = load_rating_history(user_ids, [rating_type])
+    histories = [histories[(user_id, rating_type)] for user_id in user_ids]
+    frame = pd.DataFrame(dict(
+        user_id=np.repeat(user_ids, [len(h.value) for h in histories]),
+        date=np.concatenate([h.timestamp for h in histories]),
+        rating=np.concatenate([h.value for h in histories]),
+    ))
+    if frame.empty:
+        return pd.DataFrame(columns=user_ids, index=pd.DatetimeIndex([]),
+            dtype=np.float64)
+    # Ratings are in order, so the last rating of a timestamp is the latest
+    wide = frame.pivot_table(index='date', columns='user_id',
+        values='rating', aggfunc='last').reindex(columns=user_ids)
+    wide.columns.name = None
+    freq = INTERVALS[resample_interval].freq
+    resampled = wide.resample(freq).last()
+    if len(resampled) > n_points:
+        step = -(-len(resampled) // n_points)
+        resampled = wide.resample(f'{step}{freq}').last()
+    return resampled.ffill()
+
+def plot_rating_comparison(users, rating_type, resample_interval='D'):
+    """
+    Plot the ratings of several users in one figure and return the ´div´
+    element holding the plot
+    """
+    users = users[:current_app.config['RATING_COMPARISON_MAX_USERS']]
+    frame = rating_comparison([u.id for u in users], rating_type,
+        resample_interval=resample_interval)
+    data_comp = [go.Scatter(
+        x=frame.index,
+        y=frame[user.id],
+        name=user.shortname,
+        mode='lines',
+    ) for user in users if user.id in frame]
+    layout_comp = go.Layout(
+        title='Performance over time',
+        xaxis=dict(
+            title='Time',
+        ),
+        yaxis=dict(
+            title='Rating',
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    fig_comp = go.Figure(data=data_comp, layout=layout_comp)
+    div = plotly.offline.plot(fig_comp, show_link=False, output_type="div", include_plotlyjs=False)
+    return div
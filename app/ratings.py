@@ -0,0 +1,245 @@
+"""
+Registry of rating systems.
+
+A rating system keeps one or more rating types per player, its `fields`,
+stored as columns of `MatchRating` or, for types without a column, as
+`Rating` rows. Systems are registered with `register` and fed
+every replayed match by `replay.ReplayEngine`; their `score` ranks the
+leaderboard and fills the rating choices of the forms.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import trueskill as ts
+
+# NumPy and the kernels are imported when matches are first rated, which
+# keeps them out of the startup of every process
+
+RATING_SYSTEMS = OrderedDict()
+
+
+def register(cls):
+    """
+    Class decorator adding a rating system to the registry
+    """
+    system = cls()
+    RATING_SYSTEMS[system.name] = system
+    return cls
+
+
+def rating_systems():
+    return list(RATING_SYSTEMS.values())
+
+
+def get_rating_system(name):
+    try:
+        return RATING_SYSTEMS[name]
+    except KeyError:
+        raise AssertionError(f'wrong rating_type: {name}')
+
+
+def rating_type_choices():
+    """
+    Choices for a `SelectField` of rating systems
+    """
+    return [(system.name, system.label) for system in rating_systems()]
+
+
+def rating_field_choices():
+    """
+    Choices for a `SelectField` of the rating types of all systems
+    """
+    return [(field, field.replace('_', ' ').capitalize())
+        for system in rating_systems() for field in system.fields]
+
+
+def default_rating(rating_type):
+    """
+    Value of a rating type for players without a rating of that type
+    """
+    for system in rating_systems():
+        if rating_type in system.fields:
+            return system.fields[rating_type]
+    raise KeyError(rating_type)
+
+
+def initial_ratings():
+    """
+    Ratings given to new players, by rating type
+    """
+    initial = {}
+    for system in rating_systems():
+        initial.update(system.initial)
+    return initial
+
+
+def report_progress(progress, i, n_matches, every=1000):
+    if progress is not None and i % every == 0:
+        progress(i / n_matches)
+
+
+class RatingSystem(ABC):
+    """
+    Base class of rating systems.
+
+    `fields` maps the rating types of the system to the value used when a
+    player has no rating of that type, and `initial` holds the ratings
+    given to new players. Systems must implement `play` and `score`, so a
+    system missing one fails when it is registered.
+    """
+    name = None
+    label = None
+    fields = {}
+    initial = {}
+
+    def update(self, writer, matches, arrays=None, progress=None):
+        """
+        Rate `matches` in order, adding the new ratings to `writer`, a
+        `replay.RatingWriter`. `arrays` are the `kernels.match_arrays` of
+        the matches, for systems rating them all at once.
+        """
+        for i, match in enumerate(matches):
+            self.play(writer, match)
+            report_progress(progress, i, len(matches))
+
+    @abstractmethod
+    def play(self, writer, match):
+        """
+        Rate a single `replay.ReplayMatch`
+        """
+
+    @abstractmethod
+    def score(self, state):
+        """
+        Leaderboard score from a mapping of the `fields` and
+        `matches_played` to their values. Values may also be SQL
+        expressions, so stick to arithmetic.
+        """
+
+
+@register
+class Elo(RatingSystem):
+    name = 'elo'
+    label = 'Elo'
+    fields = {'elo': 1500}
+    initial = {'elo': 1500}
+
+    def update(self, writer, matches, arrays=None, progress=None):
+        import numpy as np
+        from app import kernels
+        # The kernels only work if every match builds on the previous one
+        if not matches or not writer.sequential_state(matches, self.fields):
+            return super().update(writer, matches, progress=progress)
+        if arrays is None:
+            arrays = kernels.match_arrays(matches)
+        elo = np.array([writer.get(p, 'elo') for p in arrays.user_ids.tolist()],
+            dtype=np.float64)
+        winners, losers = kernels.replay_elo(elo, arrays.winners,
+            arrays.losers, arrays.importance)
+        _add_match_values(writer, 'elo', matches, winners, losers)
+
+    def play(self, writer, match):
+        from app import kernels
+        elo_change = kernels.get_elo_change(
+            [writer.get(p, 'elo') for p in match.winners],
+            [writer.get(p, 'elo') for p in match.losers],
+            match.importance)
+        for p in match.winners:
+            writer.add_rating(p, 'elo', writer.get(p, 'elo') + elo_change,
+                match.timestamp, match.id)
+        for p in match.losers:
+            writer.add_rating(p, 'elo', writer.get(p, 'elo') - elo_change,
+                match.timestamp, match.id)
+
+    def score(self, state):
+        return state['elo']
+
+
+@register
+class TrueSkill(RatingSystem):
+    name = 'trueskill'
+    label = 'Trueskill'
+    fields = {'trueskill_mu': 25, 'trueskill_sigma': 8.33}
+    initial = {'trueskill_mu': 25, 'trueskill_sigma': 8.333}
+
+    def play(self, writer, match):
+        rating_groups = [
+            [ts.Rating(*writer.states[p].get_trueskill()) for p in match.winners],
+            [ts.Rating(*writer.states[p].get_trueskill()) for p in match.losers],
+        ]
+        new_ratings = ts.rate(rating_groups, ranks=[0, 1])
+        players = match.winners + match.losers
+        new_ratings_flat = [item for sublist in new_ratings for item in sublist]
+        for player, rating in zip(players, new_ratings_flat):
+            writer.add_rating(player, 'trueskill_mu', rating.mu,
+                match.timestamp, match.id)
+            writer.add_rating(player, 'trueskill_sigma', rating.sigma,
+                match.timestamp, match.id)
+
+    def score(self, state):
+        return state['trueskill_mu'] - 3 * state['trueskill_sigma']
+
+
+@register
+class GoalDifference(RatingSystem):
+    name = 'goal_difference'
+    label = 'Goal difference'
+    fields = {'goal_difference': 0}
+
+    def update(self, writer, matches, arrays=None, progress=None):
+        import numpy as np
+        from app import kernels
+        if not matches or not writer.sequential_state(matches, self.fields):
+            return super().update(writer, matches, progress=progress)
+        if arrays is None:
+            arrays = kernels.match_arrays(matches)
+        goal_difference = np.array(
+            [writer.get(p, 'goal_difference') for p in arrays.user_ids.tolist()],
+            dtype=np.float64)
+        winners, losers = kernels.replay_goal_difference(goal_difference,
+            arrays.winners, arrays.losers, arrays.winner_score,
+            arrays.loser_score)
+        _add_match_values(writer, 'goal_difference', matches, winners, losers)
+
+    def play(self, writer, match):
+        diff = match.winner_score - match.loser_score
+        for p in match.winners:
+            writer.add_rating(p, 'goal_difference',
+                writer.get(p, 'goal_difference') + diff,
+                match.timestamp, match.id)
+        for p in match.losers:
+            writer.add_rating(p, 'goal_difference',
+                writer.get(p, 'goal_difference') - diff,
+                match.timestamp, match.id)
+
+    def score(self, state):
+        return state['goal_difference']
+
+
+@register
+class MatchesPlayed(RatingSystem):
+    """
+    Number of approved matches, counted from the elo ratings
+    """
+    name = 'matches_played'
+    label = 'Matches Played'
+
+    def update(self, writer, matches, arrays=None, progress=None):
+        pass
+
+    def play(self, writer, match):
+        pass
+
+    def score(self, state):
+        return state['matches_played']
+
+
+def _add_match_values(writer, rating_type, matches, winner_values,
+        loser_values):
+    # Kernel results are (n_matches, team_size) arrays, NaN for padding
+    for match, w, l in zip(matches, winner_values.tolist(),
+            loser_values.tolist()):
+        for p, value in zip(match.winners, w):
+            writer.add_rating(p, rating_type, value, match.timestamp, match.id)
+        for p, value in zip(match.losers, l):
+            writer.add_rating(p, rating_type, value, match.timestamp, match.id)
@@ -0,0 +1,383 @@
+"""
+In-memory replay of approved matches.
+
+Used by `tasks.recalculate_ratings` to rebuild ratings without querying the
+database once per player and match, and by `tasks.update_match_ratings` to
+rate a single match.
+"""
+from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app import db, ratings
+from app.candles import update_candles
+from app.models import (Rating, MatchRating, CurrentRating, Match,
+    UserMatch, rating_rows, split_ratings)
+
+ReplayMatch = namedtuple('ReplayMatch', [
+    'id', 'timestamp', 'winner_score', 'loser_score', 'importance',
+    'winners', 'losers'])
+
+
+class PlayerState(object):
+    """
+    Latest rating of every type for one player, with the timestamp of the
+    rating it came from.
+    """
+    def __init__(self):
+        self.ratings = {}
+        self.number_matches = defaultdict(int)
+
+    def get(self, rating_type):
+        try:
+            return self.ratings[rating_type][1]
+        except KeyError:
+            return ratings.default_rating(rating_type)
+
+    def get_trueskill(self):
+        # Mirror `User.get_current_trueskill`, which falls back to the
+        # default for both values if either one is missing
+        try:
+            return (self.ratings['trueskill_mu'][1],
+                    self.ratings['trueskill_sigma'][1])
+        except KeyError:
+            return (ratings.default_rating('trueskill_mu'),
+                    ratings.default_rating('trueskill_sigma'))
+
+    def set(self, rating_type, value, timestamp, match_id=None):
+        # The getters read the rating with the latest timestamp, so a rating
+        # older than the current one never becomes current.
+        current = self.ratings.get(rating_type)
+        if current is None or timestamp >= current[0]:
+            self.ratings[rating_type] = (timestamp, value)
+        if match_id is not None:
+            self.number_matches[rating_type] += 1
+
+
+class RatingWriter(object):
+    """
+    Unit of work for new ratings. Ratings are collected in memory and
+    written in bulk with `write`, as one `MatchRating` row per player and
+    match. Until then, `get` reads a players current rating from the
+    pending rows, so ratings can build on each other in order without
+    touching the database.
+    """
+    def __init__(self):
+        self.states = defaultdict(PlayerState)
+        self.new_ratings = []
+
+    def load_current_state(self, user_ids):
+        """
+        Load the current ratings of `user_ids` from the `current_rating`
+        table
+        """
+        self.load_current_ratings(CurrentRating.query
+            .filter(CurrentRating.user_id.in_(list(user_ids))))
+
+    def load_state(self, before=None, user_ids=None):
+        """
+        Load the latest rating of every type for every user (or only
+        `user_ids`) from ratings older than `before`, along with the number
+        of matches rated, in a single query.
+        """
+        stored = rating_rows()
+        latest = db.session.query(
+                stored.c.user_id,
+                stored.c.rating_type,
+                stored.c.rating_value,
+                stored.c.timestamp,
+                func.count(stored.c.match_id).over(
+                    partition_by=(stored.c.user_id, stored.c.rating_type),
+                ).label('number_matches'),
+                func.row_number().over(
+                    partition_by=(stored.c.user_id, stored.c.rating_type),
+                    order_by=(stored.c.timestamp.desc(), stored.c.id.desc()),
+                ).label('row_number'))
+        if before is not None:
+            latest = latest.filter(stored.c.timestamp < before)
+        if user_ids is not None:
+            latest = latest.filter(stored.c.user_id.in_(list(user_ids)))
+        latest = latest.subquery()
+        rows = db.session.query(
+                latest.c.user_id,
+                latest.c.rating_type,
+                latest.c.rating_value,
+                latest.c.timestamp,
+                latest.c.number_matches) \
+            .filter(latest.c.row_number == 1)
+        for user_id, rating_type, value, timestamp, number_matches in rows:
+            state = self.states[user_id]
+            state.set(rating_type, value, timestamp)
+            state.number_matches[rating_type] = number_matches
+
+    def load_state_without(self, match_ids, after, user_ids):
+        """
+        Load the state of `user_ids` as if the ratings of the matches
+        `match_ids`, all from `after`, were deleted. The ratings stay in the
+        database, so they can be replaced after the matches are replayed.
+        """
+        self.load_state(before=after, user_ids=user_ids)
+        match_ids = set(match_ids)
+        stored = rating_rows()
+        ratings = db.session.query(
+                stored.c.user_id,
+                stored.c.rating_type,
+                stored.c.rating_value,
+                stored.c.timestamp,
+                stored.c.match_id) \
+            .filter(stored.c.timestamp >= after) \
+            .filter(stored.c.user_id.in_(list(user_ids))) \
+            .order_by(stored.c.timestamp, stored.c.id)
+        for user_id, rating_type, value, timestamp, match_id in \
+                ratings.yield_per(1000):
+            if match_id not in match_ids:
+                self.states[user_id].set(rating_type, value, timestamp,
+                    match_id)
+
+    def load_current_ratings(self, rows):
+        """
+        Load state from rows shaped like `CurrentRating`
+        """
+        for row in rows:
+            state = self.states[row.user_id]
+            state.set(row.rating_type, row.rating_value, row.timestamp)
+            state.number_matches[row.rating_type] = row.number_matches
+
+    def get(self, user_id, rating_type):
+        return self.states[user_id].get(rating_type)
+
+    def add_rating(self, user_id, rating_type, value, timestamp, match_id=None):
+        self.states[user_id].set(rating_type, value, timestamp, match_id)
+        self.new_ratings.append(dict(
+            user_id=user_id,
+            match_id=match_id,
+            rating_type=rating_type,
+            rating_value=value,
+            timestamp=timestamp,
+        ))
+
+    def sequential_state(self, matches, rating_types):
+        """
+        Whether every players ratings of `rating_types` are older than their
+        first match, so each match simply builds on the previous one.
+        Otherwise an older rating can't replace the current one, which
+        only rating one match at a time handles.
+        """
+        first_match = {}
+        for match in matches:
+            for p in match.winners + match.losers:
+                first_match.setdefault(p, match.timestamp)
+        for p, timestamp in first_match.items():
+            for rating_type in rating_types:
+                current = self.states[p].ratings.get(rating_type)
+                if current is not None and current[0] > timestamp:
+                    return False
+        return True
+
+    def current_ratings(self):
+        """
+        `CurrentRating` rows for every player in the writer
+        """
+        rows = []
+        for user_id, state in self.states.items():
+            for rating_type, (timestamp, value) in state.ratings.items():
+                rows.append(dict(
+                    user_id=user_id,
+                    rating_type=rating_type,
+                    rating_value=value,
+                    timestamp=timestamp,
+                    number_matches=state.number_matches[rating_type],
+                ))
+        return rows
+
+    def write(self, candles=True):
+        """
+        Add all new ratings to the session with a single bulk insert, and
+        replace the `CurrentRating` rows of every player in the writer.
+        The new ratings are merged into the rating candles, unless
+        `candles` is False, e.g. when they are rebuilt afterwards.
+        Committing is left to the caller.
+        """
+        if candles:
+            update_candles(self.new_ratings)
+        if self.new_ratings:
+            match_ratings, other = split_ratings(self.new_ratings)
+            if match_ratings:
+                db.session.bulk_insert_mappings(MatchRating, match_ratings)
+            if other:
+                db.session.bulk_insert_mappings(Rating, other)
+        self.new_ratings = []
+        if self.states:
+            CurrentRating.query \
+                .filter(CurrentRating.user_id.in_(list(self.states))) \
+                .delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(CurrentRating,
+                self.current_ratings())
+
+
+class ReplayEngine(RatingWriter):
+    """
+    Replay matches in memory with every registered rating system,
+    collecting new ratings to be written back in bulk with `write`.
+    """
+    def init_player(self, user_id, timestamp):
+        for rating_type, value in ratings.initial_ratings().items():
+            self.add_rating(user_id, rating_type, value, timestamp)
+
+    def play_all(self, matches, progress=None):
+        """
+        Replay matches in order. The matches are converted to arrays once,
+        and each rating system rates all of them in one go, e.g. Elo and
+        goal difference with the NumPy kernels. The new ratings are
+        identical to calling `play` per match.
+        `progress` is called with the fraction of matches replayed.
+        """
+        if not matches:
+            return
+        from app import kernels
+        arrays = kernels.match_arrays(matches)
+        systems = ratings.rating_systems()
+        for k, system in enumerate(systems):
+            system_progress = None
+            if progress is not None:
+                def system_progress(fraction, k=k):
+                    progress((k + fraction) / len(systems))
+            system.update(self, matches, arrays, progress=system_progress)
+
+    def play_components(self, matches, processes, progress=None):
+        """
+        Replay matches like `play_all`, with every connected component of
+        the player-match graph replayed in its own worker process. No
+        rating depends on a match of another component, so the new ratings
+        are identical to `play_all`. They are merged back into this engine,
+        to be written in one go with `write`.
+        """
+        components = connected_components(matches)
+        if processes <= 1 or len(components) <= 1:
+            return self.play_all(matches, progress=progress)
+        # The largest components first, so no worker is left with a big
+        # one at the end
+        components.sort(key=len, reverse=True)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = []
+            for component in components:
+                players = {p for m in component for p in m.winners + m.losers}
+                states = {p: self.states[p] for p in players
+                    if p in self.states}
+                futures.append(pool.submit(_replay_component, states,
+                    component))
+            replayed = 0
+            for component, future in zip(components, futures):
+                states, new_ratings = future.result()
+                self.states.update(states)
+                self.new_ratings.extend(new_ratings)
+                replayed += len(component)
+                if progress is not None:
+                    progress(replayed / len(matches))
+
+    def play(self, match):
+        for system in ratings.rating_systems():
+            system.play(self, match)
+
+
+def _replay_component(states, matches):
+    # Runs in a worker process of `ReplayEngine.play_components`
+    engine = ReplayEngine()
+    engine.states.update(states)
+    engine.play_all(matches)
+    return dict(engine.states), engine.new_ratings
+
+
+def connected_components(matches):
+    """
+    Split matches into groups that share no players, e.g. the matches of
+    every company. Each group is in the order of `matches`, and groups are
+    ordered by their first match.
+    """
+    parent = {}
+
+    def find(p):
+        root = p
+        while parent[root] != root:
+            root = parent[root]
+        # Point the whole path at the root
+        while parent[p] != root:
+            parent[p], p = root, parent[p]
+        return root
+
+    for match in matches:
+        players = match.winners + match.losers
+        for p in players:
+            parent.setdefault(p, p)
+        root = find(players[0])
+        for p in players[1:]:
+            parent[find(p)] = root
+
+    components = {}
+    for match in matches:
+        root = find(match.winners[0])
+        components.setdefault(root, []).append(match)
+    return list(components.values())
+
+def replay_match(match):
+    """
+    `ReplayMatch` for a `models.Match`
+    """
+    return ReplayMatch(match.id, match.timestamp, match.winner_score,
+        match.loser_score, match.importance,
+        [p.id for p in match.winning_players],
+        [p.id for p in match.losing_players])
+
+
+def load_matches(after_time=None):
+    """
+    Load all approved matches from `after_time`, ordered by time, together
+    with their players in a single query.
+    """
+    if after_time is None:
+        after_time = datetime.min
+    rows = db.session.query(
+            Match.id,
+            Match.timestamp,
+            Match.winner_score,
+            Match.loser_score,
+            Match.importance,
+            UserMatch.user_id,
+            UserMatch.win) \
+        .join(UserMatch, UserMatch.match_id == Match.id) \
+        .filter(Match.approved_winner == True) \
+        .filter(Match.approved_loser == True) \
+        .filter(Match.timestamp >= after_time) \
+        .order_by(Match.timestamp, Match.id, UserMatch.user_id)
+
+    matches = []
+    for (match_id, timestamp, w_score, l_score, importance,
+            user_id, win) in rows:
+        if not matches or matches[-1].id != match_id:
+            matches.append(ReplayMatch(match_id, timestamp, w_score, l_score,
+                importance, [], []))
+        if win:
+            matches[-1].winners.append(user_id)
+        else:
+            matches[-1].losers.append(user_id)
+    return matches
+
+
+def find_affected_matches(user_ids, after_time):
+    """
+    Walk forward through the approved matches from `after_time`, starting
+    with the players in `user_ids`. A match is affected if any of its players
+    is, and then all its players are affected from there on.
+
+    Returns the affected players and the affected matches in replay order.
+    """
+    affected = set(user_ids)
+    matches = []
+    for match in load_matches(after_time):
+        players = match.winners + match.losers
+        if affected.intersection(players):
+            affected.update(players)
+            matches.append(match)
+    return affected, matches
@@ -1,12 +1,24 @@
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, jsonify, abort, Response, stream_with_context
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.urls import url_parse
+from werkzeug.http import is_resource_modified
 from datetime import datetime
+import hashlib
+import io
 
 from app import app, db
 from app.models import User, Match, UserMatch, Rating
-from app.forms import LoginForm, RegistrationForm, CreateMatchForm, EditUserForm, ChooseLeaderboardSorting, EditPasswordForm, ChooseBestMatchupForm, SelectPlotResampleForm, CreateCompanyForm, RecalculateRatingsForm
-from app.plots import plot_ratings
+from app.forms import LoginForm, RegistrationForm, CreateMatchForm, EditUserForm, ChooseLeaderboardSorting, EditPasswordForm, ChooseBestMatchupForm, SelectPlotResampleForm, CompareRatingsForm, CreateCompanyForm, RecalculateRatingsForm, ImportMatchesForm
+from app.leaderboard import get_cached_leaderboard
+from app.cache import get_cache, get_plot_cache, hit_rate
+from app.jobs import enqueue_recalculation, job_status
+from app.models import RecalculationJob
+from app.candles import INTERVALS
+from app.ratings import default_rating
+from app.stats import profile_stats
+from app.imports import read_rows, format_from_filename, import_matches
+from app.exports import TABLES, FORMATS, export
+from app.match_history import user_matches_page, MATCHES_PER_PAGE, MAX_MATCHES_PER_PAGE
 import time
 
 from app import tasks
@@ -16,13 +28,11 @@ from app import tasks
 def index(sorting='elo'):
     form = ChooseLeaderboardSorting()
     sorting = form.sorting.data
+    rows = []
     if current_user.is_authenticated:
-        users = User.query.filter_by(company_id=current_user.company_id).all()
-    else:
-        users = User.query.all()
-    users = [u for u in users if u.get_current_number_matches_approved() > 0]
-    users = sorted(users, key=lambda u: u.get_current_rating(rating_type=sorting), reverse=True)
-    return render_template('index.html', title='Home', users=users, form=form)
+        # Leaderboard is only shown to logged in users
+        rows = get_cached_leaderboard(current_user.company_id, sorting=sorting)
+    return render_template('index.html', title='Home', rows=rows, form=form)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -72,27 +82,173 @@ def register():
 
 @app.route('/user/<user_id>', methods=['GET', 'POST'])
 def user(user_id):
-    resample_interval = 'D'
     user = User.query.filter_by(id=user_id).first_or_404()
     form = SelectPlotResampleForm()
+    # The rating chart is loaded from `api_user_ratings` by the page, unless
+    # candlesticks are asked for
+    b_div = None
     if form.validate_on_submit():
-        resample_interval = form.resample_interval.data
-    b_div = plot_ratings(user.shortname, 'elo',
-                         resample_interval=resample_interval)
+        # Plotting pulls in plotly and pandas, which are slow to import
+        from app.plots import get_cached_plot_ratings
+        b_div = get_cached_plot_ratings(user, 'elo',
+                             resample_interval=form.resample_interval.data)
+    # One query for the ratings shown with the latest matches, which are
+    # all the page lists, however long the career
+    user.load_match_rating_values(
+        user.won_matches[-10:] + user.lost_matches[-10:])
     matches_pending = []
     for m in user.matches:
         if user.can_approve_match(m):
             matches_pending.append(m)
+    # Ratings loaded above are skipped
+    if current_user.is_authenticated:
+        current_user.load_match_rating_values(matches_pending)
 
     return render_template('user.html', user=user, matches=user.matches,
                            b_div=b_div, title='User',
-                           form=form,
+                           form=form, stats=profile_stats(user.id),
                            matches_pending=matches_pending)
 
+# Number of points returned by `api_user_ratings`
+DEFAULT_SERIES_POINTS = 500
+MAX_SERIES_POINTS = 5000
+
+@app.route('/api/user/<int:user_id>/ratings')
+def api_user_ratings(user_id):
+    """
+    Rating history of a user, downsampled to `points` points. Filter with
+    `rating_type` and the ISO times `after` and `before`.
+    """
+    User.query.get_or_404(user_id)
+    rating_type = request.args.get('rating_type', 'elo')
+    try:
+        default_rating(rating_type)
+        after, before = [datetime.fromisoformat(request.args[arg])
+            if arg in request.args else None for arg in ['after', 'before']]
+        n_points = int(request.args.get('points', DEFAULT_SERIES_POINTS))
+    except (KeyError, ValueError):
+        abort(400)
+    n_points = min(max(n_points, 3), MAX_SERIES_POINTS)
+
+    # Ratings are only added or deleted, never updated, so the latest
+    # rating and the count identify the history. There is no Last-Modified:
+    # rating timestamps are when matches were played, not when the ratings
+    # were written, so backdated and deleted matches don't move it forward.
+    from app.history import latest_rating, rating_series
+    latest_id, _, count = latest_rating(user_id, rating_type)
+    etag = hashlib.md5(repr((user_id, rating_type, latest_id, count, after,
+        before, n_points)).encode()).hexdigest()
+    if is_resource_modified(request.environ, etag=etag):
+        response = jsonify(rating_series(user_id, rating_type, after=after,
+            before=before, n_points=n_points))
+    else:
+        response = app.response_class(status=304)
+    response.set_etag(etag)
+    # Cached, but always revalidated
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/compare', methods=['GET', 'POST'])
+def route_compare_ratings():
+    form = CompareRatingsForm()
+    b_div = None
+    if form.validate_on_submit():
+        from app.plots import plot_rating_comparison
+        b_div = plot_rating_comparison(form.players.data,
+            form.rating_type.data,
+            resample_interval=form.resample_interval.data)
+    return render_template('compare_ratings.html', title='Compare ratings',
+                           form=form, b_div=b_div,
+                           max_players=app.config['RATING_COMPARISON_MAX_USERS'])
+
+@app.route('/api/ratings/compare')
+def api_compare_ratings():
+    """
+    Ratings of the users given as repeated `user_id` arguments on a shared
+    time axis, in buckets of `interval` (D or W). At most `points` buckets
+    are returned.
+    """
+    max_users = app.config['RATING_COMPARISON_MAX_USERS']
+    max_points = app.config['RATING_COMPARISON_MAX_POINTS']
+    try:
+        user_ids = list(dict.fromkeys(
+            request.args.getlist('user_id', type=int)))
+        rating_type = request.args.get('rating_type', 'elo')
+        default_rating(rating_type)
+        interval = request.args.get('interval', 'D')
+        INTERVALS[interval]
+        n_points = int(request.args.get('points', max_points))
+    except (KeyError, ValueError):
+        abort(400)
+    if not user_ids or len(user_ids) > max_users:
+        abort(400)
+    n_points = min(max(n_points, 1), max_points)
+    users = User.query.filter(User.id.in_(user_ids)).all()
+    if len(users) < len(user_ids):
+        abort(404)
+    shortnames = {u.id: u.shortname for u in users}
+
+    from app.plots import rating_comparison
+
+    frame = rating_comparison(user_ids, rating_type,
+        resample_interval=interval, n_points=n_points)
+    time = frame.index.values.astype('datetime64[ms]').astype('int64')
+    return jsonify(
+        rating_type=rating_type,
+        interval=interval,
+        time=time.tolist(),
+        series=[dict(
+            user_id=user_id,
+            shortname=shortnames[user_id],
+            # NaN before the first rating, which isn't valid JSON
+            value=frame[user_id].astype(object)
+                .where(frame[user_id].notna(), None).tolist(),
+        ) for user_id in user_ids],
+    )
+
+def _matches_page(user):
+    # Page of `match_history.user_matches_page` from the request arguments
+    try:
+        per_page = int(request.args.get('per_page', MATCHES_PER_PAGE))
+        return user_matches_page(user, before=request.args.get('before'),
+            per_page=min(max(per_page, 1), MAX_MATCHES_PER_PAGE))
+    except ValueError:
+        abort(400)
+
 @app.route('/user/<user_id>/all_matches')
 def route_user_all_matches(user_id):
     user = User.query.filter_by(id=user_id).first_or_404()
-    return render_template('user_all_matches.html', user=user, matches=user.matches, title='All matches')
+    page = _matches_page(user)
+    return render_template('user_all_matches.html', user=user, page=page, title='All matches')
+
+@app.route('/api/user/<int:user_id>/matches')
+def api_user_matches(user_id):
+    """
+    Matches of a user, newest first, `per_page` at a time. Get older
+    matches by passing `next` of a page as `before`.
+    """
+    user = User.query.get_or_404(user_id)
+    page = _matches_page(user)
+
+    def players(users):
+        return [dict(id=u.id, shortname=u.shortname) for u in users]
+
+    return jsonify(
+        matches=[dict(
+            id=row.match.id,
+            timestamp=row.match.timestamp.isoformat(),
+            winner_score=row.match.winner_score,
+            loser_score=row.match.loser_score,
+            importance=row.match.importance,
+            approved=bool(row.match.approved_winner
+                and row.match.approved_loser),
+            winners=players(row.match.winning_players),
+            losers=players(row.match.losing_players),
+            win=row.win,
+            elo=row.elo,
+        ) for row in page.rows],
+        next=page.before,
+    )
 
 @app.route('/match/<match_id>')
 def match(match_id):
@@ -128,12 +284,22 @@ def create_match():
     return render_template('create_match.html', title='Create match', form=form)
 
 
+@app.route('/cache_stats')
+@login_required
+def route_cache_stats():
+    if not current_user.is_admin:
+        return redirect(url_for('index'))
+    plot_stats = get_plot_cache().stats()
+    plot_stats['hit_rate'] = hit_rate(plot_stats)
+    return jsonify(dict(get_cache().stats(), plots=plot_stats))
+
+
 @app.route('/recalculate_ratings')
 @login_required
 def route_recalculate_ratings():
     if not current_user.is_admin:
-        tasks.recalculate_ratings()
-        flash('Recalculated ratings!')
+        job = enqueue_recalculation()
+        flash(f'Recalculating ratings (job {job.id})')
     return redirect(url_for('index'))
 
 
@@ -143,18 +309,77 @@ def route_recalculate_ratings_from():
     form = RecalculateRatingsForm()
     if form.validate_on_submit():
         timestamp = form.timestamp.data
-        tasks.recalculate_ratings(after_time=timestamp)
-        flash('Recalculated ratings!')
+        job = enqueue_recalculation(after_time=timestamp)
+        flash(f'Recalculating ratings (job {job.id})')
         return redirect(url_for('index'))
 
     return render_template("recalculate_ratings.html", form=form)
 
+# Number of skipped rows listed after an import
+MAX_IMPORT_ERRORS_SHOWN = 100
+
+@app.route('/import_matches', methods=['GET', 'POST'])
+@login_required
+def route_import_matches():
+    if not current_user.is_admin:
+        return redirect(url_for('index'))
+    form = ImportMatchesForm()
+    result = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        result = import_matches(read_rows(lines,
+            format_from_filename(upload.filename)))
+        msg = f'Imported {result.imported} matches, skipped {len(result.errors)} rows'
+        if result.after_time is not None:
+            job = enqueue_recalculation(after_time=result.after_time)
+            msg = f'{msg}. Recalculating ratings (job {job.id})'
+        flash(msg)
+    return render_template('import_matches.html', title='Import matches',
+                           form=form, result=result,
+                           max_errors=MAX_IMPORT_ERRORS_SHOWN)
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+@app.route('/export/<table>.<format>')
+@login_required
+def route_export(table, format):
+    """
+    Stream a table as CSV or JSONL. Filter with `company_id`, `rating_type`
+    and the ISO times `after` and `before`.
+    """
+    if table not in TABLES or format not in FORMATS:
+        abort(404)
+    try:
+        filters = dict(
+            company_id=request.args.get('company_id', type=int),
+            rating_type=request.args.get('rating_type'),
+        )
+        for arg in ['after', 'before']:
+            filters[arg] = datetime.fromisoformat(request.args[arg]) \
+                if arg in request.args else None
+    except ValueError:
+        abort(400)
+    # The session has to stay open while the rows are streamed
+    response = Response(stream_with_context(export(table, format, **filters)),
+        mimetype=EXPORT_MIMETYPES[format])
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename={table}.{format}'
+    return response
+
 @app.route('/delete_match/<match_id>', methods=['POST'])
 @login_required
 def route_delete_match(match_id):
     match = Match.query.filter_by(id=match_id).first_or_404()
-    tasks.delete_match(match)
-    flash('Match deleted')
+    approved = match.approved_winner and match.approved_loser
+    user_ids = [p.id for p in match.players]
+    timestamp = match.timestamp
+    tasks.delete_match(match, recalculate=False)
+    if approved:
+        job = enqueue_recalculation(after_time=timestamp, user_ids=user_ids)
+        flash(f'Match deleted. Recalculating ratings (job {job.id})')
+    else:
+        flash('Match deleted')
     return redirect(url_for('index'))
 
 @app.route('/edit_user', methods=['GET', 'POST'])
@@ -219,10 +444,22 @@ def route_edit_any_password(user_id):
 @login_required
 def route_approve_match(match_id):
     match = Match.query.filter_by(id=match_id).first_or_404()
-    msg = tasks.approve_match(match, approver=current_user)
+    was_approved = match.approved_winner and match.approved_loser
+    msg = tasks.approve_match(match, approver=current_user, recalculate=False)
+    # Approving a match both teams already approved changes no ratings
+    if not was_approved and match.approved_winner and match.approved_loser:
+        job = enqueue_recalculation(after_time=match.timestamp,
+            user_ids=[p.id for p in match.players])
+        msg = f'{msg}. Recalculating ratings (job {job.id})'
     flash(msg)
     return redirect(url_for('index'))
 
+@app.route('/jobs/<int:job_id>')
+@login_required
+def route_job_status(job_id):
+    job = RecalculationJob.query.get_or_404(job_id)
+    return jsonify(job_status(job))
+
 @app.route('/rules')
 def rules():
     return render_template('rules.html')
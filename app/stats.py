@@ -0,0 +1,81 @@
+"""
+Player profile stats computed by the database.
+
+Wins, losses and streaks are aggregated over the `user_match` rows of a
+player, so the profile never loads the players matches or their players.
+Like `User.matches`, every registered match counts, approved or not.
+"""
+from collections import namedtuple
+
+from sqlalchemy import case, func
+
+from app import db
+from app.models import Match, UserMatch
+
+# `winrate` is a percentage, None without matches. `form` holds the results
+# of the latest matches, oldest first, as 'W' or 'L'.
+ProfileStats = namedtuple('ProfileStats', [
+    'wins', 'losses', 'winrate', 'current_streak', 'best_streak', 'form'])
+
+FORM_LENGTH = 10
+
+
+def _user_matches(user_id):
+    return db.session.query(UserMatch.win) \
+        .join(Match, Match.id == UserMatch.match_id) \
+        .filter(UserMatch.user_id == user_id)
+
+
+def win_streaks(user_id):
+    """
+    (current, best) number of wins in a row. Runs of equal results are
+    numbered with window functions: within a run, the position among all
+    matches and among the matches with that result grow together.
+    """
+    order_by = (Match.timestamp, Match.id)
+    ordered = _user_matches(user_id).add_columns(
+            func.row_number().over(order_by=order_by).label('position'),
+            func.row_number().over(partition_by=UserMatch.win,
+                order_by=order_by).label('result_position')) \
+        .subquery()
+    runs = db.session.query(
+            ordered.c.win,
+            func.count().label('length'),
+            func.max(ordered.c.position).label('last')) \
+        .group_by(ordered.c.win,
+            ordered.c.position - ordered.c.result_position) \
+        .subquery()
+    best, last = db.session.query(
+            func.max(case((runs.c.win == True, runs.c.length))),
+            func.max(runs.c.last)) \
+        .one()
+    current = db.session.query(runs.c.length) \
+        .filter(runs.c.last == last, runs.c.win == True) \
+        .scalar()
+    return current or 0, best or 0
+
+
+def profile_stats(user_id, form_length=FORM_LENGTH):
+    """
+    `ProfileStats` of a user, with the form of the last `form_length`
+    matches
+    """
+    wins, losses = db.session.query(
+            func.sum(case((UserMatch.win == True, 1), else_=0)),
+            func.sum(case((UserMatch.win == False, 1), else_=0))) \
+        .filter(UserMatch.user_id == user_id) \
+        .one()
+    wins, losses = wins or 0, losses or 0
+    current_streak, best_streak = win_streaks(user_id)
+    latest = _user_matches(user_id) \
+        .order_by(Match.timestamp.desc(), Match.id.desc()) \
+        .limit(form_length) \
+        .all()
+    return ProfileStats(
+        wins=wins,
+        losses=losses,
+        winrate=100 * wins / (wins + losses) if wins + losses else None,
+        current_streak=current_streak,
+        best_streak=best_streak,
+        form=['W' if win else 'L' for win, in reversed(latest)],
+    )
@@ -1,10 +1,17 @@
 from app import db
-from app.models import User, Rating, Match, UserMatch, Company
+from app.models import (User, Rating, MatchRating, CurrentRating, Match,
+    UserMatch, Company, rating_rows)
+from app import replay
+from app import checkpoints, candles
+from app.cache import bump_ratings_version, bump_players_version
 from datetime import datetime
-import trueskill as ts
+from sqlalchemy import func
+from flask import current_app
 from dateutil.tz import gettz
-import numpy as np
 tz = gettz('Europe/Copenhagen')
+# Matches per statement deleting their ratings, below the 999 bound
+# parameters older SQLite versions allow
+DELETE_CHUNK_SIZE = 500
 
 def create_user(shortname, nickname, password, company, is_admin = 0):
     sn_user = User.query.filter(User.shortname == shortname.upper()).first()
@@ -23,154 +30,144 @@ def create_user(shortname, nickname, password, company, is_admin = 0):
     user.set_password(password)
     db.session.add(user)
     db.session.commit()
+    bump_players_version()
     init_ratings(user)
     return user
 
 def init_ratings(user, timestamp=None):
     if timestamp is None:
         timestamp = datetime.now()
-    r_elo = Rating(user=user, rating_type='elo', rating_value=1500,
-        timestamp=timestamp)
-    r_ts_m = Rating(user=user, rating_type='trueskill_mu',
-        rating_value=25, timestamp=timestamp)
-    r_ts_s = Rating(user=user, rating_type='trueskill_sigma',
-        rating_value=8.333, timestamp=timestamp)
-    r_gd = Rating(user=user, rating_type='goal_difference',
-        rating_value=0, timestamp=timestamp)
-    db.session.add_all([r_elo, r_ts_m, r_ts_s])
+    writer = replay.RatingWriter()
+    writer.load_current_state([user.id])
+    writer.add_rating(user.id, 'elo', 1500, timestamp)
+    writer.add_rating(user.id, 'trueskill_mu', 25, timestamp)
+    writer.add_rating(user.id, 'trueskill_sigma', 8.333, timestamp)
+    writer.write()
     db.session.commit()
 
-def recalculate_ratings(after_time=None):
+def recalculate_ratings(after_time=None, progress=None):
     """
     Reset all ratings (possibly only `after_time`)
-    Recalculate all ratings and commit new ratings to db. 
+    Recalculate all ratings and commit new ratings to db.
+    Matches are replayed in memory and the new ratings are written back in
+    a single transaction. The state at `after_time` is restored from the
+    latest rating checkpoint, and new checkpoints are added afterwards.
+    `progress` is called with the fraction of matches replayed.
     """
     if after_time is None:
         # Set first datetime to earliest possible time
         after_time = datetime.min
-    users = User.query.all()
-    timestamps = []
-    for u in users:
-        # Get the first timestamp on Rating for each User
-        # To initialize first Rating at earliest record of the user.
-        try:
-            time = Rating.query \
-                .filter(Rating.user_id == u.id) \
-                .order_by(Rating.timestamp) \
-                .first().timestamp
-            timestamps.append(time)
-        except AttributeError:
-            time = datetime.now()
-            # if no rating exists
-            init_ratings(u, time)
-            timestamps.append(time)
-    Rating.query.filter(Rating.timestamp >= after_time).delete()
-    #db.session.query(Rating).delete()
-    db.session.commit()
-    for u, t in zip(users, timestamps):
-        # If user is created after `after_time`, reinit that users ratings.
-        if t >= after_time:
-            init_ratings(u, t)
+    # Get the first timestamp on Rating for each User
+    # To initialize first Rating at earliest record of the user.
+    stored = rating_rows()
+    first_timestamps = dict(db.session.query(
+            stored.c.user_id, func.min(stored.c.timestamp))
+        .group_by(stored.c.user_id))
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    now = datetime.now()
 
-    matches = Match.query \
-        .filter(Match.approved_winner == True) \
-        .filter(Match.approved_loser == True) \
-        .filter(Match.timestamp >= after_time) \
-        .order_by(Match.timestamp).all()
-    for match in matches:
-        update_match_ratings(match)
+    engine = replay.ReplayEngine()
+    checkpoints.restore_state(engine, before=after_time)
+    for user_id in user_ids:
+        t = first_timestamps.get(user_id)
+        # If user is created after `after_time`, reinit that users ratings.
+        # Users without any rating are initialized now.
+        if t is None or t >= after_time:
+            engine.init_player(user_id, t or now)
 
-def delete_match(match):
-    timestamp = match.timestamp
-    db.session.delete(match)
+    engine.play_components(replay.load_matches(after_time),
+        processes=current_app.config['RATING_REPLAY_PROCESSES'],
+        progress=progress)
+    # Ratings are only replaced once the replay is done, so the database is
+    # not locked for writing while matches are replayed
+    for model in (MatchRating, Rating):
+        model.query.filter(model.timestamp >= after_time).delete()
+    checkpoints.invalidate_checkpoints(after_time)
+    engine.write(candles=False)
+    candles.rebuild_candles(after_time)
+    checkpoints.update_checkpoints()
     db.session.commit()
-    recalculate_ratings(after_time=timestamp)
-
-def update_match_ratings(match):
-    if not match.approved_winner or not match.approved_loser:
-        # Don't update ratings, as match is not approved
-        return False
-    update_trueskill_by_match(match)
-    update_elo_by_match(match)
-    update_goal_difference_by_match(match)
+    bump_ratings_version()
 
-def update_elo_by_match(match):
-    elo_change = get_match_elo_change(match)
-    for p in match.winning_players:
-        r = Rating(user=p, match=match, rating_type='elo',
-        rating_value=p.get_current_elo() + elo_change,
-        timestamp=match.timestamp)
-        db.session.add(r)
-    for p in match.losing_players:
-        r = Rating(user=p, match=match, rating_type='elo',
-        rating_value=p.get_current_elo() - elo_change,
-        timestamp=match.timestamp)
-        db.session.add(r)
+def recalculate_player_ratings(user_ids, after_time, progress=None):
+    """
+    Recalculate ratings from `after_time` for the matches depending on the
+    given players: their own matches, and the matches of everyone who later
+    played one of those. Ratings of all other players are left untouched.
+    """
+    affected, matches = replay.find_affected_matches(user_ids, after_time)
+    match_ids = [m.id for m in matches]
+    engine = replay.ReplayEngine()
+    engine.load_state_without(match_ids, after=after_time, user_ids=affected)
+    engine.play_all(matches, progress=progress)
+    checkpoints.invalidate_checkpoints(after_time)
+    delete_match_ratings(match_ids)
+    engine.write(candles=False)
+    candles.rebuild_candles(after_time, user_ids=affected)
+    checkpoints.update_checkpoints()
     db.session.commit()
+    bump_ratings_version()
 
-def get_match_elo_change(match):
-    Qs = []
-    # First, get all winning players, then all losing players
-    for players in [match.winning_players, match.losing_players]:
-        # Get the avg elo for each team seperately
-        elos = [p.get_current_elo() for p in players]
-        avg_elo = sum(elos) / len(elos)
-        Q = 10 ** (avg_elo / 400)
-        Qs.append(Q)
-    Q_w, Q_l = Qs
-    exp_win = Q_w / (Q_w + Q_l)
-    change_w = match.importance * (1 - exp_win)
-    return change_w
-
-def update_trueskill_by_match(match):
-    w_ratings = []
-    l_ratings = []
-    for p in match.winning_players:
-        mu, sigma = p.get_current_trueskill()
-        w_ratings.append(ts.Rating(mu, sigma))
-
-    for p in match.losing_players:
-        mu, sigma = p.get_current_trueskill()
-        l_ratings.append(ts.Rating(mu, sigma))
+def delete_match_ratings(match_ids):
+    """
+    Delete the ratings given by the matches `match_ids`, a chunk of matches
+    per statement to stay below the databases limit of bound parameters
+    """
+    for start in range(0, len(match_ids), DELETE_CHUNK_SIZE):
+        chunk = match_ids[start:start + DELETE_CHUNK_SIZE]
+        for model in (MatchRating, Rating):
+            model.query.filter(model.match_id.in_(chunk)) \
+                .delete(synchronize_session=False)
 
-    rating_groups = [w_ratings, l_ratings]
-    new_ratings = ts.rate(rating_groups, ranks=[0,1])
-    players = match.winning_players + match.losing_players
-    new_ratings_flat = [item for sublist in new_ratings for item in sublist]
-    for player, rating in zip(players, new_ratings_flat):
-        r_m = Rating(
-            user=player,
-            match=match,
-            rating_type='trueskill_mu',
-            rating_value=rating.mu,
-            timestamp=match.timestamp,
-        )
-        r_s = Rating(
-            user=player,
-            match=match,
-            rating_type='trueskill_sigma',
-            rating_value=rating.sigma,
-            timestamp=match.timestamp,
-        )
-        db.session.add_all([r_m, r_s])
+def delete_match(match, recalculate=True):
+    """
+    Delete a match. Unless `recalculate` is False, ratings depending on it
+    are recalculated right away. Otherwise that is left to the caller, e.g.
+    with `jobs.enqueue_recalculation`.
+    """
+    timestamp = match.timestamp
+    user_ids = [p.id for p in match.players]
+    # Only approved matches have ratings
+    approved = match.approved_winner and match.approved_loser
+    for model in (MatchRating, Rating):
+        model.query.filter(model.match_id == match.id) \
+            .delete(synchronize_session=False)
+    # Don't let the session update the ratings just deleted
+    db.session.expire(match, ['ratings'])
+    db.session.delete(match)
+    if approved and recalculate:
+        db.session.flush()
+        recalculate_player_ratings(user_ids, after_time=timestamp)
+    else:
         db.session.commit()
+    # The players may have no later match
+    bump_players_version()
 
-def update_goal_difference_by_match(match):
-    diff = match.winner_score - match.loser_score
-
-    for p in match.winning_players:
-        current_gd = p.get_current_goal_difference()
-        r = Rating(user=p, match=match, timestamp=match.timestamp,
-            rating_type='goal_difference', rating_value=current_gd + diff)
-        db.session.add(r)
-    for p in match.losing_players:
-        current_gd = p.get_current_goal_difference()
-        r = Rating(user=p, match=match, timestamp=match.timestamp,
-            rating_type='goal_difference', rating_value=current_gd - diff)
-        db.session.add(r)
-    db.session.commit()
+def update_match_ratings(match, writer=None):
+    """
+    Rate an approved match, building on the players current ratings.
+    New ratings are collected in `writer` (a `replay.ReplayEngine`), so
+    several matches can be rated and written together. Without one, the
+    ratings are written right away. Committing is left to the caller.
+    """
+    if not match.approved_winner or not match.approved_loser:
+        # Don't update ratings, as match is not approved
+        return False
+    write = writer is None
+    if write:
+        writer = replay.ReplayEngine()
+    # Players already in the writer may have pending ratings
+    writer.load_current_state(
+        [p.id for p in match.players if p.id not in writer.states])
+    writer.play(replay.replay_match(match))
+    if write:
+        writer.write()
 
-def approve_match(match, approver):
+def approve_match(match, approver, recalculate=True):
+    """
+    Approve a match for the approvers team. Once both teams approved,
+    ratings are recalculated, unless `recalculate` is False.
+    """
     if approver in match.winning_players:
         match.approved_winner = True
     elif approver in match.losing_players:
@@ -178,8 +175,12 @@ def approve_match(match, approver):
     else:
         # User not playing
         return 'Cant approve match. You are not a player in this match'
-    db.session.commit()
-    recalculate_ratings(after_time=match.timestamp)
+    if match.approved_winner and match.approved_loser and recalculate:
+        # Commits the approval along with the new ratings
+        recalculate_player_ratings([p.id for p in match.players],
+            after_time=match.timestamp)
+    else:
+        db.session.commit()
     return 'Match approved'
 
 def make_new_match(winners, losers, w_score, l_score, importance,
@@ -216,7 +217,12 @@ def make_new_match(winners, losers, w_score, l_score, importance,
     db.session.flush()
 
     update_match_ratings(match)
+    if match.approved_winner and match.approved_loser:
+        checkpoints.invalidate_checkpoints(match.timestamp)
     db.session.commit()
+    bump_players_version()
+    if match.approved_winner and match.approved_loser:
+        bump_ratings_version()
     return match
 
 
@@ -225,6 +231,9 @@ def update_user(user, shortname, nickname, company):
     user.nickname = nickname
     user.company = company
     db.session.commit()
+    # Names and companies are shown on the leaderboard
+    bump_ratings_version()
+    bump_players_version()
     return user
 
 def update_password(user, password):
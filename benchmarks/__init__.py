@@ -0,0 +1,4 @@
+"""
+Benchmarks of the rating hot paths. Run them as modules from the repository
+root, e.g. `python -m benchmarks.bench_league`.
+"""
@@ -0,0 +1,98 @@
+"""
+Loading a rating history and building its hover text, with ORM objects and
+`iterrows` compared to the columnar loader and vectorized formatting.
+
+    python -m benchmarks.bench_history --ratings 10000
+"""
+import argparse
+from datetime import datetime, timedelta
+import time
+
+import numpy as np
+import pandas as pd
+
+from app import app, db
+from app.models import User, Rating, MatchRating, split_ratings
+from app.plots import get_ratings, format_numbers, format_ctimes
+
+
+def fill_database(n_ratings):
+    db.create_all()
+    user = User(shortname='BENCH', nickname='bench')
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2019, 1, 1)
+    # Stored like `replay.RatingWriter.write` does
+    match_ratings, other = split_ratings([dict(
+        user_id=user.id,
+        match_id=i or None,
+        rating_type='elo',
+        rating_value=1500 + 100 * np.sin(i / 100),
+        timestamp=start + timedelta(hours=i),
+    ) for i in range(n_ratings)])
+    db.session.bulk_insert_mappings(MatchRating, match_ratings)
+    db.session.bulk_insert_mappings(Rating, other)
+    db.session.commit()
+    return user
+
+
+def orm_path(user):
+    # As `plots.get_ratings` and `plots.get_scatter_plot` used to do it
+    user = User.query.filter_by(shortname=user.shortname).first()
+    ratings = MatchRating.query \
+        .filter(MatchRating.elo != None) \
+        .filter_by(user_id=user.id) \
+        .order_by(MatchRating.timestamp).all()
+    source = pd.DataFrame(dict(
+        date=np.array([r.timestamp for r in ratings], dtype=np.datetime64),
+        rating=[r.elo for r in ratings],
+        match_id=[r.match_id for r in ratings],
+    ))
+    hover_text = []
+    for index, row in source.iterrows():
+        match_id = row['match_id']
+        if pd.isnull(match_id):
+            match_id = 0
+        hover_text.append((
+            "Match ID: {match_id}<br>"+
+            "Time: {date}<br>"+
+            "Rating: {rating}<br>").format(
+                match_id = format(match_id, "1.0f"),
+                date = row["date"].ctime(),
+                rating = format(row["rating"], "1.0f")
+            ))
+    return hover_text
+
+
+def columnar_path(user):
+    source = get_ratings(user.shortname, 'elo')
+    return ("Match ID: " + format_numbers(source["match_id"].fillna(0))
+        + "<br>Time: " + format_ctimes(source["date"])
+        + "<br>Rating: " + format_numbers(source["rating"]) + "<br>").tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--ratings', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    with app.app_context():
+        user = fill_database(args.ratings)
+        results = {}
+        for name, path in [('orm', orm_path), ('columnar', columnar_path)]:
+            timings = []
+            for _ in range(args.repeat):
+                db.session.expire_all()
+                start = time.perf_counter()
+                results[name] = path(user)
+                timings.append(time.perf_counter() - start)
+            seconds = min(timings)
+            print(f'{name:>10}: {seconds * 1000:8.1f} ms '
+                  f'{args.ratings / seconds:12,.0f} ratings/s')
+        assert results['columnar'] == results['orm'], 'hover texts differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Throughput of the NumPy Elo/goal difference kernels compared to replaying
+one match at a time.
+
+    python -m benchmarks.bench_kernels --matches 100000 --players 60
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app import kernels
+
+
+def synthetic_arrays(n_matches, n_players, seed=0):
+    rng = random.Random(seed)
+    winners = np.full((n_matches, 2), kernels.PADDING, dtype=np.int64)
+    losers = np.full((n_matches, 2), kernels.PADDING, dtype=np.int64)
+    for i in range(n_matches):
+        team_size = rng.choice([1, 2])
+        players = rng.sample(range(n_players), 2 * team_size)
+        winners[i, :team_size] = players[:team_size]
+        losers[i, :team_size] = players[team_size:]
+    winner_score = np.full(n_matches, 10, dtype=np.int64)
+    loser_score = np.array([rng.randint(0, 9) for _ in range(n_matches)])
+    importance = np.array([rng.choice([8, 16, 32]) for _ in range(n_matches)])
+    return winners, losers, winner_score, loser_score, importance
+
+
+def scalar_replay(n_players, winners, losers, winner_score, loser_score,
+        importance):
+    # Like the kernels, keep every post-match value, not just the final ones
+    elo = [1500.0] * n_players
+    goal_difference = [0.0] * n_players
+    elo_after, goal_difference_after = [], []
+    for w, l, w_score, l_score, k in zip(winners.tolist(), losers.tolist(),
+            winner_score.tolist(), loser_score.tolist(), importance.tolist()):
+        w = [p for p in w if p != kernels.PADDING]
+        l = [p for p in l if p != kernels.PADDING]
+        change = kernels.get_elo_change([elo[p] for p in w], [elo[p] for p in l], k)
+        for p in w:
+            elo[p] += change
+            goal_difference[p] += w_score - l_score
+            elo_after.append(elo[p])
+            goal_difference_after.append(goal_difference[p])
+        for p in l:
+            elo[p] -= change
+            goal_difference[p] -= w_score - l_score
+            elo_after.append(elo[p])
+            goal_difference_after.append(goal_difference[p])
+    return elo, goal_difference
+
+
+def kernel_replay(n_players, winners, losers, winner_score, loser_score,
+        importance):
+    elo = np.full(n_players, 1500.0)
+    goal_difference = np.zeros(n_players)
+    kernels.replay_elo(elo, winners, losers, importance)
+    kernels.replay_goal_difference(goal_difference, winners, losers,
+        winner_score, loser_score)
+    return elo.tolist(), goal_difference.tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--matches', type=int, default=100000)
+    parser.add_argument('--players', type=int, default=60)
+    args = parser.parse_args()
+
+    arrays = synthetic_arrays(args.matches, args.players)
+    results = {}
+    for name, replay in [
+            ('scalar', scalar_replay),
+            ('kernel', kernel_replay)]:
+        start = time.perf_counter()
+        results[name] = replay(args.players, *arrays)
+        seconds = time.perf_counter() - start
+        print(f'{name:>10}: {seconds:7.3f} s '
+              f'{args.matches / seconds:12,.0f} matches/s')
+    for name, result in results.items():
+        assert result == results['scalar'], f'{name} results differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Timings of the task and page hot paths on synthetic leagues of several
+sizes, written as JSON to compare between commits.
+
+    python -m benchmarks.bench_league --scales small medium --output new.json
+    python -m benchmarks.bench_league --output new.json --compare old.json
+"""
+import argparse
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from app import app, db
+from app.cache import get_cache, get_plot_cache
+from app.models import User, Match, UserMatch
+from benchmarks.league import PASSWORD, generate_league
+
+# Arguments of `generate_league` for every scale
+SCALES = OrderedDict([
+    ('small', dict(users=20, companies=2, matches=500)),
+    ('medium', dict(users=100, companies=5, matches=5000)),
+    ('large', dict(users=400, companies=20, matches=20000)),
+])
+
+
+def stats(timings):
+    """
+    Summary of timings in seconds, in milliseconds. `first` is usually the
+    run with cold caches.
+    """
+    return dict(
+        repeat=len(timings),
+        first_ms=timings[0] * 1000,
+        min_ms=min(timings) * 1000,
+        median_ms=statistics.median(timings) * 1000,
+        max_ms=max(timings) * 1000,
+    )
+
+
+def measure(run, repeat):
+    """
+    Time `run` `repeat` times, each in a fresh app context like a request,
+    so the per-request rating caches start empty
+    """
+    timings = []
+    for _ in range(repeat):
+        with app.app_context():
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    return stats(timings)
+
+
+def most_active_player():
+    return db.session.query(User) \
+        .join(UserMatch, UserMatch.user_id == User.id) \
+        .group_by(User.id) \
+        .order_by(db.func.count().desc(), User.id) \
+        .first()
+
+
+def match_cycle(player_ids, repeat, seed=0):
+    """
+    Timings of adding, approving and deleting a match between the players
+    `player_ids`, which leaves the league as it was. Every other match is
+    backdated by a day, so approving and deleting it replays the matches
+    after it.
+    """
+    from app.tasks import make_new_match, approve_match, delete_match
+
+    rng = random.Random(seed)
+    latest = db.session.query(db.func.max(Match.timestamp)).scalar()
+    timings = dict(make_new_match=[], approve_match=[], delete_match=[])
+    for i in range(repeat):
+        team_size = 2 if len(player_ids) >= 4 and i % 4 >= 2 else 1
+        chosen = [db.session.get(User, user_id)
+            for user_id in rng.sample(player_ids, 2 * team_size)]
+        winners, losers = chosen[:team_size], chosen[team_size:]
+        timestamp = latest + timedelta(minutes=1)
+        if i % 2:
+            timestamp = latest - timedelta(days=1)
+
+        start = time.perf_counter()
+        match = make_new_match(winners=winners, losers=losers, w_score=10,
+            l_score=rng.randrange(10), importance=16,
+            user_creating_match=winners[0], timestamp=timestamp)
+        timings['make_new_match'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        approve_match(match, losers[0])
+        timings['approve_match'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        delete_match(match)
+        timings['delete_match'].append(time.perf_counter() - start)
+    return {name: stats(t) for name, t in timings.items()}
+
+
+def run_scale(league_args, repeat):
+    """
+    Generate a league in an empty database and time every hot path on it
+    """
+    from app.plots import plot_ratings
+    from app.tasks import choose_best_matchup, recalculate_ratings
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    # Cached values belong to the previous league
+    get_cache().clear()
+    get_plot_cache().clear()
+    start = time.perf_counter()
+    generate_league(**league_args)
+    setup_s = time.perf_counter() - start
+
+    # Sessions end with every app context, so only ids are kept
+    player = most_active_player()
+    player_id, shortname = player.id, player.shortname
+    teammate_ids = [user_id for (user_id,) in db.session.query(User.id)
+        .filter_by(company_id=player.company_id).order_by(User.id).limit(4)]
+
+    timings = OrderedDict()
+    timings.update(match_cycle(teammate_ids, repeat))
+    # Full recalculations are slow, a few runs are enough
+    timings['recalculate_ratings'] = measure(recalculate_ratings,
+        max(1, min(repeat, 3)))
+    timings['choose_best_matchup'] = measure(
+        lambda: choose_best_matchup(User.query.filter(
+            User.id.in_(teammate_ids)).all()), repeat)
+    timings['plot_ratings'] = measure(
+        lambda: plot_ratings(shortname, 'elo', 'D'), repeat)
+
+    client = app.test_client()
+    with app.app_context():
+        response = client.post('/login', data=dict(shortname=shortname,
+            password=PASSWORD))
+        assert response.status_code == 302, 'login failed'
+    for name, url in [('/index', '/index'), ('/user/<id>',
+            f'/user/{player_id}')]:
+        def get(url=url):
+            response = client.get(url)
+            assert response.status_code == 200, f'{url} failed'
+        timings[name] = measure(get, repeat)
+    with app.app_context():
+        client.get('/logout')
+    return dict(
+        league=league_args,
+        setup_s=setup_s,
+        timings=timings,
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of the fastest run of every timing against
+    `baseline`, the least noisy of the stats. Returns the timings slower by
+    more than `threshold` times.
+    """
+    slower = []
+    for scale, result in results['scales'].items():
+        old = baseline['scales'].get(scale)
+        if old is None:
+            continue
+        for name, timing in result['timings'].items():
+            if name not in old['timings']:
+                continue
+            ratio = timing['min_ms'] / old['timings'][name]['min_ms']
+            flag = ''
+            if ratio > threshold:
+                flag = '  slower'
+                slower.append((scale, name))
+            print(f'{scale:>8} {name:>20}: {ratio:6.2f}x{flag}')
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES),
+        default=['small', 'medium'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--doubles', type=float, default=0.3,
+        help='Fraction of 2v2 matches.')
+    parser.add_argument('--backdated', type=float, default=0.05,
+        help='Fraction of backdated matches.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this file.')
+    parser.add_argument('--compare',
+        help='Compare the timings to the results in this file.')
+    parser.add_argument('--threshold', type=float, default=1.25,
+        help='Fail if a timing is this many times slower than in --compare.')
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['WTF_CSRF_ENABLED'] = False
+    results = dict(
+        commit=git_commit(),
+        created=datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        repeat=args.repeat,
+        scales=OrderedDict(),
+    )
+    # A cache of its own, as every scale clears it, which would clear the
+    # shared cache of a running app
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        app.config['CACHE_PATH'] = os.path.join(directory, 'cache.db')
+        for scale in args.scales:
+            league_args = dict(SCALES[scale], doubles=args.doubles,
+                backdated=args.backdated, seed=args.seed)
+            result = run_scale(league_args, args.repeat)
+            results['scales'][scale] = result
+            print(f'{scale} ({result["setup_s"]:.1f} s to generate)')
+            for name, timing in result['timings'].items():
+                print(f'{name:>22}: {timing["median_ms"]:9.1f} ms median '
+                      f'{timing["min_ms"]:9.1f} ms min')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        if slower:
+            sys.exit(f'{len(slower)} timings slower than {args.threshold}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Replaying the matches of a league of independent companies serially and
+with every company replayed in its own worker process.
+
+    python -m benchmarks.bench_parallel --companies 8 --matches 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from app import app, db
+from app.replay import ReplayEngine, connected_components, load_matches
+from benchmarks.league import START, generate_league
+
+
+def replay(user_ids, matches, processes):
+    engine = ReplayEngine()
+    for user_id in user_ids:
+        engine.init_player(user_id, START)
+    engine.play_components(matches, processes=processes)
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--companies', type=int, default=8)
+    parser.add_argument('--players', type=int, default=20,
+        help='Players per company.')
+    parser.add_argument('--matches', type=int, default=20000)
+    parser.add_argument('--processes', type=int,
+        default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    # Generating the league bumps the cache versions, keep them out of the
+    # shared cache of a running app
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        app.config['CACHE_PATH'] = os.path.join(directory, 'cache.db')
+        db.create_all()
+        # Every company is a component, replayed in its own process
+        user_ids = generate_league(users=args.companies * args.players,
+            companies=args.companies, matches=args.matches, doubles=0.5,
+            backdated=0, rate=False).user_ids
+        matches = load_matches()
+        print(f'{len(matches)} matches in '
+              f'{len(connected_components(matches))} components, '
+              f'{args.processes} processes')
+        results = {}
+        timings = {}
+        for name, processes in [('serial', 1), ('parallel', args.processes)]:
+            runs = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                engine = replay(user_ids, matches, processes)
+                runs.append(time.perf_counter() - start)
+            timings[name] = min(runs)
+            results[name] = sorted(engine.current_ratings(),
+                key=lambda r: (r['user_id'], r['rating_type']))
+            print(f'{name:>10}: {timings[name] * 1000:8.1f} ms '
+                  f'{len(matches) / timings[name]:12,.0f} matches/s')
+        print(f'{"speedup":>10}: {timings["serial"] / timings["parallel"]:8.2f}x')
+        assert results['parallel'] == results['serial'], 'ratings differ'
+
+
+if __name__ == '__main__':
+    main()
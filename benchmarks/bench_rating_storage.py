@@ -0,0 +1,149 @@
+"""
+Size and read latency of ratings stored one row per rating type (`rating`)
+compared to one row per player and match (`match_rating`).
+
+    python -m benchmarks.bench_rating_storage --matches 20000 --players 50
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+
+from app import db
+from app.models import (Rating, MatchRating, MATCH_RATING_TYPES, rating_rows,
+    split_ratings)
+
+START = datetime(2019, 1, 1)
+
+
+def synthetic_ratings(n_matches, n_players, seed=0):
+    """
+    Ratings like a replay writes them, as dicts like `Rating` rows: the
+    initial ratings of every player, and every rating type of every player
+    after each 1v1 or 2v2 match
+    """
+    rng = random.Random(seed)
+    ratings = []
+    for p in range(1, n_players + 1):
+        for rating_type in MATCH_RATING_TYPES:
+            ratings.append(dict(user_id=p, match_id=None,
+                rating_type=rating_type, rating_value=rng.random(),
+                timestamp=START))
+    for m in range(1, n_matches + 1):
+        timestamp = START + timedelta(minutes=m)
+        players = rng.sample(range(1, n_players + 1), rng.choice([2, 4]))
+        for rating_type in MATCH_RATING_TYPES:
+            for p in players:
+                ratings.append(dict(user_id=p, match_id=m,
+                    rating_type=rating_type, rating_value=rng.random(),
+                    timestamp=timestamp))
+    return ratings
+
+
+def create_database(path, ratings, wide):
+    engine = create_engine(f'sqlite:///{path}')
+    tables = [Rating.__table__, MatchRating.__table__]
+    # Only the rating tables, without foreign key targets
+    db.Model.metadata.create_all(engine, tables=tables)
+    with engine.begin() as connection:
+        if wide:
+            match_ratings, _ = split_ratings(ratings)
+            connection.execute(MatchRating.__table__.insert(), match_ratings)
+        else:
+            connection.execute(Rating.__table__.insert(), ratings)
+    with engine.connect() as connection:
+        connection.exec_driver_sql('VACUUM')
+    return engine
+
+
+def long_history(user_id, rating_types):
+    return select(Rating.rating_type, Rating.timestamp, Rating.rating_value,
+            Rating.match_id) \
+        .where(Rating.user_id == user_id) \
+        .where(Rating.rating_type.in_(rating_types)) \
+        .order_by(Rating.rating_type, Rating.timestamp, Rating.id)
+
+
+def wide_history(user_id, rating_types):
+    stored = rating_rows(rating_types)
+    return select(stored.c.rating_type, stored.c.timestamp,
+            stored.c.rating_value, stored.c.match_id) \
+        .where(stored.c.user_id == user_id) \
+        .order_by(stored.c.rating_type, stored.c.timestamp, stored.c.id)
+
+
+def long_match_values(user_id, match_ids):
+    return select(Rating.match_id, Rating.rating_value) \
+        .where(Rating.user_id == user_id) \
+        .where(Rating.match_id.in_(match_ids)) \
+        .where(Rating.rating_type == 'elo')
+
+
+def wide_match_values(user_id, match_ids):
+    stored = rating_rows(['elo'])
+    return select(stored.c.match_id, stored.c.rating_value) \
+        .where(stored.c.user_id == user_id) \
+        .where(stored.c.match_id.in_(match_ids))
+
+
+# (name, query of the old layout, query of the new layout) by user id and
+# the ids of a page of the users matches
+QUERIES = [
+    ('elo history',
+        lambda u, _: long_history(u, ['elo']),
+        lambda u, _: wide_history(u, ['elo'])),
+    ('trueskill history',
+        lambda u, _: long_history(u, ['trueskill_mu', 'trueskill_sigma']),
+        lambda u, _: wide_history(u, ['trueskill_mu', 'trueskill_sigma'])),
+    ('match page elo',
+        lambda u, ids: long_match_values(u, ids),
+        lambda u, ids: wide_match_values(u, ids)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--matches', type=int, default=20000)
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    ratings = synthetic_ratings(args.matches, args.players)
+    user_id = 1
+    match_ids = sorted({r['match_id'] for r in ratings
+        if r['user_id'] == user_id and r['match_id'] is not None})[-25:]
+    with tempfile.TemporaryDirectory() as directory:
+        engines = {}
+        for name, wide in [('long', False), ('wide', True)]:
+            path = os.path.join(directory, f'{name}.db')
+            engines[name] = create_database(path, ratings, wide)
+            table = MatchRating if wide else Rating
+            with engines[name].connect() as connection:
+                rows = connection.execute(
+                    select(db.func.count()).select_from(table)).scalar()
+            print(f'{name:>10}: {rows:10,} rows '
+                  f'{os.path.getsize(path) / 1024 ** 2:8.1f} MB')
+
+        for name, long_query, wide_query in QUERIES:
+            results = {}
+            for layout, query in [('long', long_query), ('wide', wide_query)]:
+                statement = query(user_id, match_ids)
+                timings = []
+                with engines[layout].connect() as connection:
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        results[layout] = connection.execute(statement) \
+                            .fetchall()
+                        timings.append(time.perf_counter() - start)
+                print(f'{name:>20} {layout:>5}: '
+                      f'{min(timings) * 1000:8.2f} ms')
+            assert sorted(results['long']) == sorted(results['wide']), \
+                f'{name} differs'
+
+
+if __name__ == '__main__':
+    main()
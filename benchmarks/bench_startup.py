@@ -0,0 +1,69 @@
+"""
+Import time of the app, as every gunicorn worker, `flask` command and test
+session pays it, measured with `python -X importtime`.
+
+    python -m benchmarks.bench_startup --repeat 5 --budget 1500
+"""
+import argparse
+from collections import namedtuple
+import os
+import subprocess
+import sys
+
+# Only imported when a chart is drawn or matches are rated
+HEAVY_MODULES = ('numpy', 'pandas', 'plotly')
+
+ImportTime = namedtuple('ImportTime', ['self_us', 'cumulative_us', 'depth'])
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module='app'):
+    """
+    `ImportTime` of every module imported by `import <module>` in a fresh
+    interpreter, by module name
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <indented name>
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = ImportTime(int(self_us), int(cumulative_us),
+            depth)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=None,
+        help='Fail if the best import time exceeds this many milliseconds.')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[args.module].cumulative_us)
+    total_ms = best[args.module].cumulative_us / 1000
+    print(f'import {args.module}: {total_ms:8.1f} ms')
+    # What the module imports directly, where lazy imports help
+    top_level = sorted(((t.cumulative_us, name) for name, t in best.items()
+        if t.depth == 1), reverse=True)
+    for cumulative_us, name in top_level[:args.top]:
+        print(f'{name:>30}: {cumulative_us / 1000:8.1f} ms')
+
+    heavy = [name for name in HEAVY_MODULES if name in best]
+    if heavy:
+        sys.exit(f'imported at startup: {", ".join(heavy)}')
+    if args.budget is not None and total_ms > args.budget:
+        sys.exit(f'over the budget of {args.budget:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
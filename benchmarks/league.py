@@ -0,0 +1,96 @@
+"""
+Deterministic synthetic leagues for the benchmarks.
+
+A league is a number of companies whose players only play each other, with
+a mix of 1v1 and 2v2 matches. Some matches are backdated: registered after
+matches played later, as when results are entered late, which is what makes
+recalculations replay history.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+import random
+
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app.cache import bump_players_version
+from app.models import Company, User, Match, UserMatch
+from app.replay import ReplayEngine
+
+START = datetime(2019, 1, 1)
+# Password of every generated player
+PASSWORD = 'bench'
+
+League = namedtuple('League', ['company_ids', 'user_ids', 'match_ids'])
+
+
+def generate_league(users=40, companies=2, matches=2000, doubles=0.3,
+        backdated=0.05, seed=0, rate=True):
+    """
+    Add a league to an empty database: `users` players spread evenly over
+    `companies`, and `matches` approved matches one minute apart. A
+    `doubles` fraction of the matches is 2v2 (in companies of at least four
+    players), and a `backdated` fraction is played before the match
+    registered before it. Every player gets the initial ratings at the
+    start of the league. Unless `rate` is False, all matches are then rated
+    with `tasks.recalculate_ratings`.
+
+    The same arguments give the same league. Returns a `League` of ids.
+    """
+    from app.tasks import recalculate_ratings
+
+    if users < 2 * companies:
+        raise ValueError('every company needs at least two players')
+    rng = random.Random(seed)
+    company_rows = [Company(name=f'Company {c}') for c in range(companies)]
+    db.session.add_all(company_rows)
+    db.session.flush()
+    # Hashing is slow on purpose, and every player may share the hash
+    password_hash = generate_password_hash(PASSWORD)
+    user_rows = [User(shortname=f'P{i}', nickname=f'player {i}',
+            company_id=company_rows[i % companies].id,
+            password_hash=password_hash)
+        for i in range(users)]
+    db.session.add_all(user_rows)
+    db.session.flush()
+    members = [[u.id for u in user_rows[c::companies]]
+        for c in range(companies)]
+
+    first_id = (db.session.query(db.func.max(Match.id)).scalar() or 0) + 1
+    match_rows, user_match_rows = [], []
+    for i in range(matches):
+        minutes = i
+        if i and rng.random() < backdated:
+            minutes = rng.randrange(i)
+        players = rng.choice(members)
+        team_size = 2 if len(players) >= 4 and rng.random() < doubles else 1
+        players = rng.sample(players, 2 * team_size)
+        match_id = first_id + i
+        match_rows.append(dict(
+            id=match_id,
+            winner_score=10,
+            loser_score=rng.randrange(10),
+            importance=rng.choice([8, 16, 32]),
+            timestamp=START + timedelta(minutes=minutes),
+            approved_winner=True,
+            approved_loser=True,
+        ))
+        user_match_rows += [dict(user_id=p, match_id=match_id,
+                win=k < team_size)
+            for k, p in enumerate(players)]
+    db.session.bulk_insert_mappings(Match, match_rows)
+    db.session.bulk_insert_mappings(UserMatch, user_match_rows)
+
+    engine = ReplayEngine()
+    for user in user_rows:
+        engine.init_player(user.id, START)
+    engine.write()
+    db.session.commit()
+    bump_players_version()
+    if rate:
+        recalculate_ratings()
+    return League(
+        company_ids=[c.id for c in company_rows],
+        user_ids=[u.id for u in user_rows],
+        match_ids=[m['id'] for m in match_rows],
+    )
@@ -9,4 +9,30 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
\ No newline at end of file
+    LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
+    # `sqlite` shares the cache and its versions in a file between all
+    # processes, e.g. gunicorn workers. `memory` caches per process, and a
+    # version bumped in one process is not seen by the others, so only use
+    # it with a single process.
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'sqlite'
+    CACHE_PATH = os.environ.get('CACHE_PATH') or \
+        os.path.join(basedir, 'cache.db')
+    CACHE_SIZE = int(os.environ.get('CACHE_SIZE') or 1024)
+    # Bytes of rendered plots kept in memory by every process
+    PLOT_CACHE_BYTES = int(os.environ.get('PLOT_CACHE_BYTES') or 32 * 1024 ** 2)
+    # Bounds of a rating comparison, keeping its query and figure small
+    RATING_COMPARISON_MAX_USERS = int(
+        os.environ.get('RATING_COMPARISON_MAX_USERS') or 8)
+    RATING_COMPARISON_MAX_POINTS = int(
+        os.environ.get('RATING_COMPARISON_MAX_POINTS') or 500)
+    # Number of approved matches between rating checkpoints
+    RATING_CHECKPOINT_SPACING = int(
+        os.environ.get('RATING_CHECKPOINT_SPACING') or 500)
+    # Worker processes replaying the independent groups of players (e.g.
+    # companies) of a full recalculation in parallel. 1 replays serially.
+    RATING_REPLAY_PROCESSES = int(
+        os.environ.get('RATING_REPLAY_PROCESSES') or 1)
+    # How queued rating recalculations are run: `thread` in a background
+    # thread, `eager` right away in the request, `none` only with
+    # `flask jobs run`
+    RATING_JOBS_WORKER = os.environ.get('RATING_JOBS_WORKER') or 'thread'
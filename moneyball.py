@@ -1,5 +1,5 @@
 from app import app, db
-from app.models import User, Match, UserMatch, Rating
+from app.models import User, Match, UserMatch, Rating, CurrentRating
 
 @app.shell_context_processor
 def make_shell_context():
@@ -8,5 +8,6 @@ def make_shell_context():
         'User': User, 
         'Match': Match, 
         'UserMatch': UserMatch,
-        'Rating' : Rating
+        'Rating' : Rating,
+        'CurrentRating': CurrentRating,
         }
\ No newline at end of file
@@ -2,12 +2,16 @@ import pytest
 
 
 @pytest.fixture(scope='module')
-def test_client():
+def test_client(tmp_path_factory):
     from app import app
     
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    # One cache file for the session, as the app keeps its first cache
+    app.config['CACHE_PATH'] = str(tmp_path_factory.getbasetemp() / 'cache.db')
     app.config['TESTING'] = True
     app.config['WTF_CSRF_ENABLED'] = False
+    # Run recalculation jobs in the request, so tests see the new ratings
+    app.config['RATING_JOBS_WORKER'] = 'eager'
     testing_client = app.test_client()
     ctx = app.app_context()
     ctx.push()
@@ -17,7 +21,11 @@ def test_client():
 @pytest.fixture(scope='function')
 def empty_db(test_client):
     from app import db
+    from app.cache import get_cache, get_plot_cache
     db.create_all()
+    # Cached values belong to the previous test's database
+    get_cache().clear()
+    get_plot_cache().clear()
     yield db
     db.session.remove()
     db.drop_all()
@@ -20,6 +20,9 @@ def test_login(test_client, filled_db):
     # Return to index
     assert response.status_code == 200
     assert b'Highest ranking players' in response.data
+    assert b'(KASPER) 7-11' in response.data
+    # Only players from the same company are on the leaderboard
+    assert b'FELIPE' not in response.data
     # Flash success message
     assert b'successfully logged in' in response.data
     # Not on login page
@@ -135,11 +138,181 @@ def test_user_page(test_client, filled_db):
 
     # TODO: Is there any way to test plotting functions
 
+def test_user_page_match_ratings(test_client, many_matches_db):
+    from flask import g
+    from app.models import User
+    u1, u2 = User.query.all()
+    assert len(u1.matches) > 20
+
+    # Only the ratings of the latest 10 won and lost matches are loaded
+    g.pop('rating_cache', None)
+    response = test_client.get(f'/user/{u1.id}')
+    assert response.status_code == 200
+    shown = u1.won_matches[-10:] + u1.lost_matches[-10:]
+    assert set(g.rating_cache['match']) \
+        == {(u1.id, m.id, 'elo') for m in shown}
+
 def test_plot_candlestick(test_client, many_matches_db):
     # Just checking we are not crashing when running candlestick part of the plotting code
+    for resample_interval in ['D', 'W']:
+        response = test_client.post('/user/1',
+            data=dict(resample_interval=resample_interval))
+        assert response.status_code == 200
+        assert b'User' in response.data
+        assert b'candlestick' in response.data
+
+    # Otherwise the chart is loaded by the page
     response = test_client.get('/user/1')
     assert response.status_code == 200
-    assert b'User' in response.data
+    assert b'/api/user/1/ratings?rating_type=elo' in response.data
+
+
+def test_api_user_ratings(test_client, many_matches_db):
+    from app import db
+    from app.models import User, rating_rows
+    from app.tasks import make_new_match, approve_match
+    u1, u2 = User.query.all()
+    stored = rating_rows()
+    ratings = db.session.query(stored) \
+        .filter_by(user_id=u1.id, rating_type='elo') \
+        .order_by(stored.c.timestamp, stored.c.id).all()
+
+    response = test_client.get('/api/user/1/ratings')
+    assert response.status_code == 200
+    series = response.json
+    assert series['total'] == len(ratings) == 24
+    assert series['value'] == [r.rating_value for r in ratings]
+    assert series['match_id'] == [r.match_id for r in ratings]
+    assert series['match_id'][0] is None
+    # Stored times, as they are
+    assert series['time'] == [r.timestamp.isoformat(timespec='milliseconds')
+        for r in ratings]
+
+    # Downsampled, keeping the first and last point
+    response = test_client.get('/api/user/1/ratings?points=5&rating_type=trueskill_mu')
+    series = response.json
+    assert series['total'] == 24
+    assert len(series['time']) == len(series['value']) == 5
+    assert series['time'] == sorted(series['time'])
+    mu = db.session.query(stored) \
+        .filter_by(user_id=u1.id, rating_type='trueskill_mu') \
+        .order_by(stored.c.timestamp, stored.c.id).all()
+    assert series['value'][0] == mu[0].rating_value
+    assert series['value'][-1] == mu[-1].rating_value
+
+    # Time window
+    after = ratings[10].timestamp.isoformat()
+    response = test_client.get(f'/api/user/1/ratings?after={after}')
+    assert response.json['total'] == 14
+
+    # Revalidation is cheap until a new rating lands
+    response = test_client.get('/api/user/1/ratings')
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+    # Revalidated by the ETag alone, as rating times aren't write times
+    assert 'Last-Modified' not in response.headers
+    response = test_client.get('/api/user/1/ratings',
+        headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+    response = test_client.get('/api/user/1/ratings',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    m = make_new_match(winners=[u1], losers=[u2], w_score=10, l_score=2,
+        importance=16, user_creating_match=u1)
+    approve_match(m, u2)
+    response = test_client.get('/api/user/1/ratings',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['total'] == 25
+
+    assert test_client.get('/api/user/1000/ratings').status_code == 404
+    assert test_client.get(
+        '/api/user/1/ratings?rating_type=nope').status_code == 400
+    assert test_client.get(
+        '/api/user/1/ratings?after=yesterday').status_code == 400
+    assert test_client.get(
+        '/api/user/1/ratings?points=many').status_code == 400
+
+
+def test_compare_ratings(test_client, many_matches_db):
+    from app.models import User
+    from app.plots import rating_comparison
+    u1, u2 = User.query.all()
+
+    response = test_client.get('/api/ratings/compare?user_id=1&user_id=2'
+        '&rating_type=elo&interval=W')
+    assert response.status_code == 200
+    series = response.json
+    frame = rating_comparison([1, 2], 'elo', 'W')
+    assert len(series['time']) == len(frame)
+    assert [s['shortname'] for s in series['series']] == ['KASPER', 'FELIPE']
+    assert series['series'][0]['value'] == frame[1].tolist()
+
+    response = test_client.get('/api/ratings/compare?user_id=1&points=1')
+    assert len(response.json['time']) == 1
+    assert response.json['series'][0]['value'] == [u1.get_current_elo()]
+
+    for query in ['', 'user_id=1&rating_type=nope', 'user_id=1&interval=M',
+            'user_id=x', '&'.join(f'user_id={i}' for i in range(1, 10))]:
+        response = test_client.get(f'/api/ratings/compare?{query}')
+        assert response.status_code == 400
+    assert test_client.get('/api/ratings/compare?user_id=99') \
+        .status_code == 404
+
+    response = test_client.get('/compare')
+    assert response.status_code == 200
+    assert b'Compare ratings' in response.data
+    response = test_client.post('/compare', data=dict(players=['1', '2'],
+        rating_type='trueskill_mu', resample_interval='D'))
+    assert response.status_code == 200
+    assert b'Performance over time' in response.data
+    assert b'"name":"KASPER"' in response.data
+
+
+def test_user_matches_pages(test_client, many_matches_db):
+    from sqlalchemy import event
+    from app import db
+    from app.models import User, rating_rows
+    u1, u2 = User.query.all()
+    expected = sorted(u1.matches, key=lambda m: (m.timestamp, m.id),
+        reverse=True)
+
+    queries = []
+
+    def count_query(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    matches, page_queries, before = [], [], None
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+    try:
+        while True:
+            del queries[:]
+            url = '/api/user/1/matches?per_page=5'
+            if before:
+                url += f'&before={before}'
+            response = test_client.get(url)
+            assert response.status_code == 200
+            page_queries.append(len(queries))
+            matches += response.json['matches']
+            before = response.json['next']
+            if before is None:
+                break
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_query)
+    assert [m['id'] for m in matches] == [m.id for m in expected]
+    # The same queries for every page
+    assert len(set(page_queries)) == 1
+    assert matches[0]['winners'] == [dict(id=1, shortname='KASPER')]
+    assert matches[0]['win'] is True
+    assert matches[0]['elo'] == db.session.query(rating_rows(['elo'])) \
+        .filter_by(user_id=1, match_id=matches[0]['id']).one().rating_value
+
+    response = test_client.get('/user/1/all_matches?per_page=5')
+    assert response.status_code == 200
+    assert b'Older matches' in response.data
+    assert test_client.get('/api/user/1/matches?before=nope') \
+        .status_code == 400
 
 
 def test_match_page(test_client, filled_db):
@@ -186,6 +359,28 @@ def test_create_match_page(test_client, filled_db):
     assert b'Match created' in response.data
     assert response.status_code == 200
 
+def test_create_match_page_queries(test_client, filled_db):
+    from sqlalchemy import event
+    from app import db
+    login(test_client)
+    test_client.get('/create_match')
+    queries = []
+
+    def count_query(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+    try:
+        response = test_client.get('/create_match')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_query)
+    assert response.status_code == 200
+    assert b'FELIPE' in response.data
+    # The logged in user and the cached players
+    assert len(queries) <= 2
+    logout(test_client)
+
+
 @pytest.mark.parametrize(
     ('winner_ids', 'loser_ids', 'w_score', 'l_score', 'message'), (
     ([1], [2], 10, 7, b'Match created'),
@@ -228,3 +423,83 @@ def register_match(client, winners, losers, w_score, l_score, importance):
         ), follow_redirects=True
     )
 
+
+
+def test_recalculation_job_status(test_client, filled_db):
+    from app.models import User, RecalculationJob
+    from app.tasks import make_new_match
+    u1, u2 = User.query.all()
+    m = make_new_match(winners=[u1], losers=[u2], w_score=10, l_score=2,
+        importance=16, user_creating_match=u1)
+
+    logout(test_client)
+    login(test_client, 'felipe', '321')
+    response = test_client.post(f'/match/{m.id}/approve',
+        follow_redirects=True)
+    assert b'Recalculating ratings (job 1)' in response.data
+    assert u1.get_current_number_matches_approved() == 4
+
+    response = test_client.get('/jobs/1')
+    assert response.status_code == 200
+    assert response.json['status'] == 'done'
+    assert response.json['progress'] == 1
+    assert response.json['heartbeat'] is not None
+    assert response.json['user_ids'] == [u1.id, u2.id]
+    assert test_client.get('/jobs/1000').status_code == 404
+
+    # Approving it again changes nothing to recalculate
+    response = test_client.post(f'/match/{m.id}/approve',
+        follow_redirects=True)
+    assert b'Recalculating ratings' not in response.data
+    assert RecalculationJob.query.count() == 1
+
+
+def test_import_matches_upload(test_client, filled_db):
+    import io
+    from app.models import Match
+    from app.tasks import create_user
+    create_user('boss', 'Boss', password='admin', company=None, is_admin=1)
+    n_matches = Match.query.count()
+    csv = (b'winners,losers,winner_score,loser_score,timestamp\n'
+        b'KASPER,FELIPE,10,5,2018-01-02T10:00:00\n'
+        b'KASPER,NOBODY,10,5,2018-01-02T11:00:00\n')
+
+    # Only for admins
+    login(test_client)
+    response = test_client.get('/import_matches', follow_redirects=True)
+    assert b'Import matches' not in response.data
+    logout(test_client)
+
+    login(test_client, 'boss', 'admin')
+    response = test_client.post('/import_matches', data=dict(
+        file=(io.BytesIO(csv), 'matches.csv')), follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Imported 1 matches, skipped 1 rows' in response.data
+    assert b'Recalculating ratings (job' in response.data
+    assert b'Line 3: unknown players: NOBODY' in response.data
+    assert Match.query.count() == n_matches + 1
+    logout(test_client)
+
+
+def test_export(test_client, filled_db):
+    from app import db
+    from app.models import rating_rows
+    assert test_client.get('/export/ratings.csv').status_code == 302
+    login(test_client)
+    response = test_client.get('/export/ratings.csv?rating_type=elo')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    lines = response.data.decode().splitlines()
+    assert lines[0] == 'id,user_id,shortname,match_id,rating_type,' \
+        'rating_value,timestamp'
+    assert len(lines) == 1 + db.session.query(rating_rows(['elo'])).count()
+
+    response = test_client.get('/export/matches.jsonl?after=2000-01-01')
+    assert response.status_code == 200
+    assert len(response.data.splitlines()) == 3
+    assert test_client.get('/export/users.csv').status_code == 404
+    assert test_client.get('/export/matches.xml').status_code == 404
+    assert test_client.get('/export/matches.csv?before=soon') \
+        .status_code == 400
+    logout(test_client)
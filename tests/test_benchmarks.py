@@ -0,0 +1,30 @@
+import pytest
+
+
+def test_bench_history(empty_db):
+    from benchmarks.bench_history import fill_database, orm_path, columnar_path
+
+    user = fill_database(50)
+    hover_text = columnar_path(user)
+    assert len(hover_text) == 50
+    assert hover_text == orm_path(user)
+
+
+def test_bench_rating_storage(tmp_path):
+    from benchmarks.bench_rating_storage import (synthetic_ratings,
+        create_database, QUERIES)
+
+    ratings = synthetic_ratings(20, 4)
+    match_ids = sorted({r['match_id'] for r in ratings
+        if r['user_id'] == 1 and r['match_id'] is not None})
+    engines = {layout: create_database(tmp_path / f'{layout}.db', ratings,
+            wide=layout == 'wide')
+        for layout in ['long', 'wide']}
+    for name, long_query, wide_query in QUERIES:
+        results = {}
+        for layout, query in [('long', long_query), ('wide', wide_query)]:
+            with engines[layout].connect() as connection:
+                results[layout] = connection.execute(
+                    query(1, match_ids)).fetchall()
+        assert results['long'], name
+        assert sorted(results['long']) == sorted(results['wide']), name
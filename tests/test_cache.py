@@ -0,0 +1,170 @@
+import pytest
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    from app.cache import LRUCache, SQLiteCache
+    if request.param == 'memory':
+        return LRUCache(maxsize=2)
+    return SQLiteCache(str(tmp_path / 'cache.db'), maxsize=2)
+
+
+def test_cache_get_set(cache):
+    assert cache.get('a') is None
+    cache.set('a', [1, 2])
+    cache.set(('b', 1), 'b')
+    assert cache.get('a') == [1, 2]
+    assert cache.get(('b', 1)) == 'b'
+    assert cache.stats() == dict(hits=2, misses=1, size=2)
+
+    # 'a' was used most recently, so 'b' is evicted
+    cache.get('a')
+    cache.set('c', 'c')
+    assert cache.get(('b', 1)) is None
+    assert cache.get('a') == [1, 2]
+    assert len(cache) == 2
+
+    cache.clear()
+    assert cache.get('a') is None
+    assert cache.stats() == dict(hits=0, misses=1, size=0)
+
+
+def test_cache_versions(cache):
+    assert cache.get_version('ratings') == 0
+    assert cache.bump_version('ratings') == 1
+    assert cache.bump_version('ratings') == 2
+    assert cache.get_version('ratings') == 2
+    assert cache.get_version('other') == 0
+
+
+def test_sqlite_cache_is_shared(tmp_path):
+    from app.cache import SQLiteCache
+    path = str(tmp_path / 'cache.db')
+    worker_1, worker_2 = SQLiteCache(path), SQLiteCache(path)
+    worker_1.set('a', 1)
+    worker_1.bump_version('ratings')
+    assert worker_2.get('a') == 1
+    assert worker_2.get_version('ratings') == 1
+
+
+def test_default_cache_is_shared(empty_db):
+    from app import app
+    from app.cache import SQLiteCache, get_cache, bump_ratings_version
+
+    # Another gunicorn worker opening the same cache sees every bump
+    other_worker = SQLiteCache(app.config['CACHE_PATH'])
+    version = other_worker.get_version('ratings')
+    assert isinstance(get_cache(), SQLiteCache)
+    bump_ratings_version()
+    assert other_worker.get_version('ratings') == version + 1
+
+
+def test_leaderboard_cache_invalidation(filled_db):
+    from app.models import User
+    from app.cache import get_cache
+    from app.leaderboard import get_cached_leaderboard
+    from app.tasks import make_new_match, approve_match, delete_match
+
+    cache = get_cache()
+    u1, u2 = User.query.all()
+    rows = get_cached_leaderboard(u1.company_id)
+    assert get_cached_leaderboard(u1.company_id) == rows
+    assert cache.hits == 1
+
+    # Pending matches don't change the leaderboard
+    version = cache.get_version('ratings')
+    m = make_new_match(winners=[u1], losers=[u2], w_score=10, l_score=0,
+        importance=16, user_creating_match=u1)
+    assert cache.get_version('ratings') == version
+
+    approve_match(m, u2)
+    assert cache.get_version('ratings') > version
+    new_rows = get_cached_leaderboard(u1.company_id)
+    assert new_rows[0].rating > rows[0].rating
+    assert new_rows[0].matches_played == rows[0].matches_played + 1
+
+    version = cache.get_version('ratings')
+    delete_match(m)
+    assert cache.get_version('ratings') > version
+    assert get_cached_leaderboard(u1.company_id) == rows
+
+
+def test_cache_max_bytes():
+    import sys
+    from app.cache import LRUCache, hit_rate
+    size = sys.getsizeof('x' * 100)
+    cache = LRUCache(maxsize=10, maxbytes=2 * size)
+    cache.set('a', 'a' * 100)
+    cache.set('b', 'b' * 100)
+    assert cache.stats() == dict(hits=0, misses=0, size=2, bytes=2 * size)
+    assert hit_rate(cache.stats()) is None
+
+    # Over the byte limit, the least recently used entry goes
+    cache.get('a')
+    cache.set('c', 'c' * 100)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a' * 100
+    assert cache.stats() == dict(hits=2, misses=1, size=2, bytes=2 * size)
+    assert hit_rate(cache.stats()) == 2 / 3
+
+    # Replacing an entry counts its new size only
+    cache.set('a', 'a')
+    assert cache.nbytes == size + sys.getsizeof('a')
+
+    # Entries larger than the limit are not kept
+    cache.set('d', 'd' * 1000)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_plot_cache_invalidation(many_matches_db):
+    from app.models import User
+    from app.cache import get_plot_cache
+    from app.plots import get_cached_plot_ratings
+    from app.tasks import make_new_match, approve_match
+
+    cache = get_plot_cache()
+    u1, u2 = User.query.all()
+    div = get_cached_plot_ratings(u1, 'elo', 'D')
+    assert get_cached_plot_ratings(u1, 'elo', 'D') == div
+    assert get_cached_plot_ratings(u1, 'elo', 'W') != div
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['size'] == 2
+
+    # A new rating changes the key, so the plot is rendered again
+    m = make_new_match(winners=[u1], losers=[u2], w_score=10, l_score=0,
+        importance=16, user_creating_match=u1)
+    approve_match(m, u2)
+    get_cached_plot_ratings(u1, 'elo', 'D')
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['size'] == 3
+
+
+def test_recent_players_cache(filled_db):
+    from datetime import datetime
+    from app.models import User
+    from app.cache import get_cache
+    from app.players import recent_player_ids, get_cached_recent_player_ids
+    from app.tasks import create_user, make_new_match, delete_match
+
+    def expected(users):
+        return [u.id for u in sorted(users,
+            key=lambda u: (u.get_recent_match_timestamp(), u.shortname),
+            reverse=True)]
+
+    u1, u2 = User.query.all()
+    u3 = create_user('u3', 'Three', password='123', company=u1.company)
+    u4 = create_user('u4', 'Four', password='123', company=u1.company)
+    assert recent_player_ids() == expected([u1, u2, u3, u4])
+    assert recent_player_ids(u1.company_id) == expected([u1, u3, u4])
+
+    cache = get_cache()
+    user_ids = get_cached_recent_player_ids()
+    assert get_cached_recent_player_ids() == user_ids
+    assert cache.hits == 1
+
+    # New and deleted matches change the order
+    m = make_new_match(winners=[u4], losers=[u3], w_score=10, l_score=0,
+        importance=16, timestamp=datetime(2100, 1, 1))
+    assert get_cached_recent_player_ids()[:2] == [u4.id, u3.id]
+    delete_match(m)
+    assert get_cached_recent_player_ids() == user_ids
@@ -129,4 +129,804 @@ def test_approve_match(filled_db):
     assert elo1 != u1.get_current_elo()
     assert elo2 != u2.get_current_elo()
     assert not u1.can_approve_match(m)
-    assert not u2.can_approve_match(m)
\ No newline at end of file
+    assert not u2.can_approve_match(m)
+
+def test_recalculate_ratings_matches_per_match_path(filled_db):
+    from datetime import datetime, timedelta
+    from app import db
+    from app.models import (User, Match, Rating, MatchRating, CurrentRating,
+        rating_rows)
+    from app.tasks import (create_user, make_new_match, init_ratings,
+        update_match_ratings, recalculate_ratings)
+    stored = rating_rows()
+
+    u1, u2 = User.query.all()
+    u3 = create_user('u3', 'Three', password='123', company=None)
+    u4 = create_user('u4', 'Four', password='123', company=None)
+    start = datetime.now()
+    teams = [
+        ([u1, u3], [u2, u4], 10, 3, 16),
+        ([u2], [u3], 10, 8, 32),
+        ([u4, u2], [u1, u3], 10, 0, 8),
+        ([u3], [u4], 10, 9, 16),
+        ([u1, u4], [u2, u3], 10, 5, 32),
+    ]
+    for i, (winners, losers, w_score, l_score, importance) in enumerate(teams):
+        m = make_new_match(winners=winners, losers=losers, w_score=w_score,
+            l_score=l_score, importance=importance,
+            timestamp=start + timedelta(minutes=i))
+        m.approved_winner, m.approved_loser = True, True
+    db.session.commit()
+
+    def snapshot():
+        return {
+            (r.user_id, r.match_id, r.rating_type): r.rating_value
+            for r in db.session.query(stored).all()
+        }
+
+    # Replay using the per-match path
+    first_timestamps = {}
+    for u in User.query.all():
+        first_timestamps[u] = db.session.query(stored) \
+            .filter(stored.c.user_id == u.id) \
+            .order_by(stored.c.timestamp) \
+            .first().timestamp
+    MatchRating.query.delete()
+    Rating.query.delete()
+    CurrentRating.query.delete()
+    db.session.commit()
+    for u, t in first_timestamps.items():
+        init_ratings(u, t)
+    for m in Match.query.order_by(Match.timestamp, Match.id).all():
+        update_match_ratings(m)
+    expected = snapshot()
+
+    recalculate_ratings()
+    assert snapshot() == expected
+
+    recalculate_ratings(after_time=start + timedelta(minutes=2))
+    assert snapshot() == expected
+
+
+def test_current_rating_table(many_matches_db):
+    from app import db
+    from app.models import User, CurrentRating, Match, rating_rows
+    from app.tasks import delete_match, make_new_match, approve_match
+    stored = rating_rows()
+
+    def assert_current_matches_history():
+        for u in User.query.all():
+            for rating_type in ['elo', 'trueskill_mu', 'trueskill_sigma',
+                    'goal_difference']:
+                ratings = db.session.query(stored) \
+                    .filter(stored.c.user_id == u.id) \
+                    .filter(stored.c.rating_type == rating_type) \
+                    .order_by(stored.c.timestamp.desc(),
+                        stored.c.id.desc()) \
+                    .all()
+                current = CurrentRating.query.get((u.id, rating_type))
+                assert current.rating_value == ratings[0].rating_value
+                assert current.number_matches == len(
+                    [r for r in ratings if r.match_id is not None])
+
+    u1, u2 = User.query.all()
+    assert_current_matches_history()
+    assert u1.get_current_number_matches_approved() == 23
+
+    m = make_new_match(winners=[u2], losers=[u1], w_score=10, l_score=2,
+        importance=16, user_creating_match=u2)
+    # Not approved yet
+    assert u1.get_current_number_matches_approved() == 23
+    approve_match(m, u1)
+    assert u1.get_current_number_matches_approved() == 24
+    assert_current_matches_history()
+
+    delete_match(Match.query.first())
+    assert u1.get_current_number_matches_approved() == 23
+    assert_current_matches_history()
+
+
+@pytest.mark.parametrize('sorting', [
+    'elo', 'trueskill', 'goal_difference', 'matches_played'])
+def test_leaderboard(filled_db, sorting):
+    from app.models import User, Company
+    from app.tasks import create_user, make_new_match, approve_match
+    from app.leaderboard import get_leaderboard
+
+    u1, u2 = User.query.all()
+    company = u1.company
+    u3 = create_user('u3', 'Three', password='123', company=company)
+    u4 = create_user('u4', 'Four', password='123', company=company)
+    create_user('u5', 'No matches', password='123', company=company)
+    for winners, losers in [([u1], [u3]), ([u4], [u1]), ([u4], [u3])]:
+        m = make_new_match(winners=winners, losers=losers, w_score=10,
+            l_score=3, importance=16, user_creating_match=winners[0])
+        approve_match(m, losers[0])
+
+    # Same ranking as sorting the users in python
+    users = User.query.filter_by(company_id=company.id).all()
+    users = [u for u in users if u.get_current_number_matches_approved() > 0]
+    users = sorted(users, key=lambda u: u.get_current_rating(rating_type=sorting),
+        reverse=True)
+    rows = get_leaderboard(company.id, sorting=sorting)
+    assert [r.user_id for r in rows] == [u.id for u in users]
+    assert [r.rating for r in rows] == pytest.approx(
+        [u.get_current_rating(rating_type=sorting) for u in users])
+    assert rows[0].rank == 1
+    assert str(rows[0]) == str(users[0])
+
+    # Top-N and paging
+    assert get_leaderboard(company.id, sorting=sorting, limit=2) == rows[:2]
+    assert get_leaderboard(company.id, sorting=sorting, limit=2, page=2) == rows[2:]
+
+    # Other companies are not included
+    assert [r.user_id for r in get_leaderboard(u2.company_id)] == [u2.id]
+
+    with pytest.raises(AssertionError):
+        get_leaderboard(company.id, sorting='not-a-sorting')
+
+
+def test_partial_recalculation(filled_db, monkeypatch):
+    from datetime import datetime, timedelta
+    from app import db, tasks
+    from app.models import User, Match, CurrentRating, rating_rows
+    from app.tasks import (create_user, make_new_match, approve_match,
+        delete_match, recalculate_ratings)
+    stored = rating_rows()
+    # Replayed matches are deleted over several statements
+    monkeypatch.setattr(tasks, 'DELETE_CHUNK_SIZE', 1)
+
+    u1, u2 = User.query.all()
+    u3 = create_user('u3', 'Three', password='123', company=u1.company)
+    u4 = create_user('u4', 'Four', password='123', company=u2.company)
+    u5 = create_user('u5', 'Five', password='123', company=u2.company)
+    start = datetime.now()
+
+    def play(winners, losers, minutes):
+        m = make_new_match(winners=winners, losers=losers, w_score=10,
+            l_score=5, importance=16, user_creating_match=winners[0],
+            timestamp=start + timedelta(minutes=minutes))
+        approve_match(m, losers[0])
+        return m
+
+    play([u4], [u5], 1)
+    play([u3], [u1], 3)
+    play([u5], [u4], 4)
+    play([u2], [u3], 5)
+
+    def snapshot():
+        return {r.id: (r.user_id, r.match_id, r.rating_type, r.rating_value)
+            for r in db.session.query(stored).all()}
+
+    def values(ratings):
+        return sorted(ratings.values(), key=str)
+
+    # Backdated match between u1 and u2. It affects u3, who later played
+    # u1, but not u4 and u5.
+    before = snapshot()
+    m = play([u1], [u2], 2)
+    after = snapshot()
+    unchanged = {k: v for k, v in before.items() if v[0] in (u4.id, u5.id)}
+    assert unchanged.items() <= after.items()
+
+    # Same result as recalculating everything
+    recalculate_ratings()
+    assert values(snapshot()) == values(after)
+
+    delete_match(m)
+    after_delete = snapshot()
+    recalculate_ratings()
+    assert values(snapshot()) == values(after_delete)
+    assert db.session.query(stored).filter_by(match_id=m.id).all() == []
+    assert u1.get_current_number_matches_approved() == 4
+
+
+def test_rating_checkpoints(many_matches_db, monkeypatch):
+    from app import app, db
+    from app.models import Match, RatingCheckpoint, rating_rows
+    from app.checkpoints import rebuild_checkpoints, latest_checkpoint
+    from app.tasks import recalculate_ratings, approve_match
+    stored = rating_rows()
+
+    def snapshot():
+        return sorted(
+            ((r.user_id, r.match_id, r.rating_type, r.rating_value)
+            for r in db.session.query(stored).all()), key=str)
+
+    expected = snapshot()
+    monkeypatch.setitem(app.config, 'RATING_CHECKPOINT_SPACING', 5)
+    checkpoints = rebuild_checkpoints()
+    # 23 approved matches
+    assert len(checkpoints) == 4
+    assert RatingCheckpoint.query.count() == 4
+
+    # Recalculating from a checkpoint gives the same ratings
+    matches = Match.query.order_by(Match.timestamp).all()
+    middle = matches[12].timestamp
+    checkpoint = latest_checkpoint(before=middle)
+    assert checkpoint.timestamp <= middle
+    recalculate_ratings(after_time=middle)
+    assert snapshot() == expected
+    assert RatingCheckpoint.query.count() == 4
+
+    def checkpoint_states():
+        return [(c.timestamp, sorted((r.user_id, r.rating_type,
+                r.rating_value, r.number_matches) for r in c.ratings))
+            for c in RatingCheckpoint.query.order_by(
+                RatingCheckpoint.timestamp)]
+
+    # Checkpoints after a match rewritten by a partial recalculation are
+    # rebuilt with it
+    states = checkpoint_states()
+    approve_match(matches[5], matches[5].losing_players[0])
+    assert checkpoint_states() == states
+    rebuild_checkpoints()
+    assert checkpoint_states() == states
+    recalculate_ratings(after_time=matches[3].timestamp)
+    assert snapshot() == expected
+
+
+def test_recalculation_jobs(filled_db, monkeypatch):
+    from app import app, db
+    from app.models import User, Match, RecalculationJob, rating_rows
+    from app.tasks import approve_match, delete_match, recalculate_ratings
+    from app.jobs import enqueue_recalculation, run_pending_jobs
+    stored = rating_rows()
+
+    def snapshot():
+        return sorted(
+            ((r.user_id, r.match_id, r.rating_type, r.rating_value)
+            for r in db.session.query(stored).all()), key=str)
+
+    expected = snapshot()
+    u1, u2 = User.query.all()
+    m1, m2, m3 = Match.query.order_by(Match.timestamp).all()
+
+    # Leave jobs in the queue
+    monkeypatch.setitem(app.config, 'RATING_JOBS_WORKER', 'none')
+    m1_time, m2_time = m1.timestamp, m2.timestamp
+    delete_match(m2, recalculate=False)
+    job = enqueue_recalculation(after_time=m2_time, user_ids=[u1.id])
+    merged = enqueue_recalculation(after_time=m1_time, user_ids=[u2.id])
+    assert merged.id == job.id
+    assert RecalculationJob.query.count() == 1
+    assert job.status == 'queued'
+    assert job.after_time == m1_time
+    assert job.get_user_ids() == [u1.id, u2.id]
+
+    finished = run_pending_jobs()
+    assert [j.id for j in finished] == [job.id]
+    assert job.status == 'done'
+    assert job.progress == 1
+    assert run_pending_jobs() == []
+    after_delete = snapshot()
+    assert after_delete != expected
+    recalculate_ratings()
+    assert snapshot() == after_delete
+
+    # A full recalculation swallows a partial one
+    enqueue_recalculation(after_time=m3.timestamp, user_ids=[u1.id])
+    job = enqueue_recalculation()
+    assert job.after_time is None
+    assert job.get_user_ids() is None
+    run_pending_jobs()
+    assert job.status == 'done'
+    assert snapshot() == after_delete
+
+    # A job claimed while a new recalculation is merged into it keeps its
+    # parameters, and the new recalculation gets a job of its own
+    from app import jobs
+    claimed = enqueue_recalculation(after_time=m3.timestamp,
+        user_ids=[u1.id])
+    merge_after_time = jobs._merge_after_time
+
+    def claim_first(a, b):
+        RecalculationJob.query.filter_by(id=claimed.id) \
+            .update(dict(status='running'), synchronize_session=False)
+        return merge_after_time(a, b)
+
+    monkeypatch.setattr(jobs, '_merge_after_time', claim_first)
+    job = enqueue_recalculation(after_time=m1_time, user_ids=[u2.id])
+    monkeypatch.setattr(jobs, '_merge_after_time', merge_after_time)
+    assert job.id != claimed.id
+    assert (job.status, job.after_time, job.get_user_ids()) \
+        == ('queued', m1_time, [u2.id])
+    db.session.refresh(claimed)
+    assert (claimed.status, claimed.after_time, claimed.get_user_ids()) \
+        == ('running', m3.timestamp, [u1.id])
+    claimed.status = 'done'
+    db.session.commit()
+    run_pending_jobs()
+    assert job.status == 'done'
+    assert snapshot() == after_delete
+
+    # A running job with a recent heartbeat holds the queue, one whose
+    # heartbeat stopped is failed
+    from datetime import timedelta
+    from app.jobs import HEARTBEAT_TIMEOUT
+    from app.models import copenhagen_now
+    now = copenhagen_now()
+    running = RecalculationJob(status='running',
+        started=now - 2 * HEARTBEAT_TIMEOUT, heartbeat=now)
+    db.session.add(running)
+    db.session.commit()
+    queued = enqueue_recalculation()
+    assert run_pending_jobs() == []
+    assert running.status == 'running'
+    assert queued.status == 'queued'
+
+    running.heartbeat = now - HEARTBEAT_TIMEOUT - timedelta(minutes=1)
+    db.session.commit()
+    assert [j.id for j in run_pending_jobs()] == [queued.id]
+    db.session.refresh(running)
+    assert running.status == 'failed'
+    assert queued.status == 'done'
+    assert queued.heartbeat is not None
+
+
+def test_rating_writer(filled_db):
+    from sqlalchemy import event
+    from app import db
+    from app.models import User, MatchRating, rating_rows
+    from app.replay import ReplayEngine
+    from app.tasks import (create_user, make_new_match, approve_match,
+        update_match_ratings)
+    stored = rating_rows()
+
+    u1, u2 = User.query.all()
+    u3 = create_user('u3', 'Three', password='123', company=u1.company)
+    u4 = create_user('u4', 'Four', password='123', company=u1.company)
+
+    m = make_new_match(winners=[u1, u3], losers=[u2, u4], w_score=10,
+        l_score=4, importance=16, user_creating_match=u1)
+    session = db.session()
+    commits = []
+
+    def count_commit(session):
+        commits.append(session)
+
+    event.listen(session, 'after_commit', count_commit)
+    try:
+        approve_match(m, u2)
+    finally:
+        event.remove(session, 'after_commit', count_commit)
+    # The approval and all 16 ratings in one transaction
+    assert len(commits) == 1
+    assert db.session.query(stored).filter_by(match_id=m.id).count() == 16
+    # Stored as one row per player
+    assert MatchRating.query.filter_by(match_id=m.id).count() == 4
+
+    # Rating two matches with one writer reads the pending ratings of the
+    # first match
+    u1_elo = u1.get_current_elo()
+    writer = ReplayEngine()
+    matches = [make_new_match(winners=[u1], losers=[u2], w_score=10,
+        l_score=i, importance=16) for i in range(2)]
+    for match in matches:
+        match.approved_winner, match.approved_loser = True, True
+        update_match_ratings(match, writer)
+    assert writer.get(u1.id, 'elo') > u1_elo
+    assert len(writer.new_ratings) == 2 * 8
+    writer.write()
+    db.session.commit()
+    elos = [r.rating_value for r in db.session.query(stored)
+        .filter_by(user_id=u1.id, rating_type='elo').order_by(stored.c.id)]
+    assert elos[-2] < elos[-1] == u1.get_current_elo()
+    assert u1.get_current_number_matches_approved() == 6
+
+
+def test_rating_system_registry(filled_db, monkeypatch):
+    from app import ratings
+    from app.forms import ChooseLeaderboardSorting
+    from app.leaderboard import get_leaderboard
+    from app.models import User, Rating
+    from app.tasks import recalculate_ratings
+
+    u1, u2 = User.query.all()
+    for system in ratings.rating_systems():
+        rows = get_leaderboard(u1.company_id, sorting=system.name)
+        assert rows[0].rating == u1.get_current_rating(system.name)
+    assert ChooseLeaderboardSorting().sorting.choices \
+        == ratings.rating_type_choices()
+
+    class Wins(ratings.RatingSystem):
+        name = 'wins'
+        label = 'Wins'
+        fields = {'wins': 0}
+
+        def play(self, writer, match):
+            for p in match.winners:
+                writer.add_rating(p, 'wins', writer.get(p, 'wins') + 1,
+                    match.timestamp, match.id)
+
+        def score(self, state):
+            return state['wins']
+
+    monkeypatch.setattr(ratings, 'RATING_SYSTEMS',
+        ratings.RATING_SYSTEMS.copy())
+    ratings.register(Wins)
+    recalculate_ratings()
+    assert Rating.query.filter_by(rating_type='wins').count() == 3
+    assert u1.get_current_rating('wins') == 2
+    assert u2.get_current_rating('wins') == 1
+    rows = get_leaderboard(u2.company_id, sorting='wins')
+    assert [row.rating for row in rows] == [1]
+
+    # A system without a score can't be registered
+    class Losses(ratings.RatingSystem):
+        name = 'losses'
+        fields = {'losses': 0}
+
+        def play(self, writer, match):
+            pass
+
+    with pytest.raises(TypeError):
+        ratings.register(Losses)
+    assert 'losses' not in ratings.RATING_SYSTEMS
+
+
+def test_rating_candles(many_matches_db):
+    from datetime import datetime, timedelta
+    import numpy as np
+    import pandas as pd
+    from app import db
+    from app.models import User, Match, RatingCandle
+    from app.candles import get_candles, rebuild_candles
+    from app.plots import get_ratings, candles_frame
+    from app.tasks import make_new_match, approve_match, recalculate_ratings
+
+    u1, u2 = User.query.all()
+    # Spread the matches over a few weeks
+    start = datetime(2026, 9, 1, 12)
+    for i, m in enumerate(Match.query.order_by(Match.timestamp).all()):
+        m.timestamp = start + timedelta(days=i // 2, hours=i)
+    db.session.commit()
+    recalculate_ratings()
+    m = make_new_match(winners=[u2], losers=[u1], w_score=10, l_score=8,
+        importance=16, user_creating_match=u2,
+        timestamp=start + timedelta(days=20))
+    approve_match(m, u1)
+
+    def resampled(source, resample_interval):
+        # Candles as resampled from the full history
+        resampled = source.set_index('date').rating.resample(resample_interval)
+        df = resampled.last().to_frame('close')
+        df['high'] = resampled.max()
+        df['low'] = resampled.min()
+        df['open'] = resampled.first()
+        df.close = df.close.ffill()
+        df = df.fillna(axis='columns', method='ffill')
+        open_series = df.close.shift()
+        open_series[0] = df.open[0]
+        df.open = open_series
+        df.low = np.minimum(df.low, df.open)
+        df.high = np.maximum(df.high, df.open)
+        return df[['open', 'high', 'low', 'close']]
+
+    def check_candles():
+        for user in [u1, u2]:
+            source = get_ratings(user.shortname, 'elo')
+            for interval in ['D', 'W']:
+                candles = get_candles(user.id, 'elo', interval)
+                assert sum(c.number_ratings for c in candles) == len(source)
+                pd.testing.assert_frame_equal(
+                    candles_frame(candles, interval)[
+                        ['open', 'high', 'low', 'close']],
+                    resampled(source, interval), check_freq=False,
+                    check_names=False)
+
+    # Kept up to date as matches are rated
+    check_candles()
+    incremental = sorted(
+        (c.user_id, c.rating_type, c.interval, c.bucket, c.open, c.high,
+         c.low, c.close) for c in RatingCandle.query.all())
+    rebuild_candles()
+    db.session.commit()
+    assert sorted(
+        (c.user_id, c.rating_type, c.interval, c.bucket, c.open, c.high,
+         c.low, c.close) for c in RatingCandle.query.all()) == incremental
+
+    # Backdated match rewrites the following candles
+    m = make_new_match(winners=[u2], losers=[u1], w_score=10, l_score=0,
+        importance=32, user_creating_match=u2,
+        timestamp=start + timedelta(days=3, hours=1))
+    approve_match(m, u1)
+    check_candles()
+
+
+def test_user_rating_cache(filled_db):
+    from sqlalchemy import event
+    from app import db
+    from app.models import User, CurrentRating, rating_rows
+    from app.tasks import make_new_match, approve_match
+    stored = rating_rows()
+
+    u1, u2 = User.query.all()
+    queries = []
+
+    def count_query(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        elo = u1.get_current_elo()
+        trueskill = u1.get_current_trueskill()
+        assert u1.get_current_trueskill() == trueskill
+        u1.get_current_goal_difference()
+        u1.get_current_number_matches_approved()
+        u1.get_current_rating('trueskill')
+        # Every getter is served by the first query
+        assert len(queries) == 1
+        assert elo == CurrentRating.query.get((u1.id, 'elo')).rating_value
+
+        # One query for the ratings of all matches
+        matches = u1.matches
+        del queries[:]
+        u1.load_match_rating_values(matches)
+        values = [u1.get_match_rating_value(m) for m in matches]
+        assert len(queries) == 1
+        assert values == [db.session.query(stored).filter_by(user_id=u1.id,
+            match_id=m.id, rating_type='elo').one().rating_value
+            for m in u1.matches]
+
+        # Writing ratings clears the cache
+        m = make_new_match(winners=[u1], losers=[u2], w_score=10, l_score=0,
+            importance=16, user_creating_match=u1)
+        assert u1.get_match_rating_value(m) == 0
+        approve_match(m, u2)
+        assert u1.get_current_elo() > elo
+        assert u1.get_current_number_matches_approved() == 4
+        assert u1.get_match_rating_value(m) == u1.get_current_elo()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+
+
+def test_profile_stats(filled_db):
+    import random
+    from datetime import datetime, timedelta
+    from app.models import User
+    from app.stats import profile_stats
+    from app.tasks import make_new_match, create_user
+
+    u1, u2 = User.query.all()
+
+    def expected_stats(user):
+        results = ['W' if user in m.winning_players else 'L'
+            for m in sorted(user.matches, key=lambda m: (m.timestamp, m.id))]
+        runs = ''.join(results).split('L')
+        wins = results.count('W')
+        return (wins, len(results) - wins, len(runs[-1]),
+            max(len(run) for run in runs), results[-10:])
+
+    rng = random.Random(1)
+    start = datetime(2020, 1, 1)
+    for i in range(60):
+        winners, losers = rng.choice([([u1], [u2]), ([u2], [u1])])
+        # Some matches share a timestamp
+        make_new_match(winners=winners, losers=losers, w_score=10,
+            l_score=rng.randint(0, 9), importance=16,
+            timestamp=start + timedelta(hours=rng.randint(0, 40)))
+    for user in [u1, u2]:
+        stats = profile_stats(user.id)
+        wins, losses, current, best, form = expected_stats(user)
+        assert (stats.wins, stats.losses) == (wins, losses)
+        assert stats.winrate == 100 * wins / (wins + losses)
+        assert (stats.current_streak, stats.best_streak) == (current, best)
+        assert stats.form == form
+        assert user.get_winstreak() == current
+
+    new_user = create_user('u3', 'Three', password='123', company=None)
+    assert profile_stats(new_user.id) == (0, 0, None, 0, 0, [])
+
+
+def test_import_matches(filled_db, tmp_path):
+    import json
+    from datetime import datetime
+    from app import app
+    from app.models import User, Match, CurrentRating
+    from app.tasks import create_user, recalculate_ratings
+
+    u1, u2 = User.query.all()
+    u3 = create_user('u3', 'Three', password='123', company=u1.company)
+    # The commands remove the session, so only keep the ids
+    u2_id, u3_id = u2.id, u3.id
+    path = tmp_path / 'matches.csv'
+    path.write_text(
+        'winners,losers,winner_score,loser_score,importance,timestamp,'
+        'approved_winner,approved_loser\n'
+        'KASPER U3,FELIPE,10,5,16,2018-01-02T10:00:00,1,1\n'
+        'felipe,u3,10,2,,2018-01-01 09:00:00,,\n'
+        'KASPER,NOBODY,10,5,16,2018-01-03T10:00:00,1,1\n'
+        'KASPER,FELIPE,5,10,16,2018-01-03T10:00:00,1,1\n'
+        'KASPER,FELIPE,10,5,16,2018-01-04T10:00:00,1,0\n'
+        'KASPER,KASPER,10,5,16,2018-01-04T10:00:00,1,1\n'
+        'KASPER,FELIPE,10,5,16,yesterday,1,1\n'
+        'kasper KASPER,FELIPE,10,5,16,2018-01-05T10:00:00,1,1\n')
+    n_matches = Match.query.count()
+
+    result = app.test_cli_runner().invoke(args=['import-matches', str(path),
+        '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Imported 3 matches, skipped 5 rows' in result.output
+    for line in [4, 5, 7, 8, 9]:
+        assert f'Line {line}: ' in result.output
+    assert Match.query.count() == n_matches + 3
+    unapproved = Match.query.filter_by(approved_loser=False).one()
+    assert unapproved.timestamp == datetime(2018, 1, 4, 10)
+    assert not unapproved.ratings
+
+    # The players joined before their first imported match, and the import
+    # was replayed like any other match
+    first = Match.query.order_by(Match.timestamp).first()
+    assert first.timestamp == datetime(2018, 1, 1, 9)
+    assert {r.user_id for r in first.ratings} == {u2_id, u3_id}
+    current = {(c.user_id, c.rating_type): c.rating_value
+        for c in CurrentRating.query}
+    recalculate_ratings()
+    assert current == {(c.user_id, c.rating_type): c.rating_value
+        for c in CurrentRating.query}
+    assert User.query.get(u3_id).get_current_number_matches_approved() == 2
+
+    # JSONL, without recalculating
+    path = tmp_path / 'matches.jsonl'
+    path.write_text('\n'.join([
+        json.dumps(dict(winners=['u3'], losers=['kasper'], winner_score=10,
+            loser_score=0, timestamp='2018-02-01T10:00:00')),
+        '{not json',
+        json.dumps(dict(winners=3, losers=['kasper'], winner_score=10,
+            loser_score=0, timestamp='2018-02-01T10:00:00')),
+    ]))
+    result = app.test_cli_runner().invoke(args=['import-matches', str(path),
+        '--no-recalculate'])
+    assert 'Imported 1 matches, skipped 2 rows' in result.output
+    assert 'Recalculate ratings from 2018-02-01 10:00:00' in result.output
+    assert User.query.get(u3_id).get_current_number_matches_approved() == 2
+
+
+def test_export(many_matches_db):
+    import csv
+    import io
+    import json
+    from app import app, db
+    from app.models import User, Match, Company, rating_rows
+    from app.exports import export_rows, export
+    from app.tasks import create_user, create_company, make_new_match
+    stored = rating_rows()
+
+    u1, u2 = User.query.all()
+    c3 = create_company('Company THREE')
+    u3 = create_user('u3', 'Three', password='123', company=c3)
+    u4 = create_user('u4', 'Four', password='123', company=c3)
+    make_new_match(winners=[u3], losers=[u4], w_score=10, l_score=3,
+        importance=16, user_creating_match=u3)
+
+    columns, rows = export_rows('ratings')
+    assert columns == ['id', 'user_id', 'shortname', 'match_id',
+        'rating_type', 'rating_value', 'timestamp']
+    ratings = db.session.query(stored) \
+        .order_by(stored.c.timestamp, stored.c.id).all()
+    assert [row.id for row in rows] == [r.id for r in ratings]
+
+    # Filters
+    company_user_ids = {u.id for u in u1.company.users}
+    elo = [r for r in ratings if r.rating_type == 'elo'
+        and r.user_id in company_user_ids]
+    after, before = elo[3].timestamp, elo[10].timestamp
+    columns, rows = export_rows('ratings', company_id=u1.company_id,
+        rating_type='elo', after=after, before=before)
+    assert [row.id for row in rows] == [r.id for r in elo[3:10]]
+    columns, rows = export_rows('matches', company_id=c3.id)
+    assert [row.id for row in rows] == [Match.query.all()[-1].id]
+    columns, rows = export_rows('user_matches', company_id=c3.id)
+    assert sorted((row.shortname, row.win) for row in rows) == [
+        ('U3', True), ('U4', False)]
+
+    # Formats
+    lines = ''.join(export('matches', 'jsonl')).splitlines()
+    matches = Match.query.order_by(Match.timestamp, Match.id).all()
+    assert len(lines) == len(matches)
+    assert json.loads(lines[0]) == dict(id=matches[0].id,
+        timestamp=matches[0].timestamp.isoformat(),
+        winner_score=matches[0].winner_score,
+        loser_score=matches[0].loser_score,
+        importance=matches[0].importance, approved_winner=True,
+        approved_loser=True)
+    rows = list(csv.DictReader(io.StringIO(''.join(
+        export('user_matches', 'csv')))))
+    assert len(rows) == 2 * len(matches)
+    assert rows[0]['shortname'] == 'KASPER'
+
+    result = app.test_cli_runner().invoke(args=['export', 'ratings',
+        '--format', 'jsonl', '--rating-type', 'goal_difference'])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert len(lines) == len([r for r in ratings
+        if r.rating_type == 'goal_difference'])
+    assert {json.loads(line)['rating_type'] for line in lines} \
+        == {'goal_difference'}
+
+
+def test_parallel_recalculation(filled_db, monkeypatch):
+    from datetime import datetime, timedelta
+    from app import app, db
+    from app.models import CurrentRating, rating_rows
+    from app.replay import connected_components, load_matches
+    from app.tasks import (create_company, create_user, make_new_match,
+        approve_match, recalculate_ratings)
+    stored = rating_rows()
+
+    start = datetime.now()
+    leagues = []
+    for c in range(3):
+        company = create_company(f'League {c}')
+        users = [create_user(f'p{c}{i}', f'P{c}{i}', password='123',
+            company=company) for i in range(4)]
+        leagues.append([u.id for u in users])
+        for i in range(6):
+            a, b, x, y = users[i % 4], users[(i + 1) % 4], users[(i + 2) % 4], \
+                users[(i + 3) % 4]
+            winners, losers = ([a], [b]) if i % 2 else ([a, x], [b, y])
+            m = make_new_match(winners=winners, losers=losers, w_score=10,
+                l_score=i, importance=16, user_creating_match=winners[0],
+                timestamp=start + timedelta(minutes=10 * i + c))
+            approve_match(m, losers[0])
+
+    components = connected_components(load_matches())
+    players = [sorted({p for m in component for p in m.winners + m.losers})
+        for component in components]
+    # The two players of `filled_db` and the three leagues
+    assert len(components) == 4
+    assert all(sorted(league) in players for league in leagues)
+
+    def snapshot():
+        return (
+            sorted((r.user_id, r.match_id or 0, r.rating_type, r.timestamp,
+                r.rating_value) for r in db.session.query(stored).all()),
+            sorted((r.user_id, r.rating_type, r.rating_value, r.timestamp,
+                r.number_matches) for r in CurrentRating.query.all()),
+        )
+
+    recalculate_ratings()
+    serial = snapshot()
+    monkeypatch.setitem(app.config, 'RATING_REPLAY_PROCESSES', 2)
+    fractions = []
+    recalculate_ratings(progress=fractions.append)
+    assert snapshot() == serial
+    assert fractions[-1] == 1
+
+    recalculate_ratings(after_time=start + timedelta(minutes=25))
+    assert snapshot() == serial
+
+
+def test_generate_league(empty_db):
+    from app import db
+    from app.models import User, Match, UserMatch, CurrentRating
+    from benchmarks.league import generate_league
+
+    def matches():
+        return [(m.timestamp, sorted((p.user_id, p.win)
+                for p in UserMatch.query.filter_by(match_id=m.id)))
+            for m in Match.query.order_by(Match.id)]
+
+    league = generate_league(users=10, companies=2, matches=60,
+        doubles=0.5, backdated=0.2, seed=1)
+    assert len(league.user_ids) == 10 and len(league.match_ids) == 60
+    generated = matches()
+    # Players only play within their company
+    company = dict(db.session.query(User.id, User.company_id))
+    for _, players in generated:
+        assert len({company[p] for p, _ in players}) == 1
+    assert {len(players) for _, players in generated} == {2, 4}
+    timestamps = [timestamp for timestamp, _ in generated]
+    assert timestamps != sorted(timestamps)
+    # Every player is rated
+    assert CurrentRating.query.filter_by(rating_type='elo').count() == 10
+
+    # The same arguments give the same league
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    generate_league(users=10, companies=2, matches=60, doubles=0.5,
+        backdated=0.2, seed=1)
+    assert matches() == generated
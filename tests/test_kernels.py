@@ -0,0 +1,63 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+
+
+def synthetic_matches(n_matches, n_players, seed=0):
+    from app.replay import ReplayMatch
+    rng = random.Random(seed)
+    start = datetime(2019, 1, 1)
+    matches = []
+    for i in range(n_matches):
+        team_size = rng.choice([1, 2])
+        players = rng.sample(range(1, n_players + 1), 2 * team_size)
+        # Some uneven teams
+        if team_size == 2 and rng.random() < 0.1:
+            players = players[:3]
+        matches.append(ReplayMatch(
+            id=i + 1,
+            timestamp=start + timedelta(minutes=i),
+            winner_score=10,
+            loser_score=rng.randint(0, 9),
+            importance=rng.choice([8, 16, 32]),
+            winners=players[:team_size],
+            losers=players[team_size:],
+        ))
+    return matches
+
+
+def by_player(new_ratings):
+    # Each rating system adds its ratings separately, so only the order per
+    # player and rating type is kept
+    return sorted(new_ratings, key=lambda r: (r['user_id'], r['rating_type']))
+
+
+def test_kernels_match_scalar_replay(test_client):
+    from app.replay import ReplayEngine
+
+    matches = synthetic_matches(500, 12)
+    scalar, vectorized = ReplayEngine(), ReplayEngine()
+    for engine in [scalar, vectorized]:
+        for user_id in range(1, 13):
+            engine.init_player(user_id, datetime(2018, 1, 1))
+    for match in matches:
+        scalar.play(match)
+    vectorized.play_all(matches)
+
+    # Exactly the same values, in the same order
+    assert by_player(vectorized.new_ratings) == by_player(scalar.new_ratings)
+    assert vectorized.current_ratings() == scalar.current_ratings()
+
+
+def test_kernels_fall_back_for_newer_ratings(test_client):
+    from app.replay import ReplayEngine
+
+    matches = synthetic_matches(20, 4)
+    scalar, vectorized = ReplayEngine(), ReplayEngine()
+    for engine in [scalar, vectorized]:
+        # Player 1 has a rating newer than some of its matches
+        engine.init_player(1, matches[10].timestamp)
+    for match in matches:
+        scalar.play(match)
+    vectorized.play_all(matches)
+    assert by_player(vectorized.new_ratings) == by_player(scalar.new_ratings)
@@ -0,0 +1,115 @@
+import pytest
+from datetime import datetime, timedelta
+
+
+def test_load_rating_history(many_matches_db):
+    import numpy as np
+    from app import db
+    from app.models import User, rating_rows
+    from app.history import load_rating_history
+
+    u1, u2 = User.query.all()
+    histories = load_rating_history([u1.id, u2.id],
+        ['elo', 'goal_difference', 'not_a_type'])
+    assert len(histories) == 6
+    for (user_id, rating_type), history in histories.items():
+        stored = rating_rows()
+        ratings = db.session.query(stored).filter_by(user_id=user_id,
+            rating_type=rating_type).order_by(stored.c.timestamp,
+            stored.c.id).all()
+        assert history.value.tolist() == [r.rating_value for r in ratings]
+        assert history.timestamp.tolist() == [r.timestamp for r in ratings]
+        assert [None if np.isnan(m) else int(m)
+            for m in history.match_id.tolist()] \
+            == [r.match_id for r in ratings]
+
+    # Time window
+    elo = histories[(u1.id, 'elo')]
+    after, before = elo.timestamp[3].item(), elo.timestamp[10].item()
+    window = load_rating_history([u1.id], ['elo'], after=after,
+        before=before)[(u1.id, 'elo')]
+    assert window.value.tolist() == elo.value[3:10].tolist()
+
+
+def test_hover_text(many_matches_db):
+    import pandas as pd
+    from app.models import User
+    from app.candles import get_candles
+    from app.plots import (get_ratings, get_scatter_plot,
+        get_candlestick_plot, candles_frame)
+
+    u1, u2 = User.query.all()
+    source = get_ratings(u1.shortname, 'elo')
+    source.loc[3, 'rating'] = -0.4
+    source.loc[0, 'date'] = datetime(2026, 3, 5, 7, 8, 9)
+    expected = []
+    for index, row in source.iterrows():
+        match_id = row['match_id']
+        if pd.isnull(match_id):
+            match_id = 0
+        expected.append((
+            "Match ID: {match_id}<br>"+
+            "Time: {date}<br>"+
+            "Rating: {rating}<br>").format(
+                match_id = format(match_id, "1.0f"),
+                date = row["date"].ctime(),
+                rating = format(row["rating"], "1.0f")
+            ))
+    assert list(get_scatter_plot(source).text) == expected
+
+    candles = get_candles(u1.id, 'elo', 'D')
+    df = candles_frame(candles, 'D')
+    expected = [(
+        "Open: {open_v}<br>"+
+        "High: {high}<br>"+
+        "Low: {low}<br>"+
+        "Close: {close}<br>").format(
+            open_v = format(row["open"], "1.0f"),
+            high = format(row["high"], "1.0f"),
+            low = format(row["low"], "1.0f"),
+            close = format(row["close"], "1.0f"),
+        ) for index, row in df.iterrows()]
+    assert list(get_candlestick_plot(candles, 'D').text) == expected
+
+
+def test_plot_without_ratings(filled_db):
+    from app import db
+    from app.models import User
+    from app.plots import get_ratings, get_scatter_plot, plot_ratings
+
+    # A player without matches or any ratings
+    user = User(shortname='NR', nickname='No ratings', company_id=None)
+    db.session.add(user)
+    db.session.commit()
+    source = get_ratings(user.shortname, 'elo')
+    assert source.empty
+    assert len(get_scatter_plot(source).x) == 0
+    assert '<div' in plot_ratings(user.shortname, 'elo', 'D')
+
+
+def test_rating_comparison(many_matches_db):
+    import numpy as np
+    import pandas as pd
+    from app.models import User
+    from app.plots import get_ratings, rating_comparison
+
+    u1, u2 = User.query.all()
+    frame = rating_comparison([u2.id, u1.id], 'elo', 'D')
+    assert list(frame.columns) == [u2.id, u1.id]
+    for user in [u1, u2]:
+        source = get_ratings(user.shortname, 'elo')
+        expected = source.set_index('date').rating.resample('D').last() \
+            .ffill()
+        pd.testing.assert_series_equal(frame[user.id].dropna(), expected,
+            check_names=False, check_freq=False)
+
+    # Merged buckets keep the latest rating
+    frame = rating_comparison([u1.id, u2.id], 'elo', 'D', n_points=1)
+    assert len(frame) == 1
+    assert frame.iloc[0].tolist() == [u1.get_current_elo(),
+        u2.get_current_elo()]
+
+    # Users without ratings get an empty column
+    frame = rating_comparison([u1.id, 12345], 'elo', 'W')
+    assert np.isnan(frame[12345]).all()
+    assert rating_comparison([12345], 'elo').empty
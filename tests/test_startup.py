@@ -0,0 +1,15 @@
+import pytest
+
+# Generous, to catch a heavy import creeping back rather than noise
+STARTUP_BUDGET_MS = 3000
+
+
+def test_startup_import_time():
+    from benchmarks.bench_startup import import_times, HEAVY_MODULES
+    times = import_times('app')
+    assert [name for name in HEAVY_MODULES if name in times] == []
+    # Imported when needed
+    assert 'app.plots' not in times
+    assert 'app.kernels' not in times
+    assert times['app'].cumulative_us / 1000 < STARTUP_BUDGET_MS
+